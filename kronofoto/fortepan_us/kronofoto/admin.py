@@ -14,13 +14,18 @@ from django.utils.safestring import mark_safe
 from django.forms import widgets
 from fortepan_us.kronofoto.models import Photo, PhotoSphere, PhotoSpherePair, Tag, Term, PhotoTag, Donor, NewCutoff, CSVRecord, TermGroup, Place, PlaceType, Exhibit, PhotoSphereInfo, PhotoSphereTour, TourSetDescription
 from fortepan_us.kronofoto.models import donor
+from fortepan_us.kronofoto.models import IngestBatch, IngestItem, ImageHash
+from fortepan_us.kronofoto.ingest import ingest_batch, ingest_pool
 from fortepan_us.kronofoto.models.photosphere import MainStreetSet
 from mptt.admin import MPTTModelAdmin # type: ignore
 from fortepan_us.kronofoto.models.photo import Submission
 from fortepan_us.kronofoto.models.archive import Archive, ArchiveUserPermission, ArchiveAgreement, ArchiveGroupPermission
 from fortepan_us.kronofoto.models.category import Category, ValidCategory
 from fortepan_us.kronofoto.models.csvrecord import ConnecticutRecord
-from fortepan_us.kronofoto.forms import PhotoSphereAddForm, PhotoSphereChangeForm, PhotoSpherePairInlineForm, SubmissionForm, PhotoForm, PhotoSphereInfoInlineForm
+from fortepan_us.kronofoto.imageutil import DerivativePipeline
+from fortepan_us.kronofoto.remoteimages import RemoteImageError
+from PIL import Image
+from fortepan_us.kronofoto.forms import PhotoSphereAddForm, PhotoSphereChangeForm, PhotoSpherePairInlineForm, SubmissionForm, PhotoForm, PhotoSphereInfoInlineForm, BatchIngestForm
 from django.db.models import Count, Q, Exists, OuterRef, F, ManyToManyField, QuerySet, ForeignKey, Model, Manager
 from django.db import IntegrityError, router, transaction
 from django.db.models.options import Options
@@ -34,6 +39,7 @@ from collections import defaultdict
 from fortepan_us.kronofoto.auth.forms import FortepanAuthenticationForm
 from django.http import HttpRequest, HttpResponse, HttpResponseRedirect, JsonResponse
 from django.template.response import TemplateResponse
+from django.core.paginator import Paginator
 from typing import Any, Optional, Type, DefaultDict, Set, Dict, Callable, List, Tuple, TypedDict, Sequence, TYPE_CHECKING, TypeVar, Protocol, ContextManager, Union
 from django.urls import URLPattern
 if TYPE_CHECKING:
@@ -1047,7 +1053,7 @@ class AcceptanceFactory:
         if not self.admin.has_delete_permission(self.request, obj) or not self.user.has_perm('{}.archive.{}.{}'.format(self.photo_opts.app_label, obj.archive.slug, codename_add)) and not self.user.has_perm('{}.any.{}'.format(self.photo_opts.app_label, codename_add)):
             raise PermissionDenied
         else:
-            return SaveRecord(obj=obj, form=form)
+            return SaveRecord(obj=obj, form=form, request=self.request)
 
     def get_obj_responder(self, *, obj: Optional[Submission], form: "SubmissionAdmin.AcceptForm", codename_add: str) -> AdminCommunication:
         if not obj:
@@ -1133,10 +1139,28 @@ class SubmissionLogger:
     def response(self) -> HttpResponse:
         return self.action.response
 
+def render_derivatives(request: Optional[HttpRequest], photo: Photo, *, overwrite: bool = False) -> None:
+    """Render the JPEG derivatives and placeholder of a saved Photo.
+
+    An original that cannot be read or decoded does not fail the save. The
+    user is warned and the derivatives are rendered on their first request.
+    """
+    pipeline = DerivativePipeline.for_photo(photo)
+    if not pipeline:
+        return
+    try:
+        pipeline.run(cachers=pipeline.jpeg_cachers, overwrite=overwrite)
+    except (OSError, Image.DecompressionBombError, RemoteImageError) as e:
+        if request is not None:
+            messages.warning(request, "Resized images of {} could not be made now and will be made when first viewed: {}".format(photo, e), fail_silently=True)
+        return
+    pipeline.save_placeholder()
+
 @dataclass
 class SaveRecord:
     obj: Submission
     form: "SubmissionAdmin.AcceptForm"
+    request: Optional[HttpRequest] = None
 
     @property
     def photo(self) -> Photo:
@@ -1163,6 +1187,7 @@ class SaveRecord:
             is_featured=self.form.cleaned_data['is_featured'],
         )
         new_obj.save()
+        render_derivatives(self.request, new_obj)
         new_obj.terms.set(self.obj.terms.all())
         self.obj.image.delete(save=False)
         self.obj.delete()
@@ -1432,7 +1457,7 @@ class SubmissionAdmin(PhotoBaseAdmin):
 
 @admin.register(Photo)
 class PhotoAdmin(PhotoBaseAdmin):
-    readonly_fields = ['county', 'state', 'city', 'country', "h700_image"]
+    readonly_fields = ['county', 'state', 'city', 'country', "h700_image", "near_duplicates"]
     inlines = (TagInline,)
     list_filter = (TermFilter, TagFilter, YearIsSetFilter, IsPublishedFilter, HasGeoLocationFilter, HasLocationFilter, HasPlaceFilter)
     list_display = ('thumb_image', 'accession_number', 'donor', 'year', 'caption')
@@ -1453,6 +1478,7 @@ class PhotoAdmin(PhotoBaseAdmin):
         'license',
         'original',
         'h700_image',
+        'near_duplicates',
         'year',
         'circa',
         'photographer',
@@ -1480,6 +1506,11 @@ class PhotoAdmin(PhotoBaseAdmin):
         else:
             return ""
 
+    def save_model(self, request: HttpRequest, obj: Photo, form: Any, change: bool) -> None:
+        super().save_model(request, obj, form, change)
+        if 'original' in form.changed_data:
+            render_derivatives(request, obj, overwrite=change)
+
     def h700_image(self, obj: Photo) -> str:
         h700 = obj.h700
         if h700:
@@ -1487,6 +1518,27 @@ class PhotoAdmin(PhotoBaseAdmin):
         else:
             return "-"
 
+    @admin.display(description="Near duplicates")
+    def near_duplicates(self, obj: Photo) -> str:
+        try:
+            image_hash = obj.image_hash
+        except ImageHash.DoesNotExist:
+            return "-"
+        matches = image_hash.near_duplicates(settings.KF_DUPLICATE_DISTANCE)
+        photos = Photo.objects.select_related("archive").in_bulk([photo_id for photo_id, _ in matches])
+        links = [
+            (
+                reverse("admin:kronofoto_photo_change", args=(photo_id,)),
+                difference,
+                self.thumb_image(photos[photo_id]) or photos[photo_id].accession_number,
+            )
+            for photo_id, difference in matches
+            if photo_id in photos
+        ]
+        if not links:
+            return "-"
+        return format_html_join(" ", '<a href="{}" title="{} bits apart">{}</a>', links)
+
     def get_urls(self) -> List[URLPattern]:
         from django.urls import path
         def wrap(view: Callable[..., HttpResponse]) -> Callable[..., HttpResponse]:
@@ -1497,21 +1549,40 @@ class PhotoAdmin(PhotoBaseAdmin):
 
         info = self.model._meta.app_label, self.model._meta.model_name
         return [
+            path("duplicates", wrap(self.duplicates_view), name="{}_{}_duplicates".format(*info)),
             path("terms", wrap(self.terms_view), name="{}_{}_terms".format(*info)),
             path("batch_upload", wrap(self.batch_upload_view), name="{}_{}_batchupload".format(*info)),
+            path("batch_upload/<int:pk>", wrap(self.batch_progress_view), name="{}_{}_batchprogress".format(*info)),
         ] + super().get_urls()
 
     def batch_upload_view(self, request: HttpRequest) -> HttpResponse:
         if not self.has_add_permission(request):
             raise PermissionDenied
 
+        if request.method == "POST":
+            form = BatchIngestForm(request.POST, request.FILES)
+            if form.is_valid():
+                archive = form.cleaned_data['archive']
+                codename_add = get_permission_codename('add', self.opts)
+                if not (
+                    request.user.has_perm("{}.{}".format(self.opts.app_label, codename_add))
+                    or request.user.has_perm("{}.archive.{}.{}".format(self.opts.app_label, archive.slug, codename_add))
+                ):
+                    raise PermissionDenied
+                batch = form.save_batch(request.user if request.user.is_authenticated else None)
+                if settings.KF_INGEST_RUNNER == "thread":
+                    transaction.on_commit(lambda: ingest_pool().submit(ingest_batch, batch.id))
+                return HttpResponseRedirect(reverse("admin:kronofoto_photo_batchprogress", kwargs={"pk": batch.id}))
+        else:
+            form = BatchIngestForm()
+
         context = {
             **self.admin_site.each_context(request),
             "title": "Batch Photo Upload",
             "subtitle": None,
             "actions_on_top": self.actions_on_top,
             "actions_on_bottom": self.actions_on_bottom,
-            "photo_form": PhotoForm()
+            "photo_form": form,
         }
 
         return TemplateResponse(
@@ -1520,6 +1591,62 @@ class PhotoAdmin(PhotoBaseAdmin):
             context=context,
         )
 
+    def batch_progress_view(self, request: HttpRequest, pk: int) -> HttpResponse:
+        batch = get_object_or_404(IngestBatch.objects.all(), pk=pk)
+        if batch.user_id != request.user.id and not request.user.is_superuser:
+            raise PermissionDenied
+        context = {
+            **self.admin_site.each_context(request),
+            "title": "Batch Photo Upload Progress",
+            "subtitle": None,
+            "batch": batch,
+            "stalled": batch.stalled(),
+            "progress": batch.progress(),
+            "failures": batch.items.filter(state=IngestItem.State.FAILED).order_by("id"),
+        }
+        return TemplateResponse(
+            request=request,
+            template="admin/kronofoto/photo/batch-progress.html",
+            context=context,
+        )
+
+    def duplicates_view(self, request: HttpRequest) -> HttpResponse:
+        if not self.has_view_or_change_permission(request):
+            raise PermissionDenied
+        photos = self.get_queryset(request)
+        archive = request.GET.get("archive", "")
+        if archive:
+            photos = photos.filter(archive__slug=archive)
+        try:
+            distance = int(request.GET.get("distance", settings.KF_DUPLICATE_DISTANCE))
+        except ValueError:
+            distance = settings.KF_DUPLICATE_DISTANCE
+        distance = max(0, min(distance, settings.KF_DUPLICATE_DISTANCE))
+        hashes = ImageHash.objects.filter(photo__in=photos)
+        groups: List[List[int]] = []
+        hashed = hashes.count() if archive else 0
+        if archive and hashed <= settings.KF_DUPLICATE_ADMIN_LIMIT:
+            groups = hashes.index().groups(distance)
+        page = Paginator(groups, 50).get_page(request.GET.get("page"))
+        by_id = Photo.objects.select_related("archive").in_bulk([id for ids in page for id in ids])
+        context = {
+            **self.admin_site.each_context(request),
+            "title": "Near Duplicate Photos",
+            "subtitle": None,
+            "archive": archive,
+            "distance": distance,
+            "max_distance": settings.KF_DUPLICATE_DISTANCE,
+            "too_many": hashed > settings.KF_DUPLICATE_ADMIN_LIMIT,
+            "limit": settings.KF_DUPLICATE_ADMIN_LIMIT,
+            "page_obj": page,
+            "groups": [[by_id[id] for id in ids if id in by_id] for ids in page],
+        }
+        return TemplateResponse(
+            request=request,
+            template="admin/kronofoto/photo/duplicates.html",
+            context=context,
+        )
+
     def terms_view(self, request: HttpRequest) -> HttpResponse:
         if request.GET.get('archive', "") and request.GET.get("category", ""):
             vc = get_object_or_404(
@@ -0,0 +1,91 @@
+from django import forms
+from django.db.models import QuerySet
+from django.contrib.auth.models import User
+from typing import Any, List, Optional
+from fortepan_us.kronofoto.models import Category, Term, IngestBatch, IngestItem
+from fortepan_us.kronofoto.models.photo import Photo, get_original_path
+from .photobase import PhotoBaseForm
+
+BATCH_FIELDS = [
+    'archive',
+    'category',
+    'donor',
+    'license',
+    'year',
+    'circa',
+    'photographer',
+    'terms',
+    'place',
+    'address',
+    'city',
+    'county',
+    'state',
+    'country',
+    'caption',
+    'is_published',
+    'scanner',
+]
+
+
+class MultipleFileInput(forms.ClearableFileInput):
+    allow_multiple_selected = True
+
+
+class MultipleFileField(forms.FileField):
+    def __init__(self, *args: Any, **kwargs: Any):
+        kwargs.setdefault("widget", MultipleFileInput(attrs={"accept": "image/*"}))
+        super().__init__(*args, **kwargs)
+
+    def clean(self, data: Any, initial: Any = None) -> Any:
+        single_file_clean = super().clean
+        if isinstance(data, (list, tuple)):
+            if not data and self.required:
+                raise forms.ValidationError(self.error_messages["required"], code="required")
+            return [single_file_clean(d, initial) for d in data]
+        return [single_file_clean(data, initial)]
+
+
+class BatchIngestForm(PhotoBaseForm):
+    """Metadata shared by a batch of uploaded originals, and the originals.
+    Unreadable files are reported per file after the upload rather than
+    failing the form.
+    """
+    files = MultipleFileField()
+
+    class Meta:
+        model = Photo
+        fields = BATCH_FIELDS
+
+    def get_categories(self, instance: Optional[Photo]=None) -> QuerySet[Category]:
+        return Category.objects.all()
+
+    def get_terms(self, instance: Optional[Photo]) -> QuerySet[Term]:
+        return Term.objects.order_by('term')
+
+    def save_batch(self, user: Optional[User]) -> IngestBatch:
+        """Stream the uploaded files to storage and queue them.
+
+        Args:
+            user (User, optional): The uploader.
+
+        Returns:
+            IngestBatch: The queued batch.
+        """
+        defaults = {}
+        for name in BATCH_FIELDS:
+            field = Photo._meta.get_field(name)
+            if not field.many_to_many:
+                defaults[field.attname] = getattr(self.instance, field.attname)
+        batch = IngestBatch.objects.create(
+            user=user,
+            defaults=defaults,
+            terms=[term.id for term in self.cleaned_data.get('terms') or []],
+        )
+        storage = Photo._meta.get_field('original').storage
+        items: List[IngestItem] = []
+        for upload in self.cleaned_data['files']:
+            item = IngestItem(batch=batch, filename=upload.name[:256])
+            item.original = storage.save(get_original_path(Photo(uuid=item.uuid), upload.name), upload)
+            items.append(item)
+        IngestItem.objects.bulk_create(items)
+        return batch
@@ -1,13 +1,131 @@
 from django.core.signing import Signer, BadSignature
-from PIL import Image, ImageOps
+from PIL import Image, ImageOps, ExifTags
 from io import BytesIO
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
-from typing import Optional, Any, Dict, Union, List, Tuple
-from dataclasses import dataclass
-from functools import cached_property
+from django.conf import settings
+from typing import Optional, Any, Dict, Union, List, Tuple, IO, Sequence, TYPE_CHECKING
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+from functools import cached_property, lru_cache
+from collections import OrderedDict
+from django.core.cache import caches
+from django.contrib.sites.models import Site
 from fortepan_us.kronofoto.reverse import reverse
-import requests
+from fortepan_us.kronofoto.remoteimages import remote_originals
+import base64
+import hashlib
+import math
+import threading
+
+if TYPE_CHECKING:
+    from fortepan_us.kronofoto.models.photo import ResizerBase, Photo
+
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+@dataclass
+class ImageHeader:
+    width: int
+    height: int
+    orientation: int
+
+
+def read_image_header(infile: IO[bytes]) -> ImageHeader:
+    """Read the stored dimensions and EXIF orientation of an image without
+    decoding its pixels.
+
+    Args:
+        infile (file): The image. Its position is restored afterwards.
+
+    Returns:
+        ImageHeader: The dimensions as stored, before orientation is applied.
+    """
+    position = infile.tell()
+    infile.seek(0)
+    try:
+        image = Image.open(infile)
+        width, height = image.size
+        return ImageHeader(
+            width=width,
+            height=height,
+            orientation=image.getexif().get(ExifTags.Base.Orientation, 1),
+        )
+    finally:
+        infile.seek(position)
+
+
+@dataclass
+class ImageFormat:
+    pil_format: str
+    content_type: str
+    extension: str
+
+
+IMAGE_FORMATS = {
+    "jpeg": ImageFormat(pil_format="JPEG", content_type="image/jpeg", extension="jpg"),
+    "webp": ImageFormat(pil_format="WEBP", content_type="image/webp", extension="webp"),
+    "avif": ImageFormat(pil_format="AVIF", content_type="image/avif", extension="avif"),
+}
+
+
+@lru_cache(maxsize=None)
+def can_encode(pil_format: str) -> bool:
+    Image.init()
+    return pil_format in Image.SAVE
+
+
+def available_formats() -> Tuple[str, ...]:
+    """Get the derivative formats in `KF_IMAGE_FORMATS` that Pillow can
+    encode, in order of preference. JPEG is always available and comes last.
+    """
+    formats = [
+        format for format in settings.KF_IMAGE_FORMATS
+        if format != "jpeg" and format in IMAGE_FORMATS and can_encode(IMAGE_FORMATS[format].pil_format)
+    ]
+    return (*formats, "jpeg")
+
+
+def negotiate_format(accept: str) -> str:
+    """Choose the derivative format for an Accept header.
+
+    Formats other than JPEG must be listed explicitly, as browsers that
+    support them do. Wildcards only select JPEG.
+
+    Args:
+        accept (str): The Accept header.
+
+    Returns:
+        str: A key of IMAGE_FORMATS.
+    """
+    accepted = set()
+    for part in accept.split(","):
+        media_type, *params = [value.strip() for value in part.split(";")]
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0
+        if q > 0:
+            accepted.add(media_type.lower())
+    for format in available_formats():
+        if format == "jpeg" or IMAGE_FORMATS[format].content_type in accepted:
+            return format
+    return "jpeg"
+
+
+@dataclass
+class StoredDerivative:
+    name: str
+    modified: datetime
+    size: int
+
+    @property
+    def etag(self) -> str:
+        return '"{}"'.format(hashlib.sha1("{}:{}:{}".format(self.name, self.modified.timestamp(), self.size).encode()).hexdigest())
+
 
 @dataclass
 class ImageCacher:
@@ -17,49 +135,338 @@ class ImageCacher:
     sig: str
     width: Optional[int]
     height: Optional[int]
+    format: str = "jpeg"
+    photo_id: Optional[int] = None
 
     @property
     def name(self) -> str:
-        return "images/{}/{}/{}.jpg".format(self.block1, self.block2, self.sig)
+        return "images/{}/{}/{}.{}".format(self.block1, self.block2, self.sig, IMAGE_FORMATS[self.format].extension)
+
+    @property
+    def content_type(self) -> str:
+        return IMAGE_FORMATS[self.format].content_type
+
+    def with_format(self, format: str) -> "ImageCacher":
+        return replace(self, format=format)
+
+    @property
+    def encoder_options(self) -> Dict[str, Any]:
+        """Get the Pillow save options for this format and profile, from
+        `KF_IMAGE_ENCODERS` and the per profile overrides in
+        `KF_IMAGE_PROFILE_ENCODERS`.
+        """
+        options = dict(settings.KF_IMAGE_ENCODERS.get(self.format, {}))
+        profile = settings.KF_IMAGE_PROFILE_ENCODERS.get((self.width or 0, self.height or 0), {})
+        options.update(profile.get(self.format, {}))
+        return options
 
     def precache(self) -> Optional[bytes]:
-        from fortepan_us.kronofoto.models.photo import Photo, FixedResizer, FixedHeightResizer, ResizerBase, FixedWidthResizer
-        Image.MAX_IMAGE_PIXELS = 195670000
-        if default_storage.exists(self.name):
+        """Get the derivative, rendering and storing it if it does not exist yet.
+
+        Returns:
+            bytes | None: The image data, or None if the original could not be read.
+        """
+        if self.stored() is not None:
             try:
                 return default_storage.open(self.name).read()
             except:
                 return None
-        if isinstance(self.path, str):
-            try:
-                with default_storage.open(self.path) as infile:
-                    image = ImageOps.exif_transpose(Image.open(infile))
-            except:
-                return None
-        else:
-            content = requests.get(self.path[1]).content
-            image = ImageOps.exif_transpose(Image.open(BytesIO(content)))
+        return self.render()
+
+    def cached(self) -> Optional[bytes]:
+        """Get the derivative only if it has already been rendered.
+
+        Returns:
+            bytes | None: The image data, or None if it is not in storage.
+        """
+        try:
+            with default_storage.open(self.name) as infile:
+                return infile.read()
+        except:
+            return None
 
-        if not image:
+    def stored(self) -> Optional["StoredDerivative"]:
+        """Get the storage metadata of the derivative without reading it.
+
+        Returns:
+            StoredDerivative | None: The metadata, or None if it is not in storage.
+        """
+        if settings.KF_DERIVATIVE_MANIFEST:
+            from fortepan_us.kronofoto.models.derivative import Derivative
+            entry = Derivative.objects.filter(name=self.name).values_list("modified", "size").first()
+            if entry:
+                return StoredDerivative(name=self.name, modified=entry[0], size=entry[1])
+        try:
+            if not default_storage.exists(self.name):
+                return None
+            stored = StoredDerivative(
+                name=self.name,
+                modified=default_storage.get_modified_time(self.name),
+                size=default_storage.size(self.name),
+            )
+        except (OSError, NotImplementedError):
             return None
-        w, h = image.size
+        if settings.KF_DERIVATIVE_MANIFEST:
+            Derivative.objects.record(self.name, size=stored.size, photo_id=self.photo_id)
+        return stored
+
+    def resizer(self, *, original_width: int, original_height: int) -> "ResizerBase":
+        """Get the resizer for this profile.
+
+        Args:
+            original_width (int): Width of the image being resized.
+            original_height (int): Height of the image being resized.
+
+        Returns:
+            ResizerBase: A resizer that produces this profile's dimensions.
+        """
+        from fortepan_us.kronofoto.models.photo import FixedResizer, FixedHeightResizer, FixedWidthResizer
         if self.width and self.height:
-            resizer: ResizerBase = FixedResizer(width=self.width, height=self.height, original_height=h, original_width=w)
+            return FixedResizer(width=self.width, height=self.height, original_height=original_height, original_width=original_width)
         elif self.height:
-            resizer = FixedHeightResizer(height=self.height, original_height=h, original_width=w)
+            return FixedHeightResizer(height=self.height, original_height=original_height, original_width=original_width)
         elif self.width:
-            resizer = FixedWidthResizer(width=self.width, original_height=h, original_width=w)
-        img = resizer.resize(image=image)
-        bytes = BytesIO()
-        img.save(bytes, format="JPEG", quality=60)
-        img_data = bytes.getvalue()
-        if not default_storage.exists(self.name):
-            default_storage.save(
+            return FixedWidthResizer(width=self.width, original_height=original_height, original_width=original_width)
+        raise ValueError("width or height must be set")
+
+    def decode(self, infile: IO[bytes]) -> Image.Image:
+        """Decode an original at the smallest size that still covers this
+        profile, then apply its EXIF orientation.
+
+        Args:
+            infile (file): The original image.
+
+        Returns:
+            Image.Image: The decoded and upright image.
+        """
+        return decode_original(infile, [self]).image
+
+    def encode(self, image: Image.Image) -> bytes:
+        """Encode a rendered derivative.
+
+        Args:
+            image (Image.Image): The resized image.
+
+        Returns:
+            bytes: The image data in this cacher's format.
+        """
+        if self.format != "jpeg" and image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGB")
+        data = BytesIO()
+        image.save(data, format=IMAGE_FORMATS[self.format].pil_format, **self.encoder_options)
+        return data.getvalue()
+
+    def store(self, data: bytes, *, overwrite: bool = False, dimensions: Optional[Tuple[int, int]] = None) -> None:
+        """Save derivative data under this profile's name and record it in the
+        derivative manifest.
+
+        Args:
+            data (bytes): The encoded derivative.
+            overwrite (bool): Replace an existing derivative, such as when the original has changed.
+            dimensions (tuple[int, int], optional): The size of the derivative image.
+        """
+        if default_storage.exists(self.name):
+            if not overwrite:
+                return
+            default_storage.delete(self.name)
+        default_storage.save(self.name, ContentFile(data))
+        if settings.KF_DERIVATIVE_MANIFEST:
+            from fortepan_us.kronofoto.models.derivative import Derivative
+            Derivative.objects.record(
                 self.name,
-                ContentFile(img_data)
+                size=len(data),
+                photo_id=self.photo_id,
+                dimensions=dimensions,
+                checksum=hashlib.sha1(data).hexdigest(),
             )
+
+    def render(self) -> Optional[bytes]:
+        """Decode the original, resize it and store the derivative.
+
+        Returns:
+            bytes | None: The image data, or None if the original could not be read.
+        """
+        Image.MAX_IMAGE_PIXELS = 195670000
+        try:
+            with open_original(self.path) as infile:
+                decoded = decode_original(infile, [self])
+        except:
+            return None
+        resizer = self.resizer(original_width=decoded.original_width, original_height=decoded.original_height)
+        image = decoded.resize(resizer)
+        img_data = self.encode(image)
+        self.store(img_data, dimensions=image.size)
         return img_data
 
+
+def open_original(path: Union[str, Tuple[int, str]]) -> IO[bytes]:
+    """Open an original image, either from storage or from another server in
+    the federation.
+
+    Args:
+        path (str | tuple[int, str]): A storage name, or a pair whose second item is a remote URL.
+
+    Returns:
+        file: The original image data.
+    """
+    if isinstance(path, str):
+        return default_storage.open(path)
+    return remote_originals().open(path[1])
+
+
+@dataclass
+class DecodedImage:
+    """An upright image, which may have been decoded at a reduced size, and
+    the upright size of the original it came from.
+    """
+    image: Image.Image
+    original_width: int
+    original_height: int
+
+    def covers(self, resizer: "ResizerBase") -> bool:
+        """Determine whether this image has enough pixels to render a profile
+        without upscaling.
+
+        Args:
+            resizer (ResizerBase): A resizer for the original's size.
+
+        Returns:
+            bool: True if the profile can be rendered from this image.
+        """
+        width, height = resizer.draft_size
+        return self.image.width >= min(width, self.original_width) - 1 and self.image.height >= min(height, self.original_height) - 1
+
+    def resize(self, resizer: "ResizerBase") -> Image.Image:
+        """Crop and resize this image as `resizer` would crop and resize the
+        original.
+
+        Args:
+            resizer (ResizerBase): A resizer for the original's size.
+
+        Returns:
+            Image.Image: The derivative.
+        """
+        scale_x = self.image.width / self.original_width
+        scale_y = self.image.height / self.original_height
+        left, top, right, bottom = resizer.crop_box
+        return self.image.resize(
+            (resizer.output_width, resizer.output_height),
+            Image.Resampling.LANCZOS,
+            box=(left * scale_x, top * scale_y, right * scale_x, bottom * scale_y),
+        )
+
+
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_MAX_LENGTH = 512
+
+
+def make_placeholder(image: Image.Image) -> str:
+    """Encode a tiny, blurry version of an image to paint while the real
+    image loads.
+
+    Args:
+        image (Image.Image): An upright image.
+
+    Returns:
+        str: A data URI of at most PLACEHOLDER_SIZE pixels on the longer side, about a hundred bytes as WebP. If WebP cannot be encoded or is too long, it is a PNG with as few colors as it takes to fit in the PLACEHOLDER_MAX_LENGTH characters of Photo.placeholder.
+    """
+    scale = PLACEHOLDER_SIZE / max(image.width, image.height)
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    small = image.convert("RGB").resize(size, Image.Resampling.BOX, reducing_gap=2.0)
+    encodings: List[Tuple[str, Image.Image, Dict[str, Any]]] = []
+    if can_encode("WEBP"):
+        encodings.append(("WEBP", small, {"quality": 30}))
+    encodings.append(("PNG", small, {"optimize": True}))
+    encodings.extend(("PNG", small.quantize(colors), {"optimize": True}) for colors in (64, 16, 4))
+    placeholder = ""
+    for format, encoded, options in encodings:
+        data = BytesIO()
+        encoded.save(data, format=format, **options)
+        placeholder = "data:image/{};base64,{}".format(format.lower(), base64.b64encode(data.getvalue()).decode())
+        if len(placeholder) <= PLACEHOLDER_MAX_LENGTH:
+            break
+    return placeholder
+
+
+def read_placeholder(infile: IO[bytes]) -> str:
+    """Make a placeholder from an original, decoding JPEGs at reduced size.
+
+    Args:
+        infile (file): The original image.
+
+    Returns:
+        str: The placeholder data URI.
+    """
+    image = Image.open(infile)
+    image.draft("RGB", (PLACEHOLDER_SIZE * 8, PLACEHOLDER_SIZE * 8))
+    return make_placeholder(ImageOps.exif_transpose(image))
+
+
+def difference_hash(image: Image.Image) -> int:
+    """Compute a 64 bit perceptual hash (dHash) of an image.
+
+    Each bit records whether a pixel of a 9x8 grayscale thumbnail is darker
+    than its right neighbor, so rescans, recompressions and resizes of one
+    picture get hashes that differ in only a few bits.
+
+    Args:
+        image (Image.Image): An upright image.
+
+    Returns:
+        int: The unsigned hash.
+    """
+    small = image.convert("L").resize((9, 8), Image.Resampling.BOX, reducing_gap=2.0)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            value = value << 1 | (left < pixels[row * 9 + col + 1])
+    return value
+
+
+def read_hash(infile: IO[bytes]) -> int:
+    """Hash an original, decoding JPEGs at reduced size.
+
+    Args:
+        infile (file): The original image.
+
+    Returns:
+        int: The unsigned hash.
+    """
+    image = Image.open(infile)
+    image.draft("RGB", (PLACEHOLDER_SIZE * 8, PLACEHOLDER_SIZE * 8))
+    return difference_hash(ImageOps.exif_transpose(image))
+
+
+def decode_original(infile: IO[bytes], cachers: Sequence[ImageCacher]) -> DecodedImage:
+    """Decode an original at the smallest size that still covers every
+    profile, then apply its EXIF orientation.
+
+    JPEG originals are decoded in draft mode, which lets libjpeg scale by
+    1/2, 1/4 or 1/8 during decoding. Other formats are decoded at full size.
+
+    Args:
+        infile (file): The original image.
+        cachers (list[ImageCacher]): The profiles that will be rendered from it.
+
+    Returns:
+        DecodedImage: The decoded and upright image.
+    """
+    image = Image.open(infile)
+    transposed = image.getexif().get(ExifTags.Base.Orientation, 1) in TRANSPOSED_ORIENTATIONS
+    w, h = image.size
+    if transposed:
+        w, h = h, w
+    sizes = [cacher.resizer(original_width=w, original_height=h).draft_size for cacher in cachers]
+    width = max(size[0] for size in sizes)
+    height = max(size[1] for size in sizes)
+    if transposed:
+        width, height = height, width
+    image.draft(None, (width, height))
+    return DecodedImage(image=ImageOps.exif_transpose(image), original_width=w, original_height=h)
+
+
 @dataclass
 class ImageSigner:
     id: int
@@ -92,12 +499,24 @@ class ImageSigner:
         return Signer(salt="{}/{}".format(self.block1, self.block2))
 
     @property
-    def profile_args(self) -> Tuple[Union[str, Tuple[int, str]], int, int]:
-        profile_args = (self.path, self.width or 0, self.height or 0)
+    def profile_args(self) -> Tuple[Union[str, Tuple[int, str]], int, int, int]:
+        """Get the signed payload. The photo id lets derivatives rendered on
+        request be recorded against their photo, so they are discarded with
+        it when its original is replaced.
+        """
+        profile_args = (self.path, self.width or 0, self.height or 0, self.id)
         return profile_args
 
     @property
     def url(self) -> str:
+        return signed_urls().get(self)
+
+    def sign_url(self) -> str:
+        """Sign this profile and build its URL, without consulting the URL cache.
+
+        Returns:
+            str: The resize-image URL.
+        """
         return "{}?i={}".format(
             reverse("kronofoto:resize-image", kwargs={'block1': self.block1, 'block2': self.block2, 'profile1': self.sig}), self.content
         )
@@ -105,5 +524,491 @@ class ImageSigner:
     @property
     def cacher(self) -> ImageCacher:
         return ImageCacher(
-            block1=self.block1, block2=self.block2, path=self.path, sig=self.sig, width=self.width, height=self.height
+            block1=self.block1, block2=self.block2, path=self.path, sig=self.sig, width=self.width, height=self.height, photo_id=self.id,
         )
+
+
+class SignedUrlCache:
+    """Remembers signed image URLs so templates do not re-sign the same
+    profiles on every render.
+
+    URLs are kept in an in-process LRU keyed by photo id, original path,
+    width, height, URL scheme and site domain, optionally backed by a shared Django
+    cache. The signature only depends on the key, so a changed `original`
+    name or `remote_image` produces a new key rather than a stale URL.
+    """
+    def __init__(self, *, size: int, shared: Optional[str] = None) -> None:
+        self.size = size
+        self.shared = shared
+        self._urls: "OrderedDict[Tuple[Any, ...], str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, signer: "ImageSigner") -> Tuple[Any, ...]:
+        path = signer.path if isinstance(signer.path, str) else tuple(signer.path)
+        return (signer.id, path, signer.width or 0, signer.height or 0, settings.KF_URL_SCHEME, Site.objects.get_current().domain)
+
+    def get(self, signer: "ImageSigner") -> str:
+        """Get the URL for a profile, signing it if it is not cached.
+
+        Args:
+            signer (ImageSigner): The profile.
+
+        Returns:
+            str: The resize-image URL.
+        """
+        key = self.key(signer)
+        with self._lock:
+            url = self._urls.get(key)
+            if url is not None:
+                self._urls.move_to_end(key)
+                return url
+        shared_key = "signed-url:2:{}".format(hashlib.sha1(repr(key).encode()).hexdigest())
+        if self.shared:
+            url = caches[self.shared].get(shared_key)
+        if url is None:
+            url = signer.sign_url()
+            if self.shared:
+                caches[self.shared].set(shared_key, url, timeout=None)
+        with self._lock:
+            self._urls[key] = url
+            while len(self._urls) > self.size:
+                self._urls.popitem(last=False)
+        return url
+
+    def clear(self) -> None:
+        with self._lock:
+            self._urls.clear()
+
+
+@lru_cache(maxsize=None)
+def signed_urls() -> SignedUrlCache:
+    """Get the process wide URL cache configured by the
+    `KF_SIGNED_URL_CACHE_SIZE` and `KF_SIGNED_URL_CACHE` settings.
+    """
+    return SignedUrlCache(size=settings.KF_SIGNED_URL_CACHE_SIZE, shared=settings.KF_SIGNED_URL_CACHE)
+
+
+@dataclass
+class DerivativePipeline:
+    """Renders every configured profile of one image from a single decode of
+    the original.
+
+    Profiles are rendered from largest to smallest. Profiles that keep the
+    whole frame are reused as the source for the smaller profiles after them,
+    so only the first profile is resized from the decoded original.
+    """
+    id: int
+    path: Union[str, Tuple[int, str]]
+    profiles: Sequence[Tuple[int, int]]
+    placeholder: str = field(default="", init=False)
+    image_hash: Optional[int] = field(default=None, init=False)
+
+    @staticmethod
+    def for_photo(photo: "Photo") -> Optional["DerivativePipeline"]:
+        """Get the pipeline for a Photo's configured profiles.
+
+        Args:
+            photo (Photo): A saved Photo.
+
+        Returns:
+            DerivativePipeline | None: The pipeline, or None if the Photo has no image.
+        """
+        if photo.original.name:
+            path: Union[str, Tuple[int, str]] = photo.original.name
+        elif photo.remote_image:
+            path = (0, photo.remote_image)
+        else:
+            return None
+        return DerivativePipeline(id=photo.id, path=path, profiles=settings.KF_DERIVATIVE_PROFILES)
+
+    @property
+    def cachers(self) -> List[ImageCacher]:
+        return [
+            ImageSigner(id=self.id, path=self.path, width=width, height=height).cacher.with_format(format)
+            for width, height in self.profiles
+            for format in available_formats()
+        ]
+
+    @property
+    def jpeg_cachers(self) -> List[ImageCacher]:
+        """Get the JPEG profiles, which every browser accepts.
+
+        Rendering only these keeps a save quick. The other formats are
+        rendered by the precache command, or on their first request.
+        """
+        return [cacher for cacher in self.cachers if cacher.format == "jpeg"]
+
+    def missing(self) -> List[ImageCacher]:
+        """Get the profiles that have not been rendered yet.
+
+        Returns:
+            list[ImageCacher]: Profiles with no derivative in storage.
+        """
+        return [cacher for cacher in self.cachers if cacher.stored() is None]
+
+    def run(self, *, cachers: Optional[Sequence[ImageCacher]] = None, overwrite: bool = False) -> List[ImageCacher]:
+        """Render and store derivatives.
+
+        Args:
+            cachers (list[ImageCacher], optional): The profiles to render. Defaults to the missing profiles, or all profiles when overwriting.
+            overwrite (bool): Replace existing derivatives, such as when the original has changed.
+
+        Returns:
+            list[ImageCacher]: The profiles that were rendered. The pipeline's placeholder and image hash are also set whenever anything was rendered.
+        """
+        if cachers is None:
+            cachers = self.cachers if overwrite else self.missing()
+        if not cachers:
+            return []
+        Image.MAX_IMAGE_PIXELS = 195670000
+        with open_original(self.path) as infile:
+            decoded = decode_original(infile, cachers)
+        width, height = decoded.original_width, decoded.original_height
+        profiles: Dict[Tuple[int, int], List[ImageCacher]] = {}
+        for cacher in cachers:
+            profiles.setdefault((cacher.width or 0, cacher.height or 0), []).append(cacher)
+        resizers = [
+            (group, group[0].resizer(original_width=width, original_height=height))
+            for group in profiles.values()
+        ]
+        resizers.sort(key=lambda pair: pair[1].draft_size, reverse=True)
+        source = decoded
+        for group, resizer in resizers:
+            if not source.covers(resizer):
+                source = decoded
+            image = source.resize(resizer)
+            for cacher in group:
+                cacher.store(cacher.encode(image), overwrite=overwrite, dimensions=image.size)
+            if resizer.crop_box == (0, 0, width, height):
+                source = DecodedImage(image=image, original_width=width, original_height=height)
+        self.placeholder = make_placeholder(source.image)
+        self.image_hash = difference_hash(source.image)
+        return [cacher for group, _ in resizers for cacher in group]
+
+    def save_placeholder(self) -> None:
+        """Store the placeholder and image hash from the last run."""
+        if self.placeholder:
+            from fortepan_us.kronofoto.models.photo import Photo
+            Photo.objects.filter(id=self.id).update(placeholder=self.placeholder)
+        if self.image_hash is not None:
+            from fortepan_us.kronofoto.models.imagehash import ImageHash
+            ImageHash.objects.record(self.id, self.image_hash)
+
+
+def image_version(photo: "Photo") -> str:
+    """Get a short fingerprint of a Photo's current image, from the header
+    and placeholder recorded when the image was stored and rendered.
+    """
+    recorded = (photo.original_width, photo.original_height, photo.original_orientation, photo.placeholder)
+    return hashlib.sha1(repr(recorded).encode()).hexdigest()[:8]
+
+
+@dataclass
+class ThumbnailSprite:
+    """A horizontal strip of thumbnails for a window of photos, so a carousel
+    page is one image request instead of one per photo.
+
+    The sheet is composited from the thumbnail derivatives and named by a hash
+    of the ordered photo ids, originals and image versions. Originals keep
+    their name when they are replaced, so the version is what gives a
+    replaced original a new sheet.
+    """
+    signers: Sequence[ImageSigner]
+    size: int = 75
+    versions: Sequence[str] = ()
+
+    @staticmethod
+    def for_photos(photos: Sequence["Photo"], size: int = 75) -> "ThumbnailSprite":
+        """Get the sprite for photos in display order. Photos without an
+        image are left out and repeated photos share one cell.
+
+        Args:
+            photos (list[Photo]): The photos on the page.
+            size (int): The width and height of each cell.
+
+        Returns:
+            ThumbnailSprite: The sprite.
+        """
+        signers: Dict[int, ImageSigner] = {}
+        versions = []
+        for photo in photos:
+            if photo.id in signers:
+                continue
+            if photo.remote_image:
+                path: Union[str, Tuple[int, str]] = (0, photo.remote_image)
+            elif photo.original:
+                path = photo.original.name
+            else:
+                continue
+            signers[photo.id] = ImageSigner(id=photo.id, path=path, width=size, height=size)
+            versions.append(image_version(photo))
+        return ThumbnailSprite(signers=list(signers.values()), size=size, versions=versions)
+
+    @staticmethod
+    def unsign(signed: str) -> "ThumbnailSprite":
+        """Get the sprite described by a signed `i` parameter.
+
+        Args:
+            signed (str): The value from `url`.
+
+        Returns:
+            ThumbnailSprite: The sprite.
+
+        Raises:
+            BadSignature: The parameter was not signed by this site.
+        """
+        size, items, *versions = Signer(salt="sprite").unsign_object(signed)
+        return ThumbnailSprite(
+            signers=[
+                ImageSigner(id=id, path=path if isinstance(path, str) else tuple(path), width=size, height=size)
+                for id, path in items
+            ],
+            size=size,
+            versions=versions[0] if versions else (),
+        )
+
+    @cached_property
+    def items(self) -> List[Tuple[int, Union[str, Tuple[int, str]]]]:
+        return [(signer.id, signer.path if isinstance(signer.path, str) else tuple(signer.path)) for signer in self.signers]
+
+    @cached_property
+    def key(self) -> str:
+        return hashlib.sha1(repr((self.size, self.items, list(self.versions))).encode()).hexdigest()
+
+    @property
+    def name(self) -> str:
+        return "images/sprites/{}.jpg".format(self.key)
+
+    @cached_property
+    def offsets(self) -> Dict[int, int]:
+        return {signer.id: index * self.size for index, signer in enumerate(self.signers)}
+
+    @property
+    def url(self) -> str:
+        return "{}?i={}".format(
+            reverse("kronofoto:thumbnail-sprite", kwargs={"key": self.key}),
+            Signer(salt="sprite").sign_object((self.size, self.items, list(self.versions)), compress=True),
+        )
+
+    def cached(self) -> Optional[bytes]:
+        """Get the sheet only if it has already been rendered.
+
+        Returns:
+            bytes | None: The image data, or None if it is not in storage.
+        """
+        try:
+            with default_storage.open(self.name) as infile:
+                return infile.read()
+        except OSError:
+            return None
+
+    def render(self) -> bytes:
+        """Composite the thumbnails, rendering any that are missing, and store
+        the sheet. Cells whose original cannot be read are left blank.
+
+        Returns:
+            bytes: The JPEG data.
+        """
+        sheet = Image.new("RGB", (max(len(self.signers), 1) * self.size, self.size), (255, 255, 255))
+        for index, signer in enumerate(self.signers):
+            cacher = signer.cacher
+            data = cacher.cached() or cacher.render()
+            if data is None:
+                continue
+            with Image.open(BytesIO(data)) as thumbnail:
+                sheet.paste(thumbnail.convert("RGB"), (index * self.size, 0))
+        output = BytesIO()
+        sheet.save(output, format="JPEG", **settings.KF_IMAGE_ENCODERS.get("jpeg", {}))
+        img_data = output.getvalue()
+        if not default_storage.exists(self.name):
+            default_storage.save(self.name, ContentFile(img_data))
+        return img_data
+
+
+@dataclass
+class TilePyramid:
+    """IIIF tiles of one original.
+
+    The level for scale factor `s` is the upright original reduced by `s`, cut
+    into `KF_IIIF_TILE_SIZE` squares, which are exactly the tile requests
+    advertised in the IIIF info.json. Tiles are stored as derivatives of the
+    photo, so they are discarded with the others when its original is
+    replaced, and the pyramid is not served until it is built again. Other
+    region and size requests are composited from the smallest level
+    that still has enough pixels.
+    """
+    id: int
+    path: Union[str, Tuple[int, str]]
+    width: int
+    height: int
+    tile_size: int = field(default_factory=lambda: settings.KF_IIIF_TILE_SIZE)
+
+    @property
+    def scale_factors(self) -> List[int]:
+        scale_factors = [1]
+        while max(self.width, self.height) > self.tile_size * scale_factors[-1]:
+            scale_factors.append(scale_factors[-1] * 2)
+        return scale_factors
+
+    @cached_property
+    def version(self) -> str:
+        return hashlib.sha1(repr(self.path).encode()).hexdigest()[:16]
+
+    @property
+    def name(self) -> str:
+        return "iiif/{}/{}".format(self.id, self.version)
+
+    def cacher(self, scale: int, col: int, row: int) -> ImageCacher:
+        return ImageCacher(
+            block1=self.id & 255,
+            block2=(self.id >> 8) & 255,
+            path=self.path,
+            sig="iiif-{}-{}-{}-{}".format(self.version, scale, col, row),
+            width=None,
+            height=None,
+            photo_id=self.id,
+        )
+
+    def built(self) -> bool:
+        """Determine whether the pyramid has been built. The smallest level is
+        stored last, so its tile stands in for the whole pyramid.
+        """
+        return self.cacher(self.scale_factors[-1], 0, 0).stored() is not None
+
+    def build(self, *, overwrite: bool = False) -> int:
+        """Decode the original once and store the tiles of every level.
+
+        Args:
+            overwrite (bool): Replace tiles that are already stored.
+
+        Returns:
+            int: The number of tiles stored.
+        """
+        Image.MAX_IMAGE_PIXELS = 195670000
+        with open_original(self.path) as infile:
+            image = ImageOps.exif_transpose(Image.open(infile))
+            image.load()
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        size = self.tile_size
+        count = 0
+        for scale in self.scale_factors:
+            if scale > 1:
+                image = image.reduce(2)
+            for row in range(math.ceil(image.height / size)):
+                for col in range(math.ceil(image.width / size)):
+                    tile = image.crop((col * size, row * size, min((col + 1) * size, image.width), min((row + 1) * size, image.height)))
+                    cacher = self.cacher(scale, col, row)
+                    cacher.store(cacher.encode(tile), overwrite=overwrite, dimensions=tile.size)
+                    count += 1
+        return count
+
+    def tile(self, region: Tuple[int, int, int, int], size: Tuple[int, int]) -> Optional[ImageCacher]:
+        """Get the stored tile that answers a request exactly.
+
+        Args:
+            region (tuple[int, int, int, int]): x, y, width and height in the upright original.
+            size (tuple[int, int]): The requested width and height.
+
+        Returns:
+            ImageCacher | None: The tile, or None if the request is not a tile of the pyramid.
+        """
+        x, y, w, h = region
+        for scale in self.scale_factors:
+            span = self.tile_size * scale
+            if x % span or y % span:
+                continue
+            expected = (min(span, self.width - x), min(span, self.height - y))
+            if (w, h) == expected and size == (math.ceil(w / scale), math.ceil(h / scale)):
+                return self.cacher(scale, x // span, y // span)
+        return None
+
+    def region(self, region: Tuple[int, int, int, int], size: Tuple[int, int]) -> Optional[bytes]:
+        """Composite a region from the stored tiles and scale it.
+
+        Args:
+            region (tuple[int, int, int, int]): x, y, width and height in the upright original.
+            size (tuple[int, int]): The output width and height, no larger than the region.
+
+        Returns:
+            bytes | None: The JPEG data, or None if the pyramid has not been built.
+        """
+        x, y, w, h = region
+        scale = max(s for s in self.scale_factors if s <= min(w / size[0], h / size[1]))
+        span = self.tile_size * scale
+        cols = range(x // span, (x + w - 1) // span + 1)
+        rows = range(y // span, (y + h - 1) // span + 1)
+        canvas = Image.new("RGB", (len(cols) * self.tile_size, len(rows) * self.tile_size))
+        for row in rows:
+            for col in cols:
+                data = self.cacher(scale, col, row).cached()
+                if data is None:
+                    return None
+                with Image.open(BytesIO(data)) as tile:
+                    canvas.paste(tile, ((col - cols[0]) * self.tile_size, (row - rows[0]) * self.tile_size))
+        left = x / scale - cols[0] * self.tile_size
+        top = y / scale - rows[0] * self.tile_size
+        image = canvas.resize(size, Image.Resampling.LANCZOS, box=(left, top, left + w / scale, top + h / scale))
+        return self.cacher(scale, cols[0], rows[0]).encode(image)
+
+
+@dataclass
+class PanoramaTiles:
+    """Multi-resolution tiles of an equirectangular panorama, in the layout
+    of Photo Sphere Viewer's equirectangular tiles adapter.
+
+    There is a small base image that is shown first, then levels of square
+    tiles about `KF_PHOTOSPHERE_TILE_SIZE` wide that double in resolution up
+    to the full panorama. Tiles are stored next to the panorama in a directory
+    named by its checksum, so a replaced panorama gets new tiles even though
+    photosphere images are overwritten in place.
+    """
+    name: str
+
+    def build(self) -> Optional[Dict[str, Any]]:
+        """Slice the panorama into tiles and store them.
+
+        Returns:
+            dict | None: The tile set description, with storage names instead of URLs, or None if the panorama is too small to need tiles.
+        """
+        Image.MAX_IMAGE_PIXELS = 195670000
+        with default_storage.open(self.name) as infile:
+            data = infile.read()
+        image = Image.open(BytesIO(data))
+        image.load()
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        top_cols = 2 ** max(0, round(math.log2(image.width / settings.KF_PHOTOSPHERE_TILE_SIZE)))
+        if top_cols < 4:
+            return None
+        size = round(image.width / top_cols)
+        directory = "{}_tiles/{}".format(self.name.rsplit(".", 1)[0], hashlib.sha1(data).hexdigest()[:12])
+        base_width = settings.KF_PHOTOSPHERE_BASE_WIDTH
+        self.save("{}/base.jpg".format(directory), image.resize((base_width, base_width // 2), Image.Resampling.LANCZOS))
+        cols_per_level = []
+        cols = top_cols
+        while cols >= 4:
+            cols_per_level.insert(0, cols)
+            cols //= 2
+        levels = []
+        for index, cols in enumerate(cols_per_level):
+            rows = cols // 2
+            level = image.resize((cols * size, rows * size), Image.Resampling.LANCZOS)
+            for row in range(rows):
+                for col in range(cols):
+                    tile = level.crop((col * size, row * size, (col + 1) * size, (row + 1) * size))
+                    self.save("{}/{}/{}_{}.jpg".format(directory, index, col, row), tile)
+            levels.append({
+                "width": cols * size,
+                "cols": cols,
+                "rows": rows,
+                "zoomRange": [round(100 * index / len(cols_per_level)), round(100 * (index + 1) / len(cols_per_level))],
+            })
+        return {"directory": directory, "width": top_cols * size, "levels": levels}
+
+    def save(self, name: str, image: Image.Image) -> None:
+        if default_storage.exists(name):
+            return
+        data = BytesIO()
+        image.save(data, format="JPEG", **settings.KF_IMAGE_ENCODERS.get("jpeg", {}))
+        default_storage.save(name, ContentFile(data.getvalue()))
@@ -0,0 +1,204 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
+from fortepan_us.kronofoto.models import Photo, PhotoTag, Place, WordCount, IndexUpdate, IndexChange, SearchDocument
+from fortepan_us.kronofoto.search.results import invalidate
+import re
+import threading
+
+FIELDS = ("CA", "PL", "TA", "TE")
+
+# The WordCount fields that depend on each indexed Photo field.
+PHOTO_FIELDS = {
+    "caption": "CA",
+    "place": "PL",
+    "location_point": "PL",
+}
+
+pending = threading.local()
+
+
+def word_weights(words: Sequence[str]) -> Dict[str, float]:
+    counts = Counter(words)
+    total = sum(counts.values())
+    return {word: count / total for word, count in counts.items()}
+
+
+def caption_words(caption: str) -> List[str]:
+    return [w for w in re.split(r"[^\w\']+", caption.lower()) if w.strip() and len(w.strip()) <= 64]
+
+
+def containing_places(place: Place, point: object) -> List[Place]:
+    q = Q(lft__lte=place.lft, rght__gte=place.rght, tree_id=place.tree_id)
+    if place.geom:
+        q |= Q(geom__contains=place.geom)
+    if point:
+        q |= Q(geom__contains=point)
+    return list(Place.objects.filter(q))
+
+
+Row = Tuple[int, str, str, float]
+
+
+def word_counts(updates: Dict[int, Set[str]]) -> Tuple[List[Row], Dict[int, List[int]]]:
+    """Compute some WordCount fields of some Photos, and the places
+    containing the Photos whose place fields are computed, with a fixed
+    number of queries apart from one per distinct place and location.
+
+    Args:
+        updates (dict[int, set[str]]): The fields to compute by Photo id.
+
+    Returns:
+        tuple: The (photo id, field, word, count) rows, and the containing Place ids by Photo id.
+    """
+    photos = {
+        id: (caption, place_id, point)
+        for (id, caption, place_id, point) in Photo.objects.filter(id__in=updates).values_list("id", "caption", "place_id", "location_point")
+    }
+    by_field = {
+        field: [id for id in photos if field in updates[id]] for field in FIELDS
+    }
+    weights: List[Tuple[int, str, Dict[str, float]]] = [
+        (id, "CA", word_weights(caption_words(photos[id][0]))) for id in by_field["CA"]
+    ]
+
+    located = [id for id in by_field["PL"] if photos[id][1]]
+    places = Place.objects.in_bulk({photos[id][1] for id in located})
+    containing: Dict[Tuple[int, str], List[Place]] = {}
+    photo_places = {}
+    for id in located:
+        _, place_id, point = photos[id]
+        key = (place_id, point.ewkt if point else "")
+        if key not in containing:
+            containing[key] = containing_places(places[place_id], point)
+        photo_places[id] = [place.id for place in containing[key]]
+        weights.append((id, "PL", word_weights([w for place in containing[key] for w in place.name.lower().split()])))
+
+    words: Dict[Tuple[int, str], List[str]] = defaultdict(list)
+    for id, tag in PhotoTag.objects.filter(photo_id__in=by_field["TA"], accepted=True).values_list("photo_id", "tag__tag"):
+        words[(id, "TA")].extend(tag.lower().split())
+    for id, term in Photo.terms.through.objects.filter(photo_id__in=by_field["TE"]).values_list("photo_id", "term__term"):
+        words[(id, "TE")].extend(term.lower().split())
+    weights.extend((id, field, word_weights(found)) for ((id, field), found) in words.items())
+
+    rows = [
+        (id, field, word, weight)
+        for (id, field, found) in weights
+        for word, weight in found.items()
+    ]
+    return rows, photo_places
+
+
+def set_places(photo_places: Dict[int, List[int]]) -> None:
+    Places = Photo.places.through
+    Places.objects.filter(photo_id__in=photo_places).delete()
+    Places.objects.bulk_create([
+        Places(photo_id=photo_id, place_id=place_id)
+        for photo_id, place_ids in photo_places.items()
+        for place_id in place_ids
+    ])
+
+
+def reindex(updates: Dict[int, Set[str]]) -> None:
+    """Rebuild some WordCount fields of some Photos, and their places, with
+    one delete and one insert for all of them.
+
+    Args:
+        updates (dict[int, set[str]]): The fields to rebuild by Photo id.
+    """
+    rows, photo_places = word_counts(updates)
+    stale = Q()
+    for field in FIELDS:
+        ids = [id for (id, fields) in updates.items() if field in fields]
+        if ids:
+            stale |= Q(field=field, photo_id__in=ids)
+    if not stale:
+        return
+    WordCount.objects.filter(stale).delete()
+    set_places(photo_places)
+    WordCount.objects.bulk_create([
+        WordCount(photo_id=id, field=field, word=word, count=count) for (id, field, word, count) in rows
+    ], batch_size=2000)
+    refresh_search_backend(list(updates))
+
+
+def refresh_search_backend(photo_ids: List[int]) -> None:
+    SearchDocument.objects.refresh(photo_ids)
+    invalidate()
+    if settings.KF_SEARCH_BACKEND == "memory":
+        from fortepan_us.kronofoto.search.memory import search_index
+        IndexChange.objects.bulk_create([IndexChange(photo_id=id) for id in photo_ids])
+        transaction.on_commit(lambda: search_index().refresh(photo_ids))
+
+
+def enqueue(photo_ids: Iterable[int], fields: Iterable[str]) -> None:
+    """Schedule some WordCount fields of some Photos to be rebuilt, as
+    configured by `KF_SEARCH_INDEX_UPDATES`.
+
+    "immediate" rebuilds them now. "commit" collects them until the
+    transaction commits, so several changes to the same Photo are rebuilt
+    together, once. "queue" writes them to IndexUpdate for the
+    process_index_updates command.
+
+    Args:
+        photo_ids (iterable[int]): The changed Photos.
+        fields (iterable[str]): The WordCount fields to rebuild, such as "CA".
+    """
+    photo_ids = [id for id in photo_ids if id is not None]
+    fields = set(fields)
+    if not photo_ids or not fields:
+        return
+    mode = settings.KF_SEARCH_INDEX_UPDATES
+    if mode == "queue":
+        IndexUpdate.objects.enqueue(photo_ids, fields)
+    elif mode == "commit":
+        if not hasattr(pending, "updates"):
+            pending.updates = {}
+        for id in photo_ids:
+            pending.updates.setdefault(id, set()).update(fields)
+        transaction.on_commit(flush)
+    else:
+        reindex({id: fields for id in photo_ids})
+
+
+def flush() -> None:
+    """Rebuild everything collected by `enqueue` in this thread.
+
+    Updates collected in a transaction that was rolled back are rebuilt with
+    the next one, which is harmless because rebuilding only reads the
+    current rows.
+    """
+    updates = getattr(pending, "updates", None)
+    pending.updates = {}
+    if updates:
+        batch_size = settings.KF_SEARCH_INDEX_BATCH_SIZE
+        ids = list(updates)
+        for start in range(0, len(ids), batch_size):
+            reindex({id: updates[id] for id in ids[start:start + batch_size]})
+
+
+def drain(batch_size: int) -> int:
+    """Rebuild the oldest queued IndexUpdates and remove them from the queue.
+
+    Rows are locked with SKIP LOCKED where the database supports it, so
+    several workers can drain the queue at once.
+
+    Returns:
+        int: The number of queued rows processed.
+    """
+    with transaction.atomic():
+        rows = list(
+            IndexUpdate.objects.select_for_update(skip_locked=True)
+            .order_by("id")
+            .values_list("id", "photo_id", "field")[:batch_size]
+        )
+        if not rows:
+            return 0
+        updates: Dict[int, Set[str]] = {}
+        for _, photo_id, field in rows:
+            updates.setdefault(photo_id, set()).add(field)
+        reindex(updates)
+        IndexUpdate.objects.filter(id__in=[id for (id, _, _) in rows]).delete()
+    return len(rows)
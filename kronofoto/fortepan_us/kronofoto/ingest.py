@@ -0,0 +1,172 @@
+from django import db
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional, Tuple
+from fortepan_us.kronofoto.models import Photo, WordCount, IngestBatch, IngestItem, ImageHash
+from fortepan_us.kronofoto.imageutil import DerivativePipeline, read_image_header
+from fortepan_us.kronofoto.storage import OverwriteStorage
+from fortepan_us.kronofoto.indexing import FIELDS, refresh_search_backend, set_places, word_counts
+
+Header = Tuple[int, int, int]
+
+
+def read_header(name: str) -> Tuple[Optional[Header], Optional[str]]:
+    """Read the dimensions and EXIF orientation of a stored original.
+
+    Returns:
+        tuple: (width, height, orientation) and None, or None and an error message.
+    """
+    try:
+        with OverwriteStorage().open(name) as infile:
+            header = read_image_header(infile)
+        return (header.width, header.height, header.orientation), None
+    except Exception as e:
+        return None, "{}: {}".format(type(e).__name__, e)
+
+
+def render_derivatives(job: Tuple[int, str]) -> Tuple[int, str, Optional[int], Optional[str]]:
+    """Render every configured profile of a new Photo.
+
+    Returns:
+        tuple: The photo id, its placeholder, its image hash and an error message or None.
+    """
+    id, name = job
+    pipeline = DerivativePipeline(id=id, path=name, profiles=settings.KF_DERIVATIVE_PROFILES)
+    try:
+        pipeline.run(overwrite=True)
+        return id, pipeline.placeholder, pipeline.image_hash, None
+    except Exception as e:
+        return id, "", None, "{}: {}".format(type(e).__name__, e)
+    finally:
+        db.connections.close_all()
+
+
+@dataclass
+class BulkIngest:
+    """Turns the queued files of an IngestBatch into Photos.
+
+    The work done per photo when one is saved in the admin is done here for
+    the whole batch at once: image headers are read and derivatives rendered
+    on `executor`, Photos, terms, places and index rows are written with
+    bulk queries, and federation announcements share their profile lookups.
+    Failures are recorded on the item instead of stopping the batch, and a
+    batch that was interrupted picks up where it stopped. The Photos, their
+    index rows and the item states are written in one transaction, so an
+    interruption cannot leave Photos that are unindexed or created twice.
+    """
+    batch: IngestBatch
+    executor: Executor
+
+    def run(self) -> None:
+        self.beat()
+        queued = list(self.batch.items.filter(state=IngestItem.State.QUEUED).order_by("id"))
+        if queued:
+            headers = list(self.executor.map(read_header, [item.original for item in queued]))
+            self.beat()
+            with transaction.atomic():
+                photos = self.create_photos(queued, headers)
+                if photos:
+                    self.index(photos)
+        created = list(self.batch.items.filter(state=IngestItem.State.CREATED).select_related("photo").order_by("id"))
+        if created:
+            self.beat()
+            self.render(created)
+            self.announce([item.photo for item in created if item.state == IngestItem.State.DONE and item.photo])
+        self.batch.finished = timezone.now()
+        self.batch.save(update_fields=["finished"])
+
+    def beat(self) -> None:
+        """Record that the batch is still being worked on."""
+        IngestBatch.objects.filter(id=self.batch.id).update(heartbeat=timezone.now())
+
+    def create_photos(self, items: List[IngestItem], headers: List[Tuple[Optional[Header], Optional[str]]]) -> List[Photo]:
+        photos = []
+        created = []
+        for item, (header, error) in zip(items, headers):
+            if header is None:
+                item.state = IngestItem.State.FAILED
+                item.error = error or ""
+                continue
+            width, height, orientation = header
+            photos.append(Photo(
+                uuid=item.uuid,
+                original=item.original,
+                original_width=width,
+                original_height=height,
+                original_orientation=orientation,
+                **{**self.batch.defaults, **item.fields},
+            ))
+            created.append(item)
+        Photo.objects.bulk_create(photos)
+        for item, photo in zip(created, photos):
+            item.photo = photo
+            item.state = IngestItem.State.CREATED
+        IngestItem.objects.bulk_update(items, ["state", "error", "photo"])
+        return photos
+
+    def index(self, photos: List[Photo]) -> None:
+        """Write the term, place and word count rows that saving each Photo
+        would have written.
+        """
+        Terms = Photo.terms.through
+        Terms.objects.bulk_create([
+            Terms(photo_id=photo.id, term_id=term) for photo in photos for term in self.batch.terms
+        ])
+        rows, photo_places = word_counts({photo.id: set(FIELDS) for photo in photos})
+        set_places(photo_places)
+        WordCount.objects.bulk_create([
+            WordCount(photo_id=id, field=field, word=word, count=count) for (id, field, word, count) in rows
+        ], batch_size=2000)
+        refresh_search_backend([photo.id for photo in photos])
+
+    def render(self, items: List[IngestItem]) -> None:
+        by_photo = {item.photo_id: item for item in items if item.photo_id}
+        jobs = [(photo_id, item.original) for photo_id, item in by_photo.items()]
+        placeholders = []
+        hashes = []
+        for id, placeholder, image_hash, error in self.executor.map(render_derivatives, jobs):
+            self.beat()
+            item = by_photo[id]
+            if error:
+                item.state = IngestItem.State.FAILED
+                item.error = "derivatives: {}".format(error)
+            else:
+                item.state = IngestItem.State.DONE
+                placeholders.append(Photo(id=id, placeholder=placeholder))
+                if image_hash is not None:
+                    hashes.append((id, image_hash))
+        Photo.objects.bulk_update(placeholders, ["placeholder"])
+        ImageHash.objects.record_all(hashes)
+        IngestItem.objects.bulk_update(by_photo.values(), ["state", "error"])
+
+    def announce(self, photos: List[Photo]) -> None:
+        from fortepan_us.kronofoto.signals import send_all, PhotoUpsertSender
+        send_all(PhotoUpsertSender(instance=photo, created=True) for photo in photos)
+
+
+def ingest_batch(batch_id: int) -> None:
+    """Process a batch with a thread pool of `KF_INGEST_WORKERS` workers,
+    unless something else is already working on it.
+    """
+    try:
+        if not IngestBatch.objects.claim(batch_id):
+            return
+        batch = IngestBatch.objects.get(id=batch_id)
+        with ThreadPoolExecutor(max_workers=settings.KF_INGEST_WORKERS) as executor:
+            BulkIngest(batch=batch, executor=executor).run()
+    finally:
+        db.connections.close_all()
+
+
+@lru_cache(maxsize=None)
+def ingest_pool() -> ThreadPoolExecutor:
+    """Get the process wide executor that runs uploaded batches one at a time
+    in the background, when `KF_INGEST_RUNNER` is "thread". Batches it
+    abandons, such as when the process restarts, are resumed by the
+    ingest_batches command.
+    """
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from django import db
+from fortepan_us.kronofoto.models import Photo
+from fortepan_us.kronofoto.imageutil import read_image_header
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+import os
+
+
+def read_header(job: Tuple[int, str]) -> Tuple[int, Optional[Tuple[int, int, int]]]:
+    id, name = job
+    try:
+        with default_storage.open(name) as infile:
+            header = read_image_header(infile)
+        return id, (header.width, header.height, header.orientation)
+    except Exception:
+        return id, None
+
+
+class Command(BaseCommand):
+    help = "store dimensions and EXIF orientation for photos that are missing them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, workers, chunk_size, **options):
+        photos = Photo.objects.filter(original__isnull=False).exclude(original="").filter(
+            Q(original_width=0) | Q(original_height=0) | Q(original_orientation=0)
+        )
+        last_id = 0
+        updated = failed = 0
+        db.connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            while True:
+                chunk = list(photos.filter(id__gt=last_id).order_by("id").values_list("id", "original")[:chunk_size])
+                if not chunk:
+                    break
+                last_id = chunk[-1][0]
+                changed = []
+                for id, header in executor.map(read_header, chunk):
+                    if header is None:
+                        failed += 1
+                        self.stderr.write("{} could not be read".format(id))
+                        continue
+                    width, height, orientation = header
+                    changed.append(Photo(id=id, original_width=width, original_height=height, original_orientation=orientation))
+                Photo.objects.bulk_update(changed, ["original_width", "original_height", "original_orientation"])
+                updated += len(changed)
+                self.stdout.write("{} updated, last id {}".format(updated, last_id))
+        self.stdout.write("Finished: {} updated, {} failed".format(updated, failed))
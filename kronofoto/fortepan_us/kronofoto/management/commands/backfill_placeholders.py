@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django import db
+from django.db.models import Q
+from fortepan_us.kronofoto.models import Photo
+from fortepan_us.kronofoto.imageutil import open_original, read_placeholder
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple, Union
+from PIL import Image
+import os
+
+Path = Union[str, Tuple[int, str]]
+
+
+def make(job: Tuple[int, str, Optional[str]]) -> Tuple[int, Optional[str]]:
+    id, original, remote_image = job
+    path: Path = original if original else (0, remote_image or "")
+    Image.MAX_IMAGE_PIXELS = 195670000
+    try:
+        with open_original(path) as infile:
+            return id, read_placeholder(infile)
+    except Exception:
+        return id, None
+
+
+class Command(BaseCommand):
+    help = "store image placeholders for photos that are missing them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, workers, chunk_size, **options):
+        photos = Photo.objects.filter(Q(original__gt="") | Q(remote_image__isnull=False), placeholder="")
+        last_id = 0
+        updated = failed = 0
+        db.connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            while True:
+                chunk = list(photos.filter(id__gt=last_id).order_by("id").values_list("id", "original", "remote_image")[:chunk_size])
+                if not chunk:
+                    break
+                last_id = chunk[-1][0]
+                changed = []
+                for id, placeholder in executor.map(make, chunk):
+                    if placeholder is None:
+                        failed += 1
+                        self.stderr.write("{} could not be read".format(id))
+                        continue
+                    changed.append(Photo(id=id, placeholder=placeholder))
+                Photo.objects.bulk_update(changed, ["placeholder"])
+                updated += len(changed)
+                self.stdout.write("{} updated, last id {}".format(updated, last_id))
+        self.stdout.write("Finished: {} updated, {} failed".format(updated, failed))
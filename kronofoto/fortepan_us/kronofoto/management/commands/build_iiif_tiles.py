@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand
+from django import db
+from fortepan_us.kronofoto.models import Photo
+from fortepan_us.kronofoto.imageutil import TilePyramid
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+import os
+import time
+
+
+def build(job: Tuple[TilePyramid, bool]) -> Tuple[int, int, Optional[str]]:
+    pyramid, overwrite = job
+    try:
+        return pyramid.id, pyramid.build(overwrite=overwrite), None
+    except Exception as e:
+        return pyramid.id, 0, "{}: {}".format(type(e).__name__, e)
+
+
+class Command(BaseCommand):
+    help = "build the IIIF tile pyramids of published photos"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--archive', default=None, help="only photos in the archive with this slug")
+        parser.add_argument('--overwrite', action='store_true', help="rebuild pyramids that are already stored")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--chunk-size', type=int, default=100)
+
+    def handle(self, *args, archive, overwrite, workers, chunk_size, **options):
+        photos = Photo.objects.filter(is_published=True).exclude(original="").only(
+            "id", "original", "original_width", "original_height", "original_orientation",
+        ).order_by("id")
+        if archive:
+            photos = photos.filter(archive__slug=archive)
+        counts = {"photos": 0, "skipped": 0, "tiles": 0}
+        failures: List[Tuple[int, str]] = []
+        start = time.monotonic()
+        last_id = 0
+        while True:
+            chunk = list(photos.filter(id__gt=last_id)[:chunk_size])
+            if not chunk:
+                break
+            last_id = chunk[-1].id
+            jobs = []
+            for photo in chunk:
+                counts["photos"] += 1
+                width, height = photo.get_upright_dimensions()
+                pyramid = TilePyramid(id=photo.id, path=photo.original.name, width=width, height=height)
+                if overwrite or not pyramid.built():
+                    jobs.append((pyramid, overwrite))
+                else:
+                    counts["skipped"] += 1
+            db.connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for photo_id, tiles, error in executor.map(build, jobs):
+                    counts["tiles"] += tiles
+                    if error:
+                        failures.append((photo_id, error))
+                        self.stderr.write("{} {}".format(photo_id, error))
+            self.stdout.write("{} photos, last id {}".format(counts["photos"], last_id))
+        elapsed = time.monotonic() - start
+        self.stdout.write(
+            "Finished {photos} photos in {elapsed:.1f}s: {tiles} tiles stored, "
+            "{skipped} photos skipped, {failed} failures".format(elapsed=elapsed, failed=len(failures), **counts)
+        )
+        for photo_id, error in failures:
+            self.stdout.write("  {} {}".format(photo_id, error))
@@ -1,49 +1,63 @@
 from django.core.management.base import BaseCommand
-from archive.models import Photo, WordCount, Place
-from django.db.models import Q
-import re
-from collections import Counter
+from django.db.models import Max, Min
+from django import db
+from fortepan_us.kronofoto.models import Photo, WordCount
+from fortepan_us.kronofoto.indexing import FIELDS, reindex, set_places, word_counts
+from fortepan_us.kronofoto.shadow import ShadowTable, shadow_model
+from fortepan_us.kronofoto.search.results import invalidate
+from concurrent.futures import ProcessPoolExecutor
+from typing import Tuple
+import os
+import time
+
+
+def build(job: Tuple[str, int, int]) -> int:
+    """Write the WordCount rows of the Photos with ids in [start, end) to
+    the shadow table, and set their places.
+
+    Returns:
+        int: The number of rows written.
+    """
+    table, start, end = job
+    try:
+        ids = Photo.objects.filter(id__gte=start, id__lt=end).values_list("id", flat=True)
+        rows, photo_places = word_counts({id: set(FIELDS) for id in ids})
+        Shadow = shadow_model(WordCount, table)
+        Shadow._default_manager.bulk_create([
+            Shadow(photo_id=id, field=field, word=word, count=count) for (id, field, word, count) in rows
+        ], batch_size=2000)
+        set_places(photo_places)
+        return len(rows)
+    finally:
+        db.connections.close_all()
+
 
 class Command(BaseCommand):
     help = 'build word index for search'
 
-    def handle(self, *args, **options):
-        WordCount.objects.all().delete()
-        wordcounts = []
-        # cache_places = {}
-        # caching is much more difficult with location_point
-        # This may run acceptably fast on postgres.
-        for photo in Photo.objects.all().order_by('id'):
-            print(photo.id, len(wordcounts))
-            if len(wordcounts) > 10000:
-                WordCount.objects.bulk_create(wordcounts, ignore_conflicts=True)
-                wordcounts = []
-            if photo.place:
-                q = Q(lft__lte=photo.place.lft, rght__gte=photo.place.rght, tree_id=photo.place.tree_id)
-                if photo.place.geom:
-                    q |= Q(geom__contains=photo.place.geom)
-                if photo.location_point:
-                    q |= Q(geom__contains=photo.location_point)
-                places = Place.objects.filter(q)
-                photo.places.set(places)
-                counts = sum((Counter(place.name.lower().split()) for place in places), Counter())
-                total = sum(counts.values())
-                wordcounts += [
-                    WordCount(photo=photo, word=w, field='PL', count=counts[w]/total) for w in counts
-                ]
-            counts = Counter(w for w in re.split(r"[^\w\']+", photo.caption.lower()) if w.strip())
-            total = sum(counts.values())
-            wordcounts += [
-                WordCount(photo=photo, word=w, field='CA', count=counts[w]/total) for w in counts
-            ]
-            counts = sum((Counter(term.term.lower().split()) for term in photo.terms.all()), Counter())
-            total = sum(counts.values())
-            wordcounts += [
-                WordCount(photo=photo, word=w, field='TE', count=counts[w]/total) for w in counts
-            ]
-            counts = sum((Counter(tag.tag.lower().split()) for tag in photo.tags.filter(phototag__accepted=True)), Counter())
-            total = sum(counts.values())
-            wordcounts += [
-                WordCount(photo=photo, word=w, field='TA', count=counts[w]/total) for w in counts
-            ]
-        WordCount.objects.bulk_create(wordcounts, ignore_conflicts=True)
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--chunk-size', type=int, default=1000, help="photo ids per job")
+
+    def handle(self, *args, workers, chunk_size, **options):
+        bounds = Photo.objects.aggregate(first=Min("id"), last=Max("id"))
+        shadow = ShadowTable.create(WordCount, "photo_id")
+        jobs = [
+            (shadow.table, start, start + chunk_size)
+            for start in range(bounds["first"] or 0, (bounds["last"] or -1) + 1, chunk_size)
+        ]
+        written = 0
+        start = time.monotonic()
+        db.connections.close_all()
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for count in executor.map(build, jobs):
+                    written += count
+                    elapsed = time.monotonic() - start
+                    self.stdout.write("{} rows, {:.0f} rows/s".format(written, written / elapsed if elapsed else 0))
+        except BaseException:
+            shadow.drop()
+            raise
+        shadow.swap(lambda photo_ids: reindex({id: set(FIELDS) for id in photo_ids}))
+        invalidate()
+        self.stdout.write("Finished {} rows in {:.1f}s".format(written, time.monotonic() - start))
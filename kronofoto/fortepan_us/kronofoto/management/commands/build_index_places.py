@@ -1,18 +1,71 @@
 from django.core.management.base import BaseCommand
-from archive.models import Place, PlaceWordCount
+from django.db import models
+from django.db.models import Max, Min
+from django import db
+from fortepan_us.kronofoto.models import Place, PlaceWordCount
+from fortepan_us.kronofoto.shadow import ShadowTable, shadow_model
+from fortepan_us.kronofoto.search.results import invalidate
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Set, Tuple, Type
+import os
 import re
-from collections import Counter
+import time
+
+
+def place_words(model: Type[models.Model], place_ids: Iterable[int]) -> int:
+    """Write the PlaceWordCount rows of some Places with a model, which may
+    be a copy stored in a shadow table.
+
+    Returns:
+        int: The number of rows written.
+    """
+    rows = [
+        model(place_id=id, word=word)
+        for id, name in Place.objects.filter(id__in=place_ids).values_list("id", "name")
+        for word in {w for w in re.split(r"[^\w\']+", name.lower()) if w.strip()}
+    ]
+    model._default_manager.bulk_create(rows, batch_size=5000)
+    return len(rows)
+
+
+def build(job: Tuple[str, int, int]) -> int:
+    table, start, end = job
+    try:
+        return place_words(shadow_model(PlaceWordCount, table), Place.objects.filter(id__gte=start, id__lt=end).values_list("id", flat=True))
+    finally:
+        db.connections.close_all()
+
 
 class Command(BaseCommand):
     help = 'build word index for search'
 
-    def handle(self, *args, **options):
-        PlaceWordCount.objects.all().delete()
-        wordcounts = []
-        for place in Place.objects.all():
-            counts = Counter(w for w in re.split(r"[^\w\']+", place.name.lower()) if w.strip())
-            total = sum(counts.values())
-            wordcounts += [
-                PlaceWordCount(place=place, word=w) for w in counts
-            ]
-        PlaceWordCount.objects.bulk_create(wordcounts)
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--chunk-size', type=int, default=20000, help="place ids per job")
+
+    def handle(self, *args, workers, chunk_size, **options):
+        bounds = Place.objects.aggregate(first=Min("id"), last=Max("id"))
+        shadow = ShadowTable.create(PlaceWordCount, "place_id")
+        jobs = [
+            (shadow.table, start, start + chunk_size)
+            for start in range(bounds["first"] or 0, (bounds["last"] or -1) + 1, chunk_size)
+        ]
+        written = 0
+        start = time.monotonic()
+        db.connections.close_all()
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for count in executor.map(build, jobs):
+                    written += count
+                    elapsed = time.monotonic() - start
+                    self.stdout.write("{} rows, {:.0f} rows/s".format(written, written / elapsed if elapsed else 0))
+        except BaseException:
+            shadow.drop()
+            raise
+        shadow.swap(self.rebuild)
+        invalidate()
+        self.stdout.write("Finished {} rows in {:.1f}s".format(written, time.monotonic() - start))
+
+    def rebuild(self, place_ids: Set[int]) -> None:
+        PlaceWordCount.objects.filter(place_id__in=place_ids).delete()
+        place_words(PlaceWordCount, place_ids)
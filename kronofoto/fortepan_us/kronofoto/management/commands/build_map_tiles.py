@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.http import HttpRequest
+from fortepan_us.kronofoto.models import Photo, MapTile
+from fortepan_us.kronofoto.models.maptile import covering_tiles, TileAddress
+from fortepan_us.kronofoto.views.base import ArchiveRequest, ArchiveReference
+from fortepan_us.kronofoto.views.vector_tiles import PhotoMapTile
+from collections import defaultdict
+from typing import Dict, Optional, Set, Tuple
+import time
+
+Scope = Tuple[Optional[Tuple[str, str]], Optional[str]]
+
+
+class Command(BaseCommand):
+    help = "render and store the photo map tiles that contain photos"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-zoom', type=int, default=None, help="defaults to KF_MAP_TILE_MAX_ZOOM")
+        parser.add_argument('--archive', default=None, help="only tiles for the archive with this slug")
+        parser.add_argument('--overwrite', action='store_true', help="render tiles that are already stored")
+
+    def handle(self, *args, max_zoom, archive, overwrite, **options):
+        if max_zoom is None:
+            max_zoom = settings.KF_MAP_TILE_MAX_ZOOM
+        photos = Photo.objects.filter(is_published=True, year__isnull=False, location_point__isnull=False)
+        if archive:
+            photos = photos.filter(archive__slug=archive)
+        scopes: Dict[Scope, Set[TileAddress]] = defaultdict(set)
+        rows = photos.values_list("archive__slug", "archive__server_domain", "category__slug", "location_point")
+        for slug, domain, category, point in rows.iterator(chunk_size=2000):
+            tiles = covering_tiles(point, max_zoom)
+            for scope in {((slug, domain), None), ((slug, domain), category)}:
+                scopes[scope] |= tiles
+            if not archive:
+                for scope in {(None, None), (None, category)}:
+                    scopes[scope] |= tiles
+
+        count = 0
+        start = time.monotonic()
+        for (archive_key, category), addresses in scopes.items():
+            archive_ref = ArchiveReference(archive_key[0], archive_key[1] or None) if archive_key else None
+            areq = ArchiveRequest(request=HttpRequest(), archive_ref=archive_ref, category=category)
+            queryset = areq.get_photo_queryset()
+            tiles = [
+                PhotoMapTile(queryset=queryset, url_kwargs=areq.url_kwargs, get_params=areq.get_params, zoom=zoom, x=x, y=y)
+                for (zoom, x, y) in sorted(addresses)
+            ]
+            scope = tiles[0].scope
+            if not overwrite:
+                stored = set(MapTile.objects.filter(scope=scope).values_list("zoom", "x", "y"))
+                tiles = [tile for tile in tiles if (tile.zoom, tile.x, tile.y) not in stored]
+            for tile in tiles:
+                MapTile.objects.update_or_create(
+                    scope=tile.scope, zoom=tile.zoom, x=tile.x, y=tile.y,
+                    defaults={"data": tile.encode()},
+                )
+                count += 1
+            self.stdout.write("{}: {} tiles".format(scope or "all photos", len(tiles)))
+        elapsed = time.monotonic() - start
+        self.stdout.write("Rendered {} tiles in {:.1f}s".format(count, elapsed))
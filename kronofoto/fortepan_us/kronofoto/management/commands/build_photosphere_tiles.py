@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django import db
+from fortepan_us.kronofoto.models import PhotoSphere
+from fortepan_us.kronofoto.imageutil import PanoramaTiles
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+import os
+import time
+
+
+def build(job: Tuple[int, str]) -> Tuple[int, Optional[Dict[str, Any]], Optional[str]]:
+    id, name = job
+    try:
+        return id, PanoramaTiles(name=name).build(), None
+    except Exception as e:
+        return id, None, "{}: {}".format(type(e).__name__, e)
+
+
+class Command(BaseCommand):
+    help = "slice photosphere images into multi-resolution tiles"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--overwrite', action='store_true', help="rebuild photospheres that already have tiles")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+
+    def handle(self, *args, overwrite, workers, **options):
+        spheres = PhotoSphere.objects.exclude(image="").exclude(image__isnull=True)
+        if not overwrite:
+            spheres = spheres.filter(tile_set__isnull=True)
+        jobs = list(spheres.order_by("id").values_list("id", "image"))
+        counts = {"built": 0, "skipped": 0, "failed": 0}
+        start = time.monotonic()
+        db.connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for id, tile_set, error in executor.map(build, jobs):
+                if error:
+                    counts["failed"] += 1
+                    self.stderr.write("{} {}".format(id, error))
+                elif tile_set is None:
+                    counts["skipped"] += 1
+                else:
+                    PhotoSphere.objects.filter(id=id).update(tile_set=tile_set)
+                    counts["built"] += 1
+        elapsed = time.monotonic() - start
+        self.stdout.write("Finished {} photospheres in {:.1f}s: {built} built, {skipped} too small, {failed} failures".format(
+            len(jobs), elapsed, **counts,
+        ))
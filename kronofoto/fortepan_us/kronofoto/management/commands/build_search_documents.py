@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django import db
+from fortepan_us.kronofoto.models import Photo, SearchDocument
+from fortepan_us.kronofoto.models.searchdocument import enabled
+from fortepan_us.kronofoto.search.results import invalidate
+from concurrent.futures import ProcessPoolExecutor
+from typing import Tuple
+import os
+import time
+
+
+def build(job: Tuple[int, int]) -> int:
+    start, end = job
+    try:
+        return SearchDocument.objects.refresh_range(start, end)
+    finally:
+        db.connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "rebuild the full text search documents of every photo"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--chunk-size', type=int, default=5000, help="photo ids per statement")
+
+    def handle(self, *args, workers, chunk_size, **options):
+        if not enabled():
+            raise CommandError('KF_SEARCH_BACKEND is not "fulltext"')
+        bounds = Photo.objects.aggregate(first=Min("id"), last=Max("id"))
+        if bounds["first"] is None:
+            return
+        jobs = [(start, start + chunk_size) for start in range(bounds["first"], bounds["last"] + 1, chunk_size)]
+        written = 0
+        start = time.monotonic()
+        db.connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for count in executor.map(build, jobs):
+                written += count
+                elapsed = time.monotonic() - start
+                self.stdout.write("{} documents, {:.0f} documents/s".format(written, written / elapsed if elapsed else 0))
+        invalidate()
+        self.stdout.write("Finished {} documents in {:.1f}s".format(written, time.monotonic() - start))
@@ -0,0 +1,85 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django import db
+from django.db.models import Q
+from fortepan_us.kronofoto.models import Photo, ImageHash
+from fortepan_us.kronofoto.imageutil import open_original, read_hash
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple, Union
+from PIL import Image
+import os
+import time
+
+Path = Union[str, Tuple[int, str]]
+
+
+def make(job: Tuple[int, str, Optional[str]]) -> Tuple[int, Optional[int]]:
+    id, original, remote_image = job
+    path: Path = original if original else (0, remote_image or "")
+    Image.MAX_IMAGE_PIXELS = 195670000
+    try:
+        with open_original(path) as infile:
+            return id, read_hash(infile)
+    except Exception:
+        return id, None
+
+
+class Command(BaseCommand):
+    help = "report photos whose images are near duplicates of each other"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--photo', type=int, default=None, help="only report near duplicates of this photo")
+        parser.add_argument('--archive', default=None, help="only photos in the archive with this slug")
+        parser.add_argument('--distance', type=int, default=None, help="the most bits two hashes may differ by")
+        parser.add_argument('--build', action='store_true', help="first hash photos that have not been hashed")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, photo, archive, distance, build, workers, chunk_size, **options):
+        if distance is None:
+            distance = settings.KF_DUPLICATE_DISTANCE
+        if build:
+            self.build(workers=workers, chunk_size=chunk_size)
+        hashes = ImageHash.objects.all()
+        if archive:
+            hashes = hashes.filter(photo__archive__slug=archive)
+        if photo is not None:
+            try:
+                image_hash = ImageHash.objects.get(photo_id=photo)
+            except ImageHash.DoesNotExist:
+                raise CommandError("photo {} has not been hashed".format(photo))
+            matches = image_hash.near_duplicates(distance)
+            for photo_id, difference in matches:
+                self.stdout.write("{} {}".format(photo_id, difference))
+            self.stdout.write("{} near duplicates".format(len(matches)))
+            return
+        start = time.monotonic()
+        index = hashes.index()
+        groups = index.groups(distance)
+        archives = dict(Photo.objects.filter(id__in=[id for ids in groups for id in ids]).values_list("id", "archive__slug"))
+        for ids in groups:
+            self.stdout.write(" ".join("{}:{}".format(archives.get(id, ""), id) for id in ids))
+        self.stdout.write("{} groups among {} photos in {:.2f}s".format(len(groups), len(index.hashes), time.monotonic() - start))
+
+    def build(self, *, workers: int, chunk_size: int) -> None:
+        photos = Photo.objects.filter(Q(original__gt="") | Q(remote_image__isnull=False), image_hash__isnull=True)
+        last_id = 0
+        hashed = failed = 0
+        db.connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            while True:
+                chunk = list(photos.filter(id__gt=last_id).order_by("id").values_list("id", "original", "remote_image")[:chunk_size])
+                if not chunk:
+                    break
+                last_id = chunk[-1][0]
+                hashes = []
+                for id, value in executor.map(make, chunk):
+                    if value is None:
+                        failed += 1
+                        self.stderr.write("{} could not be read".format(id))
+                        continue
+                    hashes.append((id, value))
+                ImageHash.objects.record_all(hashes)
+                hashed += len(hashes)
+                self.stdout.write("{} hashed, last id {}".format(hashed, last_id))
+        self.stdout.write("Hashed {} photos, {} failed".format(hashed, failed))
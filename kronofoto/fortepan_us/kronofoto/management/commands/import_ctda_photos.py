@@ -0,0 +1,162 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.core.files import File
+from django import db
+from fortepan_us.kronofoto.models import Archive, Category, ConnecticutRecord, Donor, IngestBatch, IngestItem
+from fortepan_us.kronofoto.models.photo import Photo, get_original_path
+from fortepan_us.kronofoto.ingest import BulkIngest
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from PIL import Image
+import requests
+import tempfile
+import os
+import uuid
+
+PREFIX = "ctda/"
+
+
+def transfer(job: Tuple[int, str, str]) -> Tuple[int, Optional[str], Optional[str]]:
+    """Download a record's TIFF to a temporary file and store it as a JPEG
+    original, so only one decoded image per worker is ever in memory.
+
+    Returns:
+        tuple: The record id, the stored name or None, and an error message or None.
+    """
+    id, url, name = job
+    Image.MAX_IMAGE_PIXELS = 195670000
+    try:
+        with tempfile.TemporaryFile() as download, tempfile.TemporaryFile() as jpeg:
+            with requests.get(url, stream=True, timeout=60) as resp:
+                resp.raise_for_status()
+                for chunk in resp.iter_content(chunk_size=1 << 20):
+                    download.write(chunk)
+            download.seek(0)
+            with Image.open(download) as image:
+                if image.mode not in ("RGB", "L"):
+                    image = image.convert("RGB")
+                image.save(jpeg, "JPEG", optimize=True, quality=95)
+            jpeg.seek(0)
+            storage = Photo._meta.get_field("original").storage
+            return id, storage.save(name, File(jpeg)), None
+    except Exception as e:
+        return id, None, "{}: {}".format(type(e).__name__, e)
+
+
+class Command(BaseCommand):
+    help = "import ctda records that have no photo yet, resuming after any that failed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--archive', required=True, help="slug of the archive the photos go in")
+        parser.add_argument('--category', required=True, help="slug of the category of the photos")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="concurrent downloads and conversions")
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--limit', type=int, default=None, help="stop after this many records")
+
+    def handle(self, *args, archive, category, workers, batch_size, limit, **options):
+        try:
+            self.archive = Archive.objects.get(slug=archive)
+            self.category = Category.objects.get(slug=category)
+        except (Archive.DoesNotExist, Category.DoesNotExist) as e:
+            raise CommandError(str(e))
+        self.donors: Dict[str, int] = {}
+        counts = {"imported": 0, "failed": 0}
+        db.connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            self.resume(executor)
+            last_id = 0
+            remaining = limit
+            while remaining is None or remaining > 0:
+                size = batch_size if remaining is None else min(batch_size, remaining)
+                records = list(ConnecticutRecord.objects.filter(photo__isnull=True, id__gt=last_id).order_by("id")[:size])
+                if not records:
+                    break
+                last_id = records[-1].id
+                if remaining is not None:
+                    remaining -= len(records)
+                imported, failed = self.import_records(records, executor)
+                counts["imported"] += imported
+                counts["failed"] += failed
+                self.stdout.write("{imported} imported, {failed} failed, last id {last_id}".format(last_id=last_id, **counts))
+        self.stdout.write("Finished: {imported} imported, {failed} failed".format(**counts))
+
+    def resume(self, executor: Executor) -> None:
+        """Finish batches that an earlier run left unfinished, and link the
+        photos they created to their records.
+        """
+        items = IngestItem.objects.filter(filename__startswith=PREFIX)
+        for batch in IngestBatch.objects.filter(finished__isnull=True, id__in=items.values("batch_id")):
+            BulkIngest(batch=batch, executor=executor).run()
+        self.link(items.filter(photo__isnull=False, photo__connecticutrecord__isnull=True))
+
+    def import_records(self, records: List[ConnecticutRecord], executor: Executor) -> Tuple[int, int]:
+        by_id = {record.id: record for record in records}
+        uuids = {record.id: uuid.uuid4() for record in records}
+        jobs = [
+            (record.id, record.tiff_url(), get_original_path(Photo(uuid=uuids[record.id]), "original.jpg"))
+            for record in records
+        ]
+        batch = IngestBatch.objects.create(
+            defaults={
+                "archive_id": self.archive.id,
+                "category_id": self.category.id,
+                "is_featured": True,
+            },
+        )
+        items = []
+        failed = 0
+        for id, name, error in executor.map(transfer, jobs):
+            if name is None:
+                failed += 1
+                self.stderr.write("{} {}".format(by_id[id], error))
+                continue
+            record = by_id[id]
+            items.append(IngestItem(
+                batch=batch,
+                uuid=uuids[id],
+                filename="{}{}".format(PREFIX, record),
+                original=name,
+                fields=self.fields(record),
+            ))
+        IngestItem.objects.bulk_create(items)
+        BulkIngest(batch=batch, executor=executor).run()
+        for item in batch.items.filter(state=IngestItem.State.FAILED):
+            failed += 1
+            self.stderr.write("{} {}".format(item.filename[len(PREFIX):], item.error))
+        return self.link(batch.items.filter(photo__isnull=False)), failed
+
+    def fields(self, record: ConnecticutRecord) -> Dict[str, Any]:
+        if record.contributor not in self.donors:
+            self.donors[record.contributor] = Donor.objects.get_or_create(
+                last_name=record.contributor, archive=self.archive,
+            )[0].id
+        return {
+            "donor_id": self.donors[record.contributor],
+            "city": record.cleaned_city,
+            "county": record.cleaned_county,
+            "state": record.cleaned_state,
+            "country": record.cleaned_country,
+            "year": record.cleaned_year,
+            "caption": "{}\n\n{}".format(record.title, record.description),
+            "is_published": record.publishable,
+        }
+
+    def link(self, items: Iterable[IngestItem]) -> int:
+        """Point each record at the Photo created from it.
+
+        Returns:
+            int: The number of records linked.
+        """
+        photos = {}
+        for item in items:
+            file_id1, file_id2 = item.filename[len(PREFIX):].split(":")
+            photos[(int(file_id1), int(file_id2))] = item.photo_id
+        records = [
+            record for record in ConnecticutRecord.objects.filter(
+                photo__isnull=True, file_id1__in={key[0] for key in photos},
+            )
+            if (record.file_id1, record.file_id2) in photos
+        ]
+        for record in records:
+            record.photo_id = photos[(record.file_id1, record.file_id2)]
+        ConnecticutRecord.objects.bulk_update(records, ["photo"])
+        return len(records)
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django import db
+from fortepan_us.kronofoto.models import IngestBatch
+from fortepan_us.kronofoto.ingest import BulkIngest
+from concurrent.futures import ProcessPoolExecutor
+import os
+import time
+
+
+class Command(BaseCommand):
+    help = "process uploaded photo batches that nothing is working on, such as after a restart or when KF_INGEST_RUNNER is \"command\""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=None, help="only this batch, even if it has finished")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--loop', action='store_true', help="keep waiting for new batches instead of exiting once none are left")
+        parser.add_argument('--interval', type=float, default=5, help="seconds between checks for new batches")
+
+    def handle(self, *args, batch, workers, loop, interval, **options):
+        db.connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            while True:
+                if batch is not None:
+                    batches = list(IngestBatch.objects.filter(id=batch))
+                else:
+                    batches = list(IngestBatch.objects.claimable().order_by("id"))
+                processed = 0
+                for ingest_batch in batches:
+                    if batch is None and not IngestBatch.objects.claim(ingest_batch.id):
+                        continue
+                    BulkIngest(batch=ingest_batch, executor=executor).run()
+                    processed += 1
+                    self.stdout.write("{}: {}".format(ingest_batch, ingest_batch.progress()))
+                if not loop or batch is not None:
+                    break
+                if not processed:
+                    time.sleep(interval)
@@ -1,16 +1,147 @@
 from django.core.management.base import BaseCommand
-from fortepan_us.kronofoto.models import Photo
-from fortepan_us.kronofoto.imageutil import ImageSigner, ImageCacher
+from django.core.files.storage import default_storage
+from django.conf import settings
+from django import db
+from fortepan_us.kronofoto.models import Photo, ImageHash
+from fortepan_us.kronofoto.imageutil import DerivativePipeline, ImageCacher
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple, Union
+from os import path
+import json
+import os
+import time
+
+Path = Union[str, Tuple[int, str]]
+
+
+def render(job: Tuple[int, Path, List[Tuple[int, int, str]]]) -> Tuple[int, int, str, Optional[int], Optional[str]]:
+    id, original, missing = job
+    wanted = set(missing)
+    pipeline = DerivativePipeline(id=id, path=original, profiles=sorted({(width, height) for (width, height, _) in missing}))
+    cachers = [
+        cacher for cacher in pipeline.cachers
+        if (cacher.width or 0, cacher.height or 0, cacher.format) in wanted
+    ]
+    try:
+        rendered = pipeline.run(cachers=cachers)
+        return id, len(rendered), pipeline.placeholder, pipeline.image_hash, None
+    except Exception as e:
+        return id, 0, "", None, "{}: {}".format(type(e).__name__, e)
+
+
+class DerivativeListing:
+    """Remembers which derivatives exist, listing each `images/{block1}/{block2}`
+    directory at most once instead of checking each profile separately.
+    """
+    def __init__(self) -> None:
+        self.directories: Dict[str, Set[str]] = {}
+
+    def exists(self, cacher: ImageCacher) -> bool:
+        directory, filename = path.split(cacher.name)
+        if directory not in self.directories:
+            try:
+                self.directories[directory] = set(default_storage.listdir(directory)[1])
+            except FileNotFoundError:
+                self.directories[directory] = set()
+        return filename in self.directories[directory]
+
 
 class Command(BaseCommand):
     help = "precache photos"
 
     def add_arguments(self, parser):
-        parser.add_argument('--year', type=int, default=0)
-        parser.add_argument('--id', type=int, default=0)
-
-    def handle(self, *args, id, year, **options):
-        for photo in (Photo.objects.filter(year__gt=year)|Photo.objects.filter(year=year, id__gte=id)).order_by('year', 'id'):
-            print(photo.year, photo.id)
-            ImageSigner(id=photo.id, path=photo.original.name, width=75, height=75).cacher.precache()
-            ImageSigner(id=photo.id, path=photo.original.name, width=500, height=500).cacher.precache()
+        parser.add_argument('--id', type=int, default=None, help="start at this photo id instead of resuming after the checkpoint")
+        parser.add_argument('--archive', default=None, help="only photos in the archive with this slug")
+        parser.add_argument('--category', default=None, help="only photos in the category with this slug")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--checkpoint', default="precache-checkpoint.json", help="file recording the last finished id")
+
+    def handle(self, *args, id, archive, category, workers, chunk_size, checkpoint, **options):
+        photos = Photo.objects.all()
+        if archive:
+            photos = photos.filter(archive__slug=archive)
+        if category:
+            photos = photos.filter(category__slug=category)
+        key = "{}/{}".format(archive or "", category or "")
+        checkpoints = self.read_checkpoints(checkpoint)
+        last_id = id - 1 if id is not None else checkpoints.get(key, 0)
+        profiles = settings.KF_DERIVATIVE_PROFILES
+        listing = DerivativeListing()
+        counts = {"photos": 0, "skipped": 0, "derivatives": 0}
+        failures: List[Tuple[int, str]] = []
+        start = time.monotonic()
+        db.connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            while True:
+                chunk = list(
+                    photos.filter(id__gt=last_id)
+                    .order_by("id")
+                    .values_list("id", "original", "remote_image")[:chunk_size]
+                )
+                if not chunk:
+                    break
+                jobs = []
+                for photo_id, original, remote_image in chunk:
+                    counts["photos"] += 1
+                    if not (original or remote_image):
+                        counts["skipped"] += 1
+                        continue
+                    pipeline = DerivativePipeline(
+                        id=photo_id,
+                        path=original if original else (0, remote_image),
+                        profiles=profiles,
+                    )
+                    missing = [
+                        (cacher.width or 0, cacher.height or 0, cacher.format)
+                        for cacher in pipeline.cachers
+                        if not listing.exists(cacher)
+                    ]
+                    if missing:
+                        jobs.append((photo_id, pipeline.path, missing))
+                    else:
+                        counts["skipped"] += 1
+                placeholders = []
+                hashes = []
+                for photo_id, rendered, placeholder, image_hash, error in executor.map(render, jobs):
+                    counts["derivatives"] += rendered
+                    if placeholder:
+                        placeholders.append(Photo(id=photo_id, placeholder=placeholder))
+                    if image_hash is not None:
+                        hashes.append((photo_id, image_hash))
+                    if error:
+                        failures.append((photo_id, error))
+                        self.stderr.write("{} {}".format(photo_id, error))
+                Photo.objects.bulk_update(placeholders, ["placeholder"])
+                ImageHash.objects.record_all(hashes)
+                last_id = chunk[-1][0]
+                checkpoints[key] = last_id
+                self.write_checkpoints(checkpoint, checkpoints)
+                elapsed = time.monotonic() - start
+                self.stdout.write("{} photos, last id {}, {:.1f} photos/s".format(
+                    counts["photos"], last_id, counts["photos"] / elapsed if elapsed else 0,
+                ))
+        elapsed = time.monotonic() - start
+        self.stdout.write(
+            "Finished {photos} photos in {elapsed:.1f}s ({rate:.1f} photos/s): "
+            "{derivatives} derivatives rendered, {skipped} photos skipped, {failed} failures".format(
+                elapsed=elapsed,
+                rate=counts["photos"] / elapsed if elapsed else 0,
+                failed=len(failures),
+                **counts,
+            )
+        )
+        for photo_id, error in failures:
+            self.stdout.write("  {} {}".format(photo_id, error))
+
+    def read_checkpoints(self, filename: str) -> Dict[str, int]:
+        try:
+            with open(filename) as infile:
+                return json.load(infile)
+        except FileNotFoundError:
+            return {}
+
+    def write_checkpoints(self, filename: str, checkpoints: Dict[str, int]) -> None:
+        with open(filename + ".tmp", "w") as outfile:
+            json.dump(checkpoints, outfile)
+        os.replace(filename + ".tmp", filename)
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django import db
+from fortepan_us.kronofoto.indexing import drain
+from concurrent.futures import ProcessPoolExecutor
+import time
+
+
+def drain_all(batch_size: int) -> int:
+    processed = 0
+    try:
+        while True:
+            count = drain(batch_size)
+            if not count:
+                return processed
+            processed += count
+    finally:
+        db.connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "rebuild the search index rows queued while KF_SEARCH_INDEX_UPDATES is \"queue\""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=500, help="queued rows per transaction")
+        parser.add_argument('--loop', action='store_true', help="keep waiting for new rows instead of exiting once the queue is empty")
+        parser.add_argument('--interval', type=float, default=5, help="seconds between checks of an empty queue")
+
+    def handle(self, *args, workers, batch_size, loop, interval, **options):
+        db.connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            while True:
+                start = time.monotonic()
+                processed = sum(executor.map(drain_all, [batch_size] * workers))
+                if processed:
+                    self.stdout.write("{} updates in {:.1f}s".format(processed, time.monotonic() - start))
+                if not loop:
+                    break
+                if not processed:
+                    time.sleep(interval)
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from fortepan_us.kronofoto.models import Derivative
+from fortepan_us.kronofoto.imageutil import read_image_header
+from typing import Dict, Iterator, List, Tuple
+import hashlib
+
+
+class Command(BaseCommand):
+    help = "rebuild the derivative manifest from a listing of images/ in storage"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--checksums', action='store_true', help="read every derivative to record its dimensions and checksum")
+
+    def directories(self) -> Iterator[str]:
+        for block1 in default_storage.listdir("images")[0]:
+            for block2 in default_storage.listdir("images/{}".format(block1))[0]:
+                yield "images/{}/{}".format(block1, block2)
+
+    def handle(self, *args, checksums, **options):
+        counts = {"added": 0, "updated": 0, "removed": 0}
+        for directory in self.directories():
+            names = {"{}/{}".format(directory, filename) for filename in default_storage.listdir(directory)[1]}
+            entries: Dict[str, Tuple[int, str]] = {
+                name: (size, checksum)
+                for (name, size, checksum) in Derivative.objects.filter(name__startswith=directory + "/").values_list("name", "size", "checksum")
+            }
+            stale = [name for name in entries if name not in names]
+            if stale:
+                counts["removed"] += Derivative.objects.filter(name__in=stale).delete()[0]
+            records: List[Derivative] = []
+            for name in sorted(names):
+                size = default_storage.size(name)
+                entry = entries.get(name)
+                if entry and entry[0] == size and (entry[1] or not checksums):
+                    continue
+                record = Derivative(name=name, size=size, modified=timezone.now())
+                if checksums:
+                    with default_storage.open(name) as infile:
+                        data = infile.read()
+                        record.checksum = hashlib.sha1(data).hexdigest()
+                        try:
+                            header = read_image_header(infile)
+                            record.width, record.height = header.width, header.height
+                        except OSError:
+                            pass
+                records.append(record)
+                counts["updated" if entry else "added"] += 1
+            if records:
+                Derivative.objects.bulk_create(
+                    records,
+                    update_conflicts=True,
+                    unique_fields=["name"],
+                    update_fields=["size", "modified", "checksum", "width", "height"],
+                )
+        self.stdout.write("{added} added, {updated} updated, {removed} removed".format(**counts))
@@ -79,6 +79,9 @@ class OverrideVaryMiddleware:
         response = self.get_response(request)
         if hasattr(response, "override_vary"):
             del response.headers['Vary']
+            vary = getattr(response, "override_vary")
+            if isinstance(vary, str) and vary:
+                response.headers['Vary'] = vary
             response.cookies.clear()
         return response
 
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.20 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kronofoto', '0150_photo_license_submission_license'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='original_orientation',
+            field=models.SmallIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.20 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kronofoto', '0151_photo_original_orientation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MapTile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=256)),
+                ('zoom', models.SmallIntegerField()),
+                ('x', models.IntegerField()),
+                ('y', models.IntegerField()),
+                ('data', models.BinaryField()),
+                ('rendered', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['zoom', 'x', 'y'], name='map_tile_address')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='maptile',
+            constraint=models.UniqueConstraint(fields=('scope', 'zoom', 'x', 'y'), name='unique_map_tile'),
+        ),
+    ]
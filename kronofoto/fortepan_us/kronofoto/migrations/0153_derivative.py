@@ -0,0 +1,27 @@
+# Generated by Django 4.2.20 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kronofoto', '0152_maptile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Derivative',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.IntegerField()),
+                ('width', models.IntegerField(blank=True, null=True)),
+                ('height', models.IntegerField(blank=True, null=True)),
+                ('checksum', models.CharField(blank=True, max_length=40)),
+                ('modified', models.DateTimeField()),
+                ('photo', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='kronofoto.photo')),
+            ],
+        ),
+    ]
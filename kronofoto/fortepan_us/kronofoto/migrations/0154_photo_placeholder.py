@@ -0,0 +1,18 @@
+# Generated by Django 4.2.20 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kronofoto', '0153_derivative'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='placeholder',
+            field=models.CharField(blank=True, default='', editable=False, max_length=512),
+        ),
+    ]
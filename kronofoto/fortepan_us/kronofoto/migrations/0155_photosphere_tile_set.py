@@ -0,0 +1,18 @@
+# Generated by Django 4.2.20 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kronofoto', '0154_photo_placeholder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photosphere',
+            name='tile_set',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
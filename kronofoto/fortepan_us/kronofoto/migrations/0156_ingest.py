@@ -0,0 +1,44 @@
+# Generated by Django 4.2.20 on 2026-10-18 12:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('kronofoto', '0155_photosphere_tile_set'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestBatch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('defaults', models.JSONField(default=dict)),
+                ('terms', models.JSONField(default=list)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='IngestItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('filename', models.CharField(max_length=256)),
+                ('uuid', models.UUIDField(default=uuid.uuid4, editable=False)),
+                ('original', models.CharField(max_length=256)),
+                ('state', models.CharField(choices=[('queued', 'Queued'), ('created', 'Photo created'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=16)),
+                ('error', models.TextField(blank=True)),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='kronofoto.ingestbatch')),
+                ('photo', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='kronofoto.photo')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['batch', 'state'], name='ingest_item_state')],
+            },
+        ),
+    ]
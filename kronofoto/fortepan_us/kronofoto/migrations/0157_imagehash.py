@@ -0,0 +1,25 @@
+# Generated by Django 4.2.20 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kronofoto', '0156_ingest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageHash',
+            fields=[
+                ('photo', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='image_hash', serialize=False, to='kronofoto.photo')),
+                ('value', models.BigIntegerField()),
+                ('band0', models.IntegerField(db_index=True)),
+                ('band1', models.IntegerField(db_index=True)),
+                ('band2', models.IntegerField(db_index=True)),
+                ('band3', models.IntegerField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.20 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kronofoto', '0157_imagehash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestitem',
+            name='fields',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
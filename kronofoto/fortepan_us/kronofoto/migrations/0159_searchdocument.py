@@ -0,0 +1,35 @@
+# Generated by Django 4.2.20 on 2026-10-18 12:00
+
+import django.contrib.postgres.search
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_gin_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(
+            "CREATE INDEX kronofoto_searchdocument_gin ON kronofoto_searchdocument USING gin (document)"
+        )
+
+
+def drop_gin_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS kronofoto_searchdocument_gin")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kronofoto', '0158_ingestitem_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('photo', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='kronofoto.photo')),
+                ('document', django.contrib.postgres.search.SearchVectorField(null=True)),
+            ],
+        ),
+        migrations.RunPython(create_gin_index, drop_gin_index),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.20 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kronofoto', '0159_searchdocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexUpdate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(choices=[('CA', 'Caption'), ('PL', 'Place'), ('TA', 'Tag'), ('TE', 'Term')], max_length=2)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('photo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='kronofoto.photo')),
+            ],
+        ),
+    ]
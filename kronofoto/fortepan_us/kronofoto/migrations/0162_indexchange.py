@@ -0,0 +1,21 @@
+# Generated by Django 4.2.20 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kronofoto', '0161_ingestbatch_heartbeat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('photo_id', models.IntegerField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -32,3 +32,9 @@ from .place import Place, PlaceType
 from .exhibit import Exhibit, Card, PhotoCard, Figure
 from .key import Key
 from .ldid import LdId
+from .maptile import MapTile
+from .derivative import Derivative
+from .ingest import IngestBatch, IngestItem
+from .imagehash import ImageHash, HammingIndex, hamming_distance
+from .searchdocument import SearchDocument
+from .indexupdate import IndexUpdate, IndexChange
@@ -0,0 +1,68 @@
+from django.core.files.storage import default_storage
+from django.db import models
+from django.utils import timezone
+from typing import Iterable, Optional, Tuple
+
+
+class DerivativeQuerySet(models.QuerySet):
+    def record(
+        self,
+        name: str,
+        *,
+        size: int,
+        photo_id: Optional[int] = None,
+        dimensions: Optional[Tuple[int, int]] = None,
+        checksum: str = "",
+    ) -> "Derivative":
+        """Record that a derivative has been stored.
+
+        Args:
+            name (str): The storage name.
+            size (int): The size in bytes.
+            photo_id (int, optional): The Photo it was rendered from, if known.
+            dimensions (tuple[int, int], optional): Width and height, if known.
+            checksum (str): The sha1 of the data, if known.
+
+        Returns:
+            Derivative: The manifest entry.
+        """
+        defaults = {"size": size, "checksum": checksum, "modified": timezone.now()}
+        if photo_id is not None:
+            defaults["photo_id"] = photo_id
+        if dimensions is not None:
+            defaults["width"], defaults["height"] = dimensions
+        obj, _ = self.update_or_create(name=name, defaults=defaults)
+        return obj
+
+    def discard(self, names: Iterable[str] = ()) -> None:
+        """Delete these derivatives and the named ones from storage and from
+        the manifest, so they are rendered again on their next request.
+
+        Args:
+            names (iterable[str]): More storage names, which may not be in the manifest.
+        """
+        names = set(names)
+        names.update(self.values_list("name", flat=True))
+        for name in names:
+            default_storage.delete(name)
+        Derivative.objects.filter(name__in=names).delete()
+
+
+class Derivative(models.Model):
+    """Manifest of the resized images in storage.
+
+    Image requests consult this instead of asking storage whether a
+    derivative exists. Entries are added when derivatives are rendered or
+    found in storage, and can be rebuilt from a storage listing with the
+    reconcile_derivatives command. The photo is only a hint for invalidation,
+    so it is not enforced by the database.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    photo = models.ForeignKey("kronofoto.Photo", null=True, blank=True, on_delete=models.CASCADE, db_constraint=False)
+    size = models.IntegerField()
+    width = models.IntegerField(null=True, blank=True)
+    height = models.IntegerField(null=True, blank=True)
+    checksum = models.CharField(max_length=40, blank=True)
+    modified = models.DateTimeField()
+
+    objects = DerivativeQuerySet.as_manager()
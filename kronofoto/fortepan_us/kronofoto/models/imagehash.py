@@ -0,0 +1,200 @@
+from django.db import models
+from functools import lru_cache
+from itertools import combinations
+from typing import Dict, Iterable, List, Set, Tuple
+
+HASH_BITS = 64
+BANDS = 4
+BAND_BITS = HASH_BITS // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+HASH_MASK = (1 << HASH_BITS) - 1
+
+
+def to_signed(value: int) -> int:
+    """Convert an unsigned 64 bit hash to the signed value a BigIntegerField stores."""
+    value &= HASH_MASK
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """Count the bits that differ between two hashes, signed or not."""
+    return bin((a ^ b) & HASH_MASK).count("1")
+
+
+def split_bands(value: int) -> List[int]:
+    """Split a hash into BANDS unsigned values of BAND_BITS bits each."""
+    value &= HASH_MASK
+    return [(value >> (BAND_BITS * i)) & BAND_MASK for i in range(BANDS)]
+
+
+@lru_cache(maxsize=None)
+def flip_masks(radius: int) -> Tuple[int, ...]:
+    """List the masks that flip at most `radius` bits of a band."""
+    masks = [0]
+    for count in range(1, radius + 1):
+        for bits in combinations(range(BAND_BITS), count):
+            masks.append(sum(1 << bit for bit in bits))
+    return tuple(masks)
+
+
+def band_neighbors(band: int, radius: int) -> List[int]:
+    """List every band value within `radius` bits of `band`, including itself."""
+    return [band ^ mask for mask in flip_masks(radius)]
+
+
+class HammingIndex:
+    """Multi-index hashing over the bands of 64 bit hashes.
+
+    If two hashes differ in at most `distance` bits, then by the pigeonhole
+    principle at least one of their BANDS bands differs in at most
+    `distance // BANDS` bits. Looking up the neighbors of each band in a
+    dictionary therefore finds every candidate, and only the candidates are
+    compared in full.
+    """
+    def __init__(self, hashes: Iterable[Tuple[int, int]]):
+        self.hashes: Dict[int, int] = {}
+        self.bands: List[Dict[int, List[int]]] = [{} for _ in range(BANDS)]
+        for id, value in hashes:
+            self.hashes[id] = value
+            for band, table in zip(split_bands(value), self.bands):
+                table.setdefault(band, []).append(id)
+
+    def query(self, value: int, distance: int) -> List[Tuple[int, int]]:
+        """Find the hashes within `distance` bits of `value`.
+
+        Args:
+            value (int): The hash to look up.
+            distance (int): The greatest number of differing bits.
+
+        Returns:
+            list[tuple[int, int]]: (id, distance) pairs, closest first.
+        """
+        masks = flip_masks(distance // BANDS)
+        candidates: Set[int] = set()
+        for band, table in zip(split_bands(value), self.bands):
+            for mask in masks:
+                ids = table.get(band ^ mask)
+                if ids:
+                    candidates.update(ids)
+        matches = []
+        for id in candidates:
+            difference = hamming_distance(value, self.hashes[id])
+            if difference <= distance:
+                matches.append((id, difference))
+        matches.sort(key=lambda match: (match[1], match[0]))
+        return matches
+
+    def groups(self, distance: int) -> List[List[int]]:
+        """Cluster the ids whose hashes are within `distance` bits of each
+        other, directly or through other members of the cluster.
+
+        Returns:
+            list[list[int]]: Clusters of at least two ids, largest first.
+        """
+        parents = {id: id for id in self.hashes}
+
+        def find(id: int) -> int:
+            while parents[id] != id:
+                parents[id] = parents[parents[id]]
+                id = parents[id]
+            return id
+
+        for id, value in self.hashes.items():
+            for other, _ in self.query(value, distance):
+                a, b = find(id), find(other)
+                if a != b:
+                    parents[max(a, b)] = min(a, b)
+        clusters: Dict[int, List[int]] = {}
+        for id in sorted(self.hashes):
+            clusters.setdefault(find(id), []).append(id)
+        groups = [ids for ids in clusters.values() if len(ids) > 1]
+        groups.sort(key=lambda ids: (-len(ids), ids[0]))
+        return groups
+
+
+class ImageHashQuerySet(models.QuerySet):
+    def record(self, photo_id: int, value: int) -> "ImageHash":
+        """Store the hash of a Photo's image.
+
+        Args:
+            photo_id (int): The Photo.
+            value (int): Its 64 bit hash.
+
+        Returns:
+            ImageHash: The stored hash.
+        """
+        obj, _ = self.update_or_create(photo_id=photo_id, defaults=ImageHash.fields_for(value))
+        return obj
+
+    def record_all(self, hashes: Iterable[Tuple[int, int]]) -> None:
+        """Store many hashes at once.
+
+        Args:
+            hashes (iterable[tuple[int, int]]): (photo id, hash) pairs.
+        """
+        objs = [ImageHash(photo_id=photo_id, **ImageHash.fields_for(value)) for photo_id, value in hashes]
+        self.bulk_create(
+            objs,
+            update_conflicts=True,
+            unique_fields=["photo"],
+            update_fields=["value", "band0", "band1", "band2", "band3"],
+            batch_size=1000,
+        )
+
+    def near(self, value: int, distance: int) -> List[Tuple[int, int]]:
+        """Find the Photos whose images are within `distance` bits of a hash,
+        using the indexed band columns to narrow the candidates.
+
+        Args:
+            value (int): The hash to look up.
+            distance (int): The greatest number of differing bits.
+
+        Returns:
+            list[tuple[int, int]]: (photo id, distance) pairs, closest first.
+        """
+        radius = distance // BANDS
+        q = models.Q()
+        for i, band in enumerate(split_bands(value)):
+            q |= models.Q(**{"band{}__in".format(i): band_neighbors(band, radius)})
+        return HammingIndex(self.filter(q).values_list("photo_id", "value")).query(value, distance)
+
+    def index(self) -> HammingIndex:
+        """Load these hashes into memory for many lookups."""
+        return HammingIndex(self.values_list("photo_id", "value").iterator(chunk_size=10000))
+
+
+class ImageHash(models.Model):
+    """A 64 bit difference hash (dHash) of a Photo's image, for finding near
+    duplicates such as rescans or the same print donated to two archives.
+
+    The hash is also split into four 16 bit bands in indexed columns, so
+    that a lookup only compares the photos sharing a nearly equal band.
+    Hashes are stored whenever derivatives are rendered.
+    """
+    photo = models.OneToOneField("kronofoto.Photo", on_delete=models.CASCADE, primary_key=True, related_name="image_hash")
+    value = models.BigIntegerField()
+    band0 = models.IntegerField(db_index=True)
+    band1 = models.IntegerField(db_index=True)
+    band2 = models.IntegerField(db_index=True)
+    band3 = models.IntegerField(db_index=True)
+
+    objects = ImageHashQuerySet.as_manager()
+
+    @staticmethod
+    def fields_for(value: int) -> Dict[str, int]:
+        fields = {"value": to_signed(value)}
+        for i, band in enumerate(split_bands(value)):
+            fields["band{}".format(i)] = band
+        return fields
+
+    def near_duplicates(self, distance: int) -> List[Tuple[int, int]]:
+        """Find other Photos within `distance` bits of this one.
+
+        Returns:
+            list[tuple[int, int]]: (photo id, distance) pairs, closest first.
+        """
+        return [
+            (photo_id, difference)
+            for photo_id, difference in ImageHash.objects.near(self.value, distance)
+            if photo_id != self.photo_id
+        ]
@@ -0,0 +1,50 @@
+from django.db import models
+from typing import Iterable
+
+
+class IndexUpdateQuerySet(models.QuerySet):
+    def enqueue(self, photo_ids: Iterable[int], fields: Iterable[str]) -> None:
+        """Queue some WordCount fields of some Photos to be rebuilt.
+
+        Args:
+            photo_ids (iterable[int]): The changed Photos.
+            fields (iterable[str]): The WordCount fields to rebuild, such as "CA".
+        """
+        fields = list(fields)
+        self.bulk_create([
+            IndexUpdate(photo_id=photo_id, field=field) for photo_id in set(photo_ids) for field in fields
+        ])
+
+
+class IndexUpdate(models.Model):
+    """A queued rebuild of one WordCount field of a Photo, for when
+    `KF_SEARCH_INDEX_UPDATES` is "queue".
+
+    Rows are written in the same transaction as the change, so an update is
+    never lost, and drained by the process_index_updates command. Repeated
+    updates to the same Photo are not merged when queued but when drained.
+    """
+    FIELDS = [
+        ("CA", "Caption"),
+        ("PL", "Place"),
+        ("TA", "Tag"),
+        ("TE", "Term"),
+    ]
+    photo = models.ForeignKey("kronofoto.Photo", on_delete=models.CASCADE)
+    field = models.CharField(max_length=2, choices=FIELDS)
+    created = models.DateTimeField(auto_now_add=True)
+
+    objects = IndexUpdateQuerySet.as_manager()
+
+
+class IndexChange(models.Model):
+    """A Photo whose WordCount rows were rebuilt, for when
+    `KF_SEARCH_BACKEND` is "memory".
+
+    Each process's search index reloads the Photos changed since it last
+    looked, which also catches rows that were deleted without replacement.
+    The photo is not a foreign key, so deleting it keeps the change. Changes
+    are pruned once they are older than twice `KF_SEARCH_INDEX_MAX_AGE`.
+    """
+    photo_id = models.IntegerField()
+    created = models.DateTimeField(auto_now_add=True)
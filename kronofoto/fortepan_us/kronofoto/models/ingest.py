@@ -0,0 +1,97 @@
+from django.db import models
+from django.conf import settings
+from django.utils import timezone
+from datetime import timedelta
+from typing import Dict
+import uuid
+
+
+class IngestBatchQuerySet(models.QuerySet):
+    def claimable(self) -> "IngestBatchQuerySet":
+        """Get the unfinished batches that nothing is working on: those that
+        have not started, and those whose heartbeat is older than
+        `KF_INGEST_STALLED_AFTER` seconds.
+        """
+        cutoff = timezone.now() - timedelta(seconds=settings.KF_INGEST_STALLED_AFTER)
+        return self.filter(finished__isnull=True).filter(models.Q(heartbeat__isnull=True) | models.Q(heartbeat__lt=cutoff))
+
+    def claim(self, id: int) -> bool:
+        """Start working on a batch, unless something else already is.
+
+        Args:
+            id (int): The batch.
+
+        Returns:
+            bool: Whether the batch was claimed.
+        """
+        return self.claimable().filter(id=id).update(heartbeat=timezone.now()) == 1
+
+
+class IngestBatch(models.Model):
+    """A batch of originals uploaded together in the admin, which all get the
+    same metadata.
+
+    `defaults` holds the Photo field values by attribute name, such as
+    `archive_id` and `year`, and `terms` holds the Term ids. `heartbeat` is
+    updated while the batch is being worked on, so a batch abandoned by a
+    restart can be told apart from one that is still running.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True)
+    defaults = models.JSONField(default=dict)
+    terms = models.JSONField(default=list)
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    heartbeat = models.DateTimeField(null=True, blank=True)
+
+    objects = IngestBatchQuerySet.as_manager()
+
+    def stalled(self) -> bool:
+        """Determine whether the batch is unfinished and nothing has worked on
+        it for `KF_INGEST_STALLED_AFTER` seconds.
+        """
+        if self.finished:
+            return False
+        return timezone.now() - (self.heartbeat or self.created) > timedelta(seconds=settings.KF_INGEST_STALLED_AFTER)
+
+    def progress(self) -> Dict[str, int]:
+        """Count the items in each state.
+
+        Returns:
+            dict[str, int]: The number of items by state value, and the total.
+        """
+        counts = {state: 0 for state in IngestItem.State.values}
+        for state, count in self.items.values_list("state").annotate(count=models.Count("id")).order_by():
+            counts[state] = count
+        counts["total"] = sum(counts.values())
+        return counts
+
+    def __str__(self) -> str:
+        return "Batch {} ({})".format(self.id, self.created)
+
+
+class IngestItem(models.Model):
+    """One uploaded file in an IngestBatch.
+
+    `fields` holds Photo field values by attribute name that override the
+    batch defaults for this file, for imports whose records each have their
+    own caption, donor or location.
+    """
+    class State(models.TextChoices):
+        QUEUED = "queued", "Queued"
+        CREATED = "created", "Photo created"
+        DONE = "done", "Done"
+        FAILED = "failed", "Failed"
+
+    batch = models.ForeignKey(IngestBatch, on_delete=models.CASCADE, related_name="items")
+    filename = models.CharField(max_length=256)
+    uuid = models.UUIDField(default=uuid.uuid4, editable=False)
+    original = models.CharField(max_length=256)
+    fields = models.JSONField(default=dict, blank=True)
+    state = models.CharField(max_length=16, choices=State.choices, default=State.QUEUED)
+    photo = models.ForeignKey("kronofoto.Photo", on_delete=models.SET_NULL, null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["batch", "state"], name="ingest_item_state"),
+        ]
@@ -0,0 +1,95 @@
+from django.db import models
+from django.db.models import Q
+from django.contrib.gis.geos import Point
+from typing import Callable, Iterable, Optional, Set, Tuple
+import mercantile # type: ignore
+
+TileAddress = Tuple[int, int, int]
+
+
+def covering_tiles(point: Point, max_zoom: int) -> Set[TileAddress]:
+    """Get the addresses of every tile from zoom 0 to `max_zoom` that contains
+    a point. A point on a tile edge is in the tiles on both sides.
+
+    Args:
+        point (Point): A point in EPSG:4326.
+        max_zoom (int): The highest zoom level to include.
+
+    Returns:
+        set[tuple[int, int, int]]: (zoom, x, y) for each tile.
+    """
+    eps = 1e-9
+    return {
+        (tile.z, tile.x, tile.y)
+        for tile in mercantile.tiles(
+            point.x - eps, point.y - eps, point.x + eps, point.y + eps,
+            zooms=list(range(max_zoom + 1)),
+        )
+    }
+
+
+class MapTileQuerySet(models.QuerySet):
+    def get_or_render(self, *, scope: str, zoom: int, x: int, y: int, render: Callable[[], bytes]) -> bytes:
+        """Get a stored tile, rendering and storing it if it does not exist.
+
+        Args:
+            scope (str): Identifies the archive and category the tile was rendered for.
+            zoom (int): tile zoom level
+            x (int): tile x index
+            y (int): tile y index
+            render (callable): Renders the tile if it is not stored.
+
+        Returns:
+            bytes: The encoded tile.
+        """
+        data = self.filter(scope=scope, zoom=zoom, x=x, y=y).values_list("data", flat=True).first()
+        if data is None:
+            data = render()
+            self.update_or_create(scope=scope, zoom=zoom, x=x, y=y, defaults={"data": data})
+        return bytes(data)
+
+    def invalidate(self, points: Iterable[Optional[Point]], max_zoom: int) -> int:
+        """Delete the tiles containing any of these points, in every scope.
+
+        Args:
+            points (iterable): Locations that changed. None values are ignored.
+            max_zoom (int): The highest zoom level tiles are stored for.
+
+        Returns:
+            int: The number of tiles deleted.
+        """
+        addresses: Set[TileAddress] = set()
+        for point in points:
+            if point is not None:
+                addresses |= covering_tiles(point, max_zoom)
+        if not addresses:
+            return 0
+        q = Q()
+        for zoom, x, y in addresses:
+            q |= Q(zoom=zoom, x=x, y=y)
+        return self.filter(q).delete()[0]
+
+
+class MapTile(models.Model):
+    """A rendered photo map tile.
+
+    Tiles are only stored for unfiltered maps of all photos, an archive, a
+    category or both, up to `KF_MAP_TILE_MAX_ZOOM`. They are deleted when a
+    photo inside them is added, moved, published, unpublished or redated.
+    """
+    scope = models.CharField(max_length=256)
+    zoom = models.SmallIntegerField()
+    x = models.IntegerField()
+    y = models.IntegerField()
+    data = models.BinaryField()
+    rendered = models.DateTimeField(auto_now=True)
+
+    objects = MapTileQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["scope", "zoom", "x", "y"], name="unique_map_tile"),
+        ]
+        indexes = [
+            models.Index(fields=["zoom", "x", "y"], name="map_tile_address"),
+        ]
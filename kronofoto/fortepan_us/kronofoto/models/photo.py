@@ -34,6 +34,7 @@ import uuid
 from PIL import Image, ExifTags, ImageOps, UnidentifiedImageError
 from io import BytesIO
 import os
+import math
 from os import path
 import operator
 from bisect import bisect_left
@@ -63,7 +64,7 @@ from typing import (
     Union,
 )
 from typing_extensions import Self
-from fortepan_us.kronofoto.imageutil import ImageSigner
+from fortepan_us.kronofoto.imageutil import ImageSigner, read_image_header, TRANSPOSED_ORIENTATIONS, PLACEHOLDER_MAX_LENGTH
 from itertools import chain, cycle, islice
 from typing import Dict, Any, List, Optional, Set, Tuple, Protocol, TypeVar, Generic
 from typing_extensions import Self
@@ -402,6 +403,36 @@ class Submission(PhotoBase):
 
 class ResizerBase(Protocol):
     """Base for resize images functions."""
+    original_width: int
+    original_height: int
+
+    @property
+    def crop_box(self) -> Tuple[int, int, int, int]:
+        """The part of the original that ends up in the output.
+
+        Returns:
+            tuple[int, int, int, int]: left, top, right, bottom
+        """
+        return (0, 0, self.original_width, self.original_height)
+
+    @property
+    def draft_size(self) -> Tuple[int, int]:
+        """The smallest size the whole original can be reduced to before
+        cropping and resizing without making the output any less sharp.
+
+        Returns:
+            tuple[int, int]: width, height
+        """
+        left, top, right, bottom = self.crop_box
+        scale = max(
+            self.output_width / max(right - left, 1),
+            self.output_height / max(bottom - top, 1),
+        )
+        return (
+            max(1, math.ceil(self.original_width * scale)),
+            max(1, math.ceil(self.original_height * scale)),
+        )
+
     @property
     def output_height(self) -> int:
         "Desired height"
@@ -514,6 +545,10 @@ class FixedResizer(ResizerBase):
             round(yoff + adjusted_output_height),
         )
 
+    @property
+    def crop_box(self) -> Tuple[int, int, int, int]:
+        return self.crop_coords
+
     def crop_image(self, *, image: Image.Image) -> Image.Image:
         return image.crop(self.crop_coords)
 
@@ -532,6 +567,7 @@ class ImageData:
     width: int
     url: str
     name: str
+    placeholder: str = ""
 
 
 class LabelProtocol(Protocol):
@@ -557,6 +593,8 @@ class Photo(PhotoBase):
     places = models.ManyToManyField("kronofoto.Place", editable=False)
     original_height = models.IntegerField(default=0, editable=False)
     original_width = models.IntegerField(default=0, editable=False)
+    original_orientation = models.SmallIntegerField(default=0, editable=False)
+    placeholder = models.CharField(max_length=PLACEHOLDER_MAX_LENGTH, blank=True, default="", editable=False)
 
     @property
     def fullsizeurl(self) -> str:
@@ -617,20 +655,48 @@ class Photo(PhotoBase):
             )
 
     def get_image_dimensions(self) -> Tuple[int, int]:
-        """Gets the image dimensions, and saves the result in the table if doing so required loading the image file.
+        """Gets the image dimensions, and saves them and the EXIF orientation in the table if doing so required reading the image header.
+
+        A missing orientation alone is left to the backfill_dimensions command, so rows that predate it are not read on every render.
 
         Returns:
             tuple[int, int]: width, height
         """
         if self.original_height == 0 or self.original_width == 0:
-            Image.MAX_IMAGE_PIXELS = 195670000
-            self.original_height = self.original.height
-            self.original_width = self.original.width
+            with self.original.storage.open(self.original.name) as infile:
+                header = read_image_header(infile)
+            self.original_width = header.width
+            self.original_height = header.height
+            self.original_orientation = header.orientation
             Photo.objects.filter(id=self.id).update(
-                original_height=self.original_height, original_width=self.original_width
+                original_height=self.original_height,
+                original_width=self.original_width,
+                original_orientation=self.original_orientation,
             )
         return (self.original_width, self.original_height)
 
+    def get_upright_dimensions(self) -> Tuple[int, int]:
+        """Gets the image dimensions after its EXIF orientation is applied.
+
+        Returns:
+            tuple[int, int]: width, height
+        """
+        width, height = self.get_image_dimensions()
+        if self.original_orientation in TRANSPOSED_ORIENTATIONS:
+            return (height, width)
+        return (width, height)
+
+    def capture_image_header(self) -> None:
+        """Set the dimensions and EXIF orientation from a newly assigned
+        original, reading only the image header, and clear the placeholder
+        of the previous original.
+        """
+        header = read_image_header(self.original.file)
+        self.original_width = header.width
+        self.original_height = header.height
+        self.original_orientation = header.orientation
+        self.placeholder = ""
+
     @property
     def h700(self) -> Optional[ImageData]:
         """Get ImageData for a 700 pixel tall version of this Photo.
@@ -647,7 +713,7 @@ class Photo(PhotoBase):
             width, height = 0, 700
         elif self.original:
             path = self.original.name
-            width, height = self.get_image_dimensions()
+            width, height = self.get_upright_dimensions()
         else:
             raise ValueError
         signer = ImageSigner(id=self.id, path=path, width=0, height=700)
@@ -656,6 +722,7 @@ class Photo(PhotoBase):
             width=round(width*700/height),
             url=signer.url,
             name="h700",
+            placeholder=self.placeholder,
         )
 
     @property
@@ -678,6 +745,7 @@ class Photo(PhotoBase):
             width=75,
             url=signer.url,
             name="thumbnail",
+            placeholder=self.placeholder,
         )
 
     tags = models.ManyToManyField(
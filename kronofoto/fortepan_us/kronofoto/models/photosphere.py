@@ -97,6 +97,7 @@ class PhotoSphere(models.Model):
         null=True,
         editable=True,
     )
+    tile_set = models.JSONField(null=True, blank=True, editable=False)
     heading = models.FloatField(
         default=0,
         validators=[
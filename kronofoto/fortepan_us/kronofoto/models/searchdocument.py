@@ -0,0 +1,98 @@
+from django.db import models, connection
+from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
+from typing import Iterable, List
+
+# Each indexed field gets its own tsvector weight, so queries can be
+# restricted to a field with a weight label such as 'word':B.
+WEIGHTS = {
+    "caption": "A",
+    "tag": "B",
+    "term": "C",
+    "place": "D",
+}
+
+DOCUMENT_SQL = """
+INSERT INTO {document} (photo_id, document)
+SELECT p.id,
+    setweight(to_tsvector('simple', coalesce(p.caption, '')), '{caption}')
+    || setweight(to_tsvector('simple', coalesce((
+        SELECT string_agg(t.tag, ' ') FROM {phototag} pt JOIN {tag_table} t ON t.id = pt.tag_id
+        WHERE pt.photo_id = p.id AND pt.accepted
+    ), '')), '{tag}')
+    || setweight(to_tsvector('simple', coalesce((
+        SELECT string_agg(t.term, ' ') FROM {photo_terms} pt JOIN {term_table} t ON t.id = pt.term_id
+        WHERE pt.photo_id = p.id
+    ), '')), '{term}')
+    || setweight(to_tsvector('simple', coalesce((
+        SELECT string_agg(pl.name, ' ') FROM {photo_places} pp JOIN {place_table} pl ON pl.id = pp.place_id
+        WHERE pp.photo_id = p.id
+    ), '')), '{place}')
+FROM {photo} p
+WHERE {where}
+ON CONFLICT (photo_id) DO UPDATE SET document = EXCLUDED.document
+"""
+
+
+def enabled() -> bool:
+    """Check whether the full text search backend is selected."""
+    return settings.KF_SEARCH_BACKEND == "fulltext"
+
+
+class SearchDocumentQuerySet(models.QuerySet):
+    def document_sql(self, where: str) -> str:
+        from .photo import Photo, PhotoTag
+        from .tag import Tag
+        from .term import Term
+        from .place import Place
+        return DOCUMENT_SQL.format(
+            document=SearchDocument._meta.db_table,
+            photo=Photo._meta.db_table,
+            phototag=PhotoTag._meta.db_table,
+            tag_table=Tag._meta.db_table,
+            photo_terms=Photo.terms.through._meta.db_table,
+            term_table=Term._meta.db_table,
+            photo_places=Photo.places.through._meta.db_table,
+            place_table=Place._meta.db_table,
+            where=where,
+            **WEIGHTS,
+        )
+
+    def refresh(self, photo_ids: Iterable[int]) -> None:
+        """Rebuild the documents of some Photos from their caption, accepted
+        tags, terms and places. Does nothing unless the full text backend is
+        selected.
+
+        Args:
+            photo_ids (iterable[int]): The Photos to rebuild.
+        """
+        ids: List[int] = list(photo_ids)
+        if not ids or not enabled():
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(self.document_sql("p.id = ANY(%s)"), [ids])
+
+    def refresh_range(self, start: int, end: int) -> int:
+        """Rebuild the documents of the Photos with ids in [start, end).
+
+        Returns:
+            int: The number of documents written.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(self.document_sql("p.id >= %s AND p.id < %s"), [start, end])
+            return cursor.rowcount
+
+
+class SearchDocument(models.Model):
+    """A weighted tsvector of a Photo's caption, tags, terms and places, for
+    the PostgreSQL full text search backend.
+
+    Only used when `KF_SEARCH_BACKEND` is "fulltext". Documents are rebuilt
+    after changes to a Photo, its tags or its terms, and can be rebuilt for
+    every Photo with the build_search_documents command. The GIN index is
+    only created on PostgreSQL.
+    """
+    photo = models.OneToOneField("kronofoto.Photo", on_delete=models.CASCADE, primary_key=True, related_name="search_document")
+    document = SearchVectorField(null=True)
+
+    objects = SearchDocumentQuerySet.as_manager()
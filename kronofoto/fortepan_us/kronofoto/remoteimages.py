@@ -0,0 +1,223 @@
+from dataclasses import dataclass, field
+from functools import cached_property, lru_cache
+from django.conf import settings
+from typing import Any, Dict, IO, List, Optional, Tuple
+from requests.adapters import HTTPAdapter
+import hashlib
+import json
+import os
+import requests
+import tempfile
+import threading
+import time
+
+
+class RemoteImageError(Exception):
+    """Raised when a remote original cannot be fetched."""
+
+
+@dataclass
+class RemoteOriginalCache:
+    """Fetches originals of federated photos and keeps them on disk, so every
+    profile of a `remote_image` photo is rendered from one download.
+
+    Cached copies are used as is for `revalidate_after` seconds and are then
+    revalidated with their ETag or Last-Modified header. Failures are
+    remembered for `failure_ttl` seconds so a slow or broken server is not
+    asked again for each profile. If revalidation fails, the stale copy is
+    used.
+
+    Once the cached originals take more than `max_total_bytes`, the least
+    recently used ones are removed. Zero means no limit.
+    """
+    directory: str
+    max_bytes: int
+    timeout: Tuple[float, float]
+    revalidate_after: float
+    failure_ttl: float
+    pool_size: int = 10
+    max_total_bytes: int = 0
+    _total: Optional[int] = field(default=None, init=False, repr=False, compare=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
+
+    @cached_property
+    def session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def paths(self, url: str) -> Tuple[str, str]:
+        """Get the data and metadata file names for a URL.
+
+        Returns:
+            tuple[str, str]: data file, metadata file
+        """
+        digest = hashlib.sha256(url.encode()).hexdigest()
+        base = os.path.join(self.directory, digest[:2], digest)
+        return base, base + ".json"
+
+    def open(self, url: str) -> IO[bytes]:
+        """Open the cached original for a URL, fetching or revalidating it first
+        if necessary.
+
+        Args:
+            url (str): The remote image URL.
+
+        Returns:
+            file: The original image data.
+
+        Raises:
+            RemoteImageError: The image could not be fetched and there is no cached copy.
+        """
+        data_path, meta_path = self.paths(url)
+        meta = self.read_meta(meta_path)
+        now = time.time()
+        has_data = os.path.exists(data_path)
+        if meta.get("failed_until", 0) > now:
+            if has_data:
+                return self.open_data(data_path)
+            raise RemoteImageError("{} failed recently".format(url))
+        if has_data and now - meta.get("fetched", 0) < self.revalidate_after:
+            return self.open_data(data_path)
+        try:
+            self.fetch(url, data_path=data_path, meta_path=meta_path, meta=meta if has_data else {})
+        except (requests.RequestException, RemoteImageError) as e:
+            meta["failed_until"] = now + self.failure_ttl
+            self.write_meta(meta_path, meta)
+            if has_data:
+                return self.open_data(data_path)
+            raise RemoteImageError(str(e)) from e
+        return self.open_data(data_path)
+
+    def fetch(self, url: str, *, data_path: str, meta_path: str, meta: Dict[str, Any]) -> None:
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as resp:
+            if resp.status_code == 304:
+                meta["fetched"] = time.time()
+                meta.pop("failed_until", None)
+                self.write_meta(meta_path, meta)
+                return
+            if resp.status_code != 200:
+                raise RemoteImageError("{} returned {}".format(url, resp.status_code))
+            if int(resp.headers.get("Content-Length") or 0) > self.max_bytes:
+                raise RemoteImageError("{} is larger than {} bytes".format(url, self.max_bytes))
+            os.makedirs(os.path.dirname(data_path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(data_path))
+            try:
+                size = 0
+                with os.fdopen(fd, "wb") as outfile:
+                    for chunk in resp.iter_content(chunk_size=64 * 1024):
+                        size += len(chunk)
+                        if size > self.max_bytes:
+                            raise RemoteImageError("{} is larger than {} bytes".format(url, self.max_bytes))
+                        outfile.write(chunk)
+                os.replace(temp_path, data_path)
+            except:
+                os.unlink(temp_path)
+                raise
+            self.write_meta(meta_path, {
+                "url": url,
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+                "fetched": time.time(),
+            })
+            self.added(size, keep=data_path)
+
+    def open_data(self, data_path: str) -> IO[bytes]:
+        """Open a cached original and mark it as recently used."""
+        try:
+            os.utime(data_path)
+        except OSError:
+            pass
+        return open(data_path, "rb")
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        """Get the cached originals.
+
+        Returns:
+            list[tuple[float, int, str]]: The last use, size and path of each data file.
+        """
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if len(name) != 64:
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, stat.st_size, path))
+        return found
+
+    def added(self, size: int, *, keep: str) -> None:
+        """Count a newly cached original, and evict the least recently used
+        originals if the cache has grown past `max_total_bytes`.
+
+        The running total is kept per process and is corrected from the
+        directory whenever it crosses the limit, since other processes
+        share the cache.
+
+        Args:
+            size (int): The size of the new original.
+            keep (str): The new original, which is never evicted.
+        """
+        if not self.max_total_bytes:
+            return
+        with self._lock:
+            if self._total is None:
+                self._total = sum(size for _, size, _ in self.entries())
+            else:
+                self._total += size
+            if self._total <= self.max_total_bytes:
+                return
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_total_bytes:
+                    break
+                if path == keep:
+                    continue
+                for name in (path, path + ".json"):
+                    try:
+                        os.unlink(name)
+                    except FileNotFoundError:
+                        pass
+                total -= size
+            self._total = total
+
+    def read_meta(self, meta_path: str) -> Dict[str, Any]:
+        try:
+            with open(meta_path) as infile:
+                return json.load(infile)
+        except (OSError, ValueError):
+            return {}
+
+    def write_meta(self, meta_path: str, meta: Dict[str, Any]) -> None:
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(meta_path))
+        with os.fdopen(fd, "w") as outfile:
+            json.dump(meta, outfile)
+        os.replace(temp_path, meta_path)
+
+
+@lru_cache(maxsize=None)
+def remote_originals() -> RemoteOriginalCache:
+    """Get the process wide remote original cache configured by the
+    `KF_REMOTE_IMAGE_*` settings.
+    """
+    return RemoteOriginalCache(
+        directory=settings.KF_REMOTE_IMAGE_CACHE_DIR or os.path.join(tempfile.gettempdir(), "kronofoto-remote-images"),
+        max_bytes=settings.KF_REMOTE_IMAGE_MAX_BYTES,
+        timeout=settings.KF_REMOTE_IMAGE_TIMEOUT,
+        revalidate_after=settings.KF_REMOTE_IMAGE_REVALIDATE,
+        failure_ttl=settings.KF_REMOTE_IMAGE_FAILURE_TTL,
+        pool_size=settings.KF_REMOTE_IMAGE_POOL_SIZE,
+        max_total_bytes=settings.KF_REMOTE_IMAGE_CACHE_BYTES,
+    )
@@ -0,0 +1,145 @@
+from concurrent.futures import Future
+from dataclasses import dataclass
+from functools import lru_cache
+from django.conf import settings
+from typing import Callable, Dict, Optional, TypeVar
+import threading
+import time
+
+T = TypeVar("T")
+
+
+class ResizeQueueFull(Exception):
+    """Raised when a render cannot get a worker slot in time."""
+
+
+@dataclass
+class ResizeStats:
+    queue_depth: int
+    in_flight: int
+    renders: int
+    coalesced: int
+    rejected: int
+    failures: int
+    mean_latency: float
+    max_latency: float
+
+
+class ResizePool:
+    """Caps the number of concurrent image renders in this process and
+    coalesces concurrent requests for the same derivative into one render.
+
+    Requests beyond `size` running renders wait for a slot; once `queue_limit`
+    renders are already waiting for one, or a slot does not free up within
+    `timeout` seconds, `ResizeQueueFull` is raised so the caller can shed load.
+    """
+    def __init__(self, *, size: int, queue_limit: int, timeout: float) -> None:
+        self.size = size
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._renders: Dict[str, Future] = {}
+        self._waiting = 0
+        self._in_flight = 0
+        self._count = 0
+        self._coalesced = 0
+        self._rejected = 0
+        self._failures = 0
+        self._total_latency = 0.0
+        self._max_latency = 0.0
+
+    def render(self, key: str, func: Callable[[], T]) -> T:
+        """Run `func` in a worker slot, or wait for the result of a render of
+        `key` that is already queued or running.
+
+        Args:
+            key (str): Identifies the derivative, such as its storage name.
+            func (callable): Renders the derivative.
+
+        Returns:
+            The value returned by `func`.
+
+        Raises:
+            ResizeQueueFull: The queue is saturated.
+        """
+        with self._lock:
+            future = self._renders.get(key)
+            if future is not None:
+                self._coalesced += 1
+            elif self._waiting + self._in_flight >= self.size + self.queue_limit:
+                self._rejected += 1
+                raise ResizeQueueFull(key)
+            else:
+                self._renders[key] = Future()
+                self._waiting += 1
+        if future is not None:
+            return future.result()
+        return self._lead(key, func)
+
+    def _lead(self, key: str, func: Callable[[], T]) -> T:
+        future = self._renders[key]
+        try:
+            acquired = self._slots.acquire(timeout=self.timeout)
+            with self._lock:
+                self._waiting -= 1
+                if acquired:
+                    self._in_flight += 1
+                else:
+                    self._rejected += 1
+            if not acquired:
+                raise ResizeQueueFull(key)
+            start = time.monotonic()
+            try:
+                result = func()
+            except:
+                with self._lock:
+                    self._failures += 1
+                raise
+            finally:
+                self._slots.release()
+                elapsed = time.monotonic() - start
+                with self._lock:
+                    self._in_flight -= 1
+                    self._count += 1
+                    self._total_latency += elapsed
+                    self._max_latency = max(self._max_latency, elapsed)
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._renders[key]
+
+    def stats(self) -> ResizeStats:
+        """Get a snapshot of the pool counters for sizing the pool.
+
+        Returns:
+            ResizeStats: Current queue depth and in-flight renders, and totals since the process started.
+        """
+        with self._lock:
+            return ResizeStats(
+                queue_depth=self._waiting,
+                in_flight=self._in_flight,
+                renders=self._count,
+                coalesced=self._coalesced,
+                rejected=self._rejected,
+                failures=self._failures,
+                mean_latency=self._total_latency / self._count if self._count else 0.0,
+                max_latency=self._max_latency,
+            )
+
+
+@lru_cache(maxsize=None)
+def resize_pool() -> ResizePool:
+    """Get the process wide pool configured by the `KF_RESIZE_POOL_SIZE`,
+    `KF_RESIZE_QUEUE_LIMIT` and `KF_RESIZE_TIMEOUT` settings.
+    """
+    return ResizePool(
+        size=settings.KF_RESIZE_POOL_SIZE,
+        queue_limit=settings.KF_RESIZE_QUEUE_LIMIT,
+        timeout=settings.KF_RESIZE_TIMEOUT,
+    )
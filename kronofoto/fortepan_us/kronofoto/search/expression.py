@@ -2,6 +2,7 @@ from django.db.models import Q, F, Value, Case, When, IntegerField, Sum, FloatFi
 from django.db.models.functions import Cast, Length, Lower, Replace, Greatest, Least, StrIndex, Upper
 from django.db.models import Subquery, Exists, OuterRef
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.conf import settings
 from functools import cached_property
 from fortepan_us.kronofoto import models
 from dataclasses import dataclass
@@ -236,11 +237,27 @@ class Expression:
         return score
 
     def as_collection(self, qs, user):
+        if settings.KF_SEARCH_BACKEND == "memory":
+            from .memory import IndexQuery, search_index
+            r = IndexQuery(index=search_index(), user=user).as_collection(self, qs)
+            if r is not None:
+                return r
+        if settings.KF_SEARCH_BACKEND == "fulltext":
+            from .fulltext import FullTextQuery
+            return FullTextQuery(user=user).as_collection(self, qs)
         q = self.filter(user)
         r = qs.filter(q).order_by('year', 'id')
         return r
 
     def as_search(self, qs, user):
+        if settings.KF_SEARCH_BACKEND == "memory":
+            from .memory import IndexQuery, search_index
+            r = IndexQuery(index=search_index(), user=user).as_search(self, qs)
+            if r is not None:
+                return r
+        if settings.KF_SEARCH_BACKEND == "fulltext":
+            from .fulltext import FullTextQuery
+            return FullTextQuery(user=user).as_search(self, qs)
         q = self.filter(user)
         r = qs.filter(q).annotate(relevance=self.scoreF(False, user)).order_by('-relevance', 'year', 'id')
         return r
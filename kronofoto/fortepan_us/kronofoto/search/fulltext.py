@@ -0,0 +1,128 @@
+from django.db.models import Q, F, Value, FloatField
+from django.db.models.functions import Cast, Coalesce, Greatest, Least
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField
+from dataclasses import dataclass
+from typing import Any, List, Optional
+from fortepan_us.kronofoto.models.searchdocument import WEIGHTS
+from . import expression
+import re
+
+# The word searches the full text backend can answer from search documents,
+# and the weights of the fields each one looks in.
+TEXT_WEIGHTS = {
+    expression.SingleWordCaptionValue: WEIGHTS["caption"],
+    expression.MultiWordCaptionValue: WEIGHTS["caption"],
+    expression.SingleWordTagValue: WEIGHTS["tag"],
+    expression.MultiWordTagValue: WEIGHTS["tag"],
+    expression.SingleWordTermValue: WEIGHTS["term"],
+    expression.MultiWordTermValue: WEIGHTS["term"],
+    expression.IndexContainsWordValue: WEIGHTS["tag"] + WEIGHTS["term"] + WEIGHTS["place"],
+}
+
+
+# The alias of a Photo's document, which is empty for Photos that do not
+# have a SearchDocument yet.
+DOCUMENT = "search_text"
+
+
+def document_words(text: str) -> List[str]:
+    """Split search text into words the way the 'simple' text search
+    configuration splits documents, which breaks words at apostrophes,
+    hyphens and underscores too. Words that are split are searched as a
+    phrase, so "o'brien" matches the document's 'o' followed by 'brien'.
+    """
+    return [word for word in re.split(r"[\W_]+", text.lower()) if word]
+
+
+def lexeme(word: str, weights: str) -> str:
+    return "'{}':{}".format(word.replace("\\", "\\\\").replace("'", "''"), weights)
+
+
+@dataclass
+class FullTextQuery:
+    """Evaluates an expression tree against SearchDocuments instead of
+    WordCount subqueries.
+
+    Each largest subtree made only of caption, tag, term and index word
+    searches becomes a single `to_tsquery` matched against the GIN indexed
+    document and ranked with `ts_rank`. Other expressions, such as years,
+    donors and places, keep their own filters and scores, and are combined
+    with the same arithmetic as `Expression.scoreF`. Photos without a
+    SearchDocument are searched as if their document were empty, so they
+    still match negated word searches.
+    """
+    user: Any = None
+
+    def tsquery(self, expr: expression.Expression) -> Optional[str]:
+        """Compile an expression to tsquery text.
+
+        Returns:
+            str | None: The tsquery, or None if part of the expression is not a word search.
+        """
+        if isinstance(expr, expression.Not):
+            inner = self.tsquery(expr.value)
+            return "!({})".format(inner) if inner else None
+        if isinstance(expr, expression.BinaryOperator):
+            left = self.tsquery(expr.left)
+            right = self.tsquery(expr.right)
+            if left is None or right is None:
+                return None
+            operator = "&" if isinstance(expr, expression.And) else "|"
+            return "({}) {} ({})".format(left, operator, right)
+        weights = TEXT_WEIGHTS.get(type(getattr(expr, "_value", None)))
+        if weights is None:
+            return None
+        words = document_words(expr._value.value)
+        if not words:
+            return None
+        return " <-> ".join(lexeme(word, weights) for word in words)
+
+    def search_query(self, text: str) -> SearchQuery:
+        return SearchQuery(text, search_type="raw", config="simple")
+
+    def filter(self, expr: expression.Expression) -> Q:
+        text = self.tsquery(expr)
+        if text:
+            return Q(**{DOCUMENT: self.search_query(text)})
+        if isinstance(expr, expression.Not):
+            v = self.filter(expr.value)
+            return ~v if v else v
+        if isinstance(expr, expression.BinaryOperator):
+            l = self.filter(expr.left)
+            r = self.filter(expr.right)
+            if l and r:
+                return l & r if isinstance(expr, expression.And) else l | r
+            return l or r
+        return expr.filter(self.user)
+
+    def score(self, expr: expression.Expression, negated: bool) -> Any:
+        text = self.tsquery(expr)
+        if text:
+            rank = Coalesce(
+                SearchRank(F(DOCUMENT), self.search_query(text), normalization=32),
+                Value(0.0),
+                output_field=FloatField(),
+            )
+            return 1 - rank if negated else rank
+        if isinstance(expr, expression.Not):
+            return self.score(expr.value, not negated)
+        if isinstance(expr, expression.BinaryOperator):
+            l = self.score(expr.left, negated)
+            r = self.score(expr.right, negated)
+            if isinstance(expr, expression.Maximum):
+                return Least(l, r) if negated else Greatest(l, r)
+            if isinstance(expr, expression.And):
+                return l + r if negated else l * r
+            return l * r if negated else l + r
+        return expr.scoreF(negated, self.user)
+
+    def with_document(self, qs: Any) -> Any:
+        return qs.alias(**{
+            DOCUMENT: Coalesce(F("search_document__document"), Cast(Value(""), SearchVectorField())),
+        })
+
+    def as_collection(self, expr: expression.Expression, qs: Any) -> Any:
+        return self.with_document(qs).filter(self.filter(expr)).order_by('year', 'id')
+
+    def as_search(self, expr: expression.Expression, qs: Any) -> Any:
+        return self.with_document(qs).filter(self.filter(expr)).annotate(relevance=self.score(expr, False)).order_by('-relevance', 'year', 'id')
@@ -0,0 +1,269 @@
+from django.db.models import Case, When, Value, FloatField, Max
+from django.conf import settings
+from django.utils import timezone
+from django import db
+from array import array
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+from fortepan_us.kronofoto import models
+from . import expression
+import datetime
+import threading
+import time
+
+Key = Tuple[str, str]
+
+# The WordCount fields each indexed word search sums over.
+WORD_FIELDS = {
+    expression.SingleWordCaptionValue: ("CA",),
+    expression.SingleWordTagValue: ("TA",),
+    expression.SingleWordTermValue: ("TE",),
+    expression.IndexContainsWordValue: ("TE", "TA", "PL"),
+}
+
+# Scored by substring matching, which WordCount cannot answer.
+UNSUPPORTED = (
+    expression.MultiWordCaptionValue,
+    expression.MultiWordTagValue,
+    expression.MultiWordTermValue,
+)
+
+
+@dataclass
+class Postings:
+    """WordCount rows of one (field, word), as sorted photo ids and their
+    weights in parallel arrays.
+    """
+    ids: array = field(default_factory=lambda: array("l"))
+    weights: array = field(default_factory=lambda: array("d"))
+
+    def add(self, id: int, weight: float) -> None:
+        if self.ids and self.ids[-1] == id:
+            self.weights[-1] += weight
+        else:
+            self.ids.append(id)
+            self.weights.append(weight)
+
+
+class InvertedIndex:
+    """WordCount held in memory as posting lists, so word searches are
+    evaluated with set operations instead of correlated subqueries.
+
+    The posting lists are loaded once, in a background thread. Photos that
+    change afterwards are reloaded into a small overlay that takes
+    precedence over their stale postings, either from change events in this
+    process or from the IndexChanges written by other processes.
+    The whole index is reloaded in the background once it is older than
+    `KF_SEARCH_INDEX_MAX_AGE` seconds.
+    """
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.postings: Dict[Key, Postings] = {}
+        self.overlay: Dict[Key, Dict[int, float]] = {}
+        self.overlay_keys: Dict[int, Set[Key]] = {}
+        self.stale: Set[int] = set()
+        self.photo_ids: Set[int] = set()
+        self.last_change = 0
+        self.loaded_at: Optional[float] = None
+        self.loading = False
+
+    def ready(self) -> bool:
+        """Check whether the index can answer searches, starting a load in
+        the background if it is missing or too old.
+        """
+        with self.lock:
+            age = None if self.loaded_at is None else time.monotonic() - self.loaded_at
+            if not self.loading and (age is None or age > settings.KF_SEARCH_INDEX_MAX_AGE):
+                self.loading = True
+                threading.Thread(target=self.load, daemon=True, name="search-index").start()
+            return age is not None
+
+    def load(self) -> None:
+        try:
+            started = time.monotonic()
+            max_age = datetime.timedelta(seconds=2 * settings.KF_SEARCH_INDEX_MAX_AGE)
+            models.IndexChange.objects.filter(created__lt=timezone.now() - max_age).delete()
+            last_change = models.IndexChange.objects.aggregate(last=Max("id"))["last"] or 0
+            postings: Dict[Key, Postings] = {}
+            rows = (
+                models.WordCount.objects
+                .order_by("field", "word", "photo_id")
+                .values_list("field", "word", "photo_id", "count")
+                .iterator(chunk_size=20000)
+            )
+            key: Optional[Key] = None
+            current = Postings()
+            for field_name, word, photo_id, count in rows:
+                if (field_name, word) != key:
+                    key = (field_name, word)
+                    current = postings[key] = Postings()
+                current.add(photo_id, count)
+            photo_ids = set(models.Photo.objects.values_list("id", flat=True).iterator(chunk_size=20000))
+            with self.lock:
+                self.postings = postings
+                self.overlay = {}
+                self.overlay_keys = {}
+                self.stale = set()
+                self.photo_ids = photo_ids
+                self.last_change = last_change
+                self.loaded_at = started
+        finally:
+            with self.lock:
+                self.loading = False
+            db.connections.close_all()
+
+    def refresh(self, photo_ids: Iterable[int]) -> None:
+        """Reload the postings of some Photos from the database.
+
+        Args:
+            photo_ids (iterable[int]): The Photos whose words changed.
+        """
+        ids = set(photo_ids)
+        if not ids or self.loaded_at is None:
+            return
+        rows = list(models.WordCount.objects.filter(photo_id__in=ids).values_list("field", "word", "photo_id", "count"))
+        existing = set(models.Photo.objects.filter(id__in=ids).values_list("id", flat=True))
+        with self.lock:
+            for id in ids:
+                for key in self.overlay_keys.pop(id, ()):
+                    self.overlay[key].pop(id, None)
+            self.stale |= ids
+            self.photo_ids -= ids - existing
+            self.photo_ids |= existing
+            for field_name, word, photo_id, count in rows:
+                key = (field_name, word)
+                scores = self.overlay.setdefault(key, {})
+                scores[photo_id] = scores.get(photo_id, 0.0) + count
+                self.overlay_keys.setdefault(photo_id, set()).add(key)
+
+    def sync(self) -> None:
+        """Reload the Photos with IndexChanges newer than the index, such as
+        those changed by other processes.
+        """
+        with self.lock:
+            last_change = self.last_change
+        changed = list(models.IndexChange.objects.filter(id__gt=last_change).values_list("id", "photo_id"))
+        if changed:
+            self.refresh(photo_id for _, photo_id in changed)
+            with self.lock:
+                self.last_change = max(self.last_change, max(id for id, _ in changed))
+
+    def lookup(self, key: Key) -> Dict[int, float]:
+        """Get the weight of a word in a field for each Photo containing it."""
+        with self.lock:
+            scores: Dict[int, float] = {}
+            postings = self.postings.get(key)
+            if postings:
+                stale = self.stale
+                for id, weight in zip(postings.ids, postings.weights):
+                    if id not in stale:
+                        scores[id] = weight
+            scores.update(self.overlay.get(key, {}))
+            return scores
+
+    def all_photos(self) -> Set[int]:
+        with self.lock:
+            return set(self.photo_ids)
+
+
+@lru_cache(maxsize=None)
+def search_index() -> InvertedIndex:
+    """Get the process wide search index."""
+    return InvertedIndex()
+
+
+@dataclass
+class IndexQuery:
+    """Evaluates an expression tree with an InvertedIndex.
+
+    Word searches are answered from posting lists and combined by set
+    intersection, union and difference, with the same relevance arithmetic
+    as `Expression.scoreF`. Other expressions, which score 1 when they
+    match and 0 otherwise, are each run once as a query for their matching
+    ids. The resulting ids are handed back to the ORM for ordering and
+    pagination.
+    """
+    index: InvertedIndex
+    user: Any = None
+    leaves: Dict[int, Dict[int, float]] = field(default_factory=dict)
+
+    def supported(self, expr: expression.Expression) -> bool:
+        if isinstance(expr, expression.Not):
+            return self.supported(expr.value)
+        if isinstance(expr, expression.BinaryOperator):
+            return self.supported(expr.left) and self.supported(expr.right)
+        return not isinstance(expr._value, UNSUPPORTED)
+
+    def leaf(self, expr: expression.Expression) -> Dict[int, float]:
+        if id(expr) not in self.leaves:
+            value = expr._value
+            fields = WORD_FIELDS.get(type(value))
+            if fields:
+                scores: Dict[int, float] = {}
+                for field_name in fields:
+                    for photo_id, weight in self.index.lookup((field_name, value.value.lower())).items():
+                        scores[photo_id] = scores.get(photo_id, 0.0) + weight
+            else:
+                q = expr.filter(self.user)
+                ids: Iterable[int] = models.Photo.objects.filter(q).values_list("id", flat=True) if q else self.index.all_photos()
+                scores = dict.fromkeys(ids, 1.0)
+            self.leaves[id(expr)] = scores
+        return self.leaves[id(expr)]
+
+    def matches(self, expr: expression.Expression) -> Set[int]:
+        if isinstance(expr, expression.Not):
+            return self.index.all_photos() - self.matches(expr.value)
+        if isinstance(expr, expression.And):
+            return self.matches(expr.left) & self.matches(expr.right)
+        if isinstance(expr, expression.BinaryOperator):
+            return self.matches(expr.left) | self.matches(expr.right)
+        return set(self.leaf(expr))
+
+    def score(self, expr: expression.Expression, negated: bool, photo_id: int) -> float:
+        if isinstance(expr, expression.Not):
+            return self.score(expr.value, not negated, photo_id)
+        if isinstance(expr, expression.BinaryOperator):
+            l = self.score(expr.left, negated, photo_id)
+            r = self.score(expr.right, negated, photo_id)
+            if isinstance(expr, expression.Maximum):
+                return min(l, r) if negated else max(l, r)
+            if isinstance(expr, expression.And):
+                return l + r if negated else l * r
+            return l * r if negated else l + r
+        weight = self.leaf(expr).get(photo_id, 0.0)
+        return 1 - weight if negated else weight
+
+    def evaluate(self, expr: expression.Expression) -> Optional[Set[int]]:
+        """Find the matching Photos.
+
+        Returns:
+            set[int] | None: Their ids, or None if the index is not loaded, cannot answer the expression, or matches more than `KF_SEARCH_INDEX_MAX_RESULTS` Photos.
+        """
+        if not self.supported(expr) or not self.index.ready():
+            return None
+        self.index.sync()
+        ids = self.matches(expr)
+        if len(ids) > settings.KF_SEARCH_INDEX_MAX_RESULTS:
+            return None
+        return ids
+
+    def as_collection(self, expr: expression.Expression, qs: Any) -> Optional[Any]:
+        ids = self.evaluate(expr)
+        if ids is None:
+            return None
+        return qs.filter(id__in=ids).order_by('year', 'id')
+
+    def as_search(self, expr: expression.Expression, qs: Any) -> Optional[Any]:
+        ids = self.evaluate(expr)
+        if ids is None:
+            return None
+        by_score: Dict[float, list] = {}
+        for photo_id in ids:
+            by_score.setdefault(round(self.score(expr, False, photo_id), 6), []).append(photo_id)
+        relevance = Case(
+            *[When(id__in=photo_ids, then=Value(score)) for score, photo_ids in by_score.items()],
+            default=Value(0.0),
+            output_field=FloatField(),
+        )
+        return qs.filter(id__in=ids).annotate(relevance=relevance).order_by('-relevance', 'year', 'id')
@@ -0,0 +1,90 @@
+from django.core.cache import caches
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, When, Value, IntegerField
+from array import array
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Any, Optional
+import hashlib
+
+GENERATION_KEY = "kf:search:generation"
+
+
+def result_cache() -> Any:
+    return caches[settings.KF_SEARCH_RESULT_CACHE] if settings.KF_SEARCH_RESULT_CACHE else None
+
+
+def invalidate() -> None:
+    """Expire every cached search result once the current transaction
+    commits, by moving on to a new generation of cache keys.
+    """
+    cache = result_cache()
+    if cache is None:
+        return
+    def bump() -> None:
+        try:
+            cache.incr(GENERATION_KEY)
+        except ValueError:
+            cache.set(GENERATION_KEY, 1, timeout=None)
+    transaction.on_commit(bump)
+
+
+def cache_key(expr: Any, *, archive: Optional[str], category: Optional[str], user: Any) -> str:
+    """Get the cache key of a relevance search.
+
+    Only searches of collections depend on who is searching, because private
+    collections are visible to their owners.
+    """
+    text = str(expr)
+    visibility = user.id if user.is_authenticated and "collection:" in text else ""
+    cache = result_cache()
+    generation = cache.get(GENERATION_KEY, 0) if cache is not None else 0
+    parts = [text, archive or "", category or "", str(visibility), settings.KF_SEARCH_BACKEND, str(generation)]
+    return "kf:search:{}".format(hashlib.sha1("\0".join(parts).encode()).hexdigest())
+
+
+@dataclass
+class SearchResults:
+    """The ordered ids of a relevance search, cached for
+    `KF_SEARCH_RESULT_TTL` seconds so that paging through the results runs
+    the scored query once instead of a count and an offset query per page.
+
+    Counting is free, and pages are slices of the ids. Only the Photos of a
+    page are loaded, from the original queryset so unpublished Photos stay
+    hidden.
+    """
+    queryset: Any
+    key: str
+
+    @cached_property
+    def ids(self) -> array:
+        cache = result_cache()
+        data = cache.get(self.key) if cache is not None else None
+        ids = array("l")
+        if data is not None:
+            ids.frombytes(data)
+            return ids
+        ids.extend(self.queryset.values_list("id", flat=True))
+        if cache is not None and len(ids) <= settings.KF_SEARCH_RESULT_MAX:
+            cache.set(self.key, ids.tobytes(), timeout=settings.KF_SEARCH_RESULT_TTL)
+        return ids
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, k: Any) -> Any:
+        if isinstance(k, slice):
+            ids = list(self.ids[k])
+            position = Case(
+                *[When(id=id, then=Value(i)) for (i, id) in enumerate(ids)],
+                output_field=IntegerField(),
+            )
+            return self.queryset.filter(id__in=ids).order_by(position)
+        photos = list(self[k:k + 1]) if k >= 0 else []
+        if not photos:
+            raise IndexError(k)
+        return photos[0]
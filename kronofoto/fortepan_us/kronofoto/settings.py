@@ -2,3 +2,48 @@ KF_DJANGOCMS_SUPPORT = False
 KF_DJANGOCMS_NAVIGATION = False
 KF_DJANGOCMS_ROOT = ''
 KF_URL_SCHEME = "https:"
+KF_RESIZE_POOL_SIZE = 2
+KF_RESIZE_QUEUE_LIMIT = 16
+KF_RESIZE_TIMEOUT = 10
+KF_RESIZE_RETRY_AFTER = 5
+KF_DERIVATIVE_PROFILES = [(0, 1400), (0, 700), (500, 500), (75, 75)]
+KF_SIGNED_URL_CACHE_SIZE = 20000
+KF_SIGNED_URL_CACHE = None
+KF_REMOTE_IMAGE_CACHE_DIR = None
+KF_REMOTE_IMAGE_MAX_BYTES = 256 * 1024 * 1024
+KF_REMOTE_IMAGE_TIMEOUT = (5, 30)
+KF_REMOTE_IMAGE_REVALIDATE = 24 * 60 * 60
+KF_REMOTE_IMAGE_FAILURE_TTL = 5 * 60
+KF_REMOTE_IMAGE_POOL_SIZE = 10
+KF_DATADUMP_MAX_PAGE_SIZE = 50000
+KF_MAP_TILE_MAX_ZOOM = 14
+KF_MAP_TILE_SQL_CLUSTERING = True
+KF_IMAGE_FORMATS = ["avif", "webp"]
+KF_IMAGE_ENCODERS = {
+    "jpeg": {"quality": 60},
+    "webp": {"quality": 60, "method": 4},
+    "avif": {"quality": 50, "speed": 6},
+}
+KF_IMAGE_PROFILE_ENCODERS = {}
+KF_IMAGE_SERVE_MODE = "python"
+KF_IMAGE_ACCEL_PREFIX = "/protected-images/"
+KF_DERIVATIVE_MANIFEST = True
+KF_CAROUSEL_SPRITES = False
+KF_IIIF_TILE_SIZE = 512
+KF_IIIF_MAX_SIZE = 4096
+KF_PHOTOSPHERE_TILE_SIZE = 512
+KF_PHOTOSPHERE_BASE_WIDTH = 1024
+KF_INGEST_WORKERS = 4
+KF_DUPLICATE_DISTANCE = 6
+KF_SEARCH_BACKEND = "wordcount"
+KF_SEARCH_INDEX_MAX_AGE = 3600
+KF_SEARCH_INDEX_MAX_RESULTS = 10000
+KF_SEARCH_INDEX_UPDATES = "commit"
+KF_SEARCH_INDEX_BATCH_SIZE = 500
+KF_SEARCH_RESULT_CACHE = "default"
+KF_SEARCH_RESULT_TTL = 600
+KF_SEARCH_RESULT_MAX = 100000
+KF_REMOTE_IMAGE_CACHE_BYTES = 10 * 1024 * 1024 * 1024
+KF_INGEST_RUNNER = "thread"
+KF_INGEST_STALLED_AFTER = 300
+KF_DUPLICATE_ADMIN_LIMIT = 20000
@@ -0,0 +1,141 @@
+from django.db import connection, models
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Set, Type
+import uuid
+
+
+@lru_cache(maxsize=None)
+def shadow_model(model: Type[models.Model], table: str) -> Type[models.Model]:
+    """Get a copy of a model that is stored in another table.
+
+    The copy has the same fields, indexes and constraints, except that
+    deletes do not cascade to it and its foreign keys are not enforced by the
+    database. It is created once per process and table, so worker processes
+    can write to the table with the ORM.
+    """
+    attrs = {}
+    for field in model._meta.local_fields:
+        _, path, args, kwargs = field.deconstruct()
+        if field.is_relation:
+            kwargs["related_name"] = "+"
+        if field.many_to_one:
+            kwargs["on_delete"] = models.DO_NOTHING
+            kwargs["db_constraint"] = False
+        attrs[field.name] = type(field)(*args, **kwargs)
+    meta = type("Meta", (), {
+        "app_label": model._meta.app_label,
+        "db_table": table,
+        "unique_together": model._meta.unique_together,
+    })
+    return type("Shadow_{}".format(table), (models.Model,), {"__module__": model.__module__, "Meta": meta, **attrs})
+
+
+@dataclass
+class ShadowTable:
+    """An empty copy of a model's table that is filled while the original
+    keeps serving queries, and then swapped in place of it.
+
+    Rows written to or deleted from the original table while the copy is
+    filled would be lost by the swap, so `swap` hands their owners back to
+    the caller to rebuild in the new table. Rows are never updated in place,
+    so these are the owners of rows added since the copy was created, the
+    owners with fewer of their older rows than a snapshot taken then, and
+    the owners that no longer exist.
+
+    The copy's foreign keys are only enforced once it is swapped in, so rows
+    it points to can be deleted meanwhile.
+    """
+    model: Type[models.Model]
+    owner: str
+    table: str
+    last_row: int = 0
+
+    @classmethod
+    def create(cls, model: Type[models.Model], owner: str) -> "ShadowTable":
+        """Create the copy, and snapshot the rows of each owner in the
+        original.
+
+        Args:
+            model (Model): The model to rebuild.
+            owner (str): The attribute of the rows that identifies what they were built from, such as "photo_id".
+        """
+        shadow = cls(
+            model=model,
+            owner=owner,
+            table="{}_rebuild_{}".format(model._meta.db_table, uuid.uuid4().hex[:8]),
+        )
+        with connection.schema_editor() as editor:
+            editor.create_model(shadow.copy)
+            editor.execute(
+                "CREATE TABLE {counts} AS SELECT {owner} AS {owner}, COUNT(*) AS {rows}, MAX({pk}) AS {last} FROM {live} GROUP BY {owner}".format(
+                    counts=editor.quote_name(shadow.counts),
+                    owner=editor.quote_name(shadow.column),
+                    rows=editor.quote_name("row_count"),
+                    pk=editor.quote_name(model._meta.pk.column),
+                    last=editor.quote_name("last_row"),
+                    live=editor.quote_name(model._meta.db_table),
+                )
+            )
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT MAX({}) FROM {}".format(connection.ops.quote_name("last_row"), connection.ops.quote_name(shadow.counts)))
+            shadow.last_row = cursor.fetchone()[0] or 0
+        return shadow
+
+    @property
+    def copy(self) -> Type[models.Model]:
+        return shadow_model(self.model, self.table)
+
+    @property
+    def counts(self) -> str:
+        return "{}_counts".format(self.table)
+
+    @property
+    def column(self) -> str:
+        return self.model._meta.get_field(self.owner).column
+
+    def swap(self, rebuild: Callable[[Set[int]], None]) -> None:
+        """Replace the original table with the copy, drop the original, and
+        enforce the copy's foreign keys.
+
+        Args:
+            rebuild (callable): Called in the same transaction, after the swap, with the owners of rows written to or deleted from the original table since the copy was created.
+        """
+        live = self.model._meta.db_table
+        old = "{}_old".format(self.table)
+        target = self.model._meta.get_field(self.owner).related_model._meta
+        with connection.schema_editor() as editor:
+            quote = editor.quote_name
+            editor.alter_db_table(self.model, live, old)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT {owner} FROM {old} WHERE {pk} > %s"
+                    " UNION SELECT {owner} FROM {counts} c WHERE {rows} > ("
+                    "SELECT COUNT(*) FROM {old} o WHERE o.{owner} = c.{owner} AND o.{pk} <= %s)"
+                    " UNION SELECT {owner} FROM {copy} s WHERE NOT EXISTS ("
+                    "SELECT 1 FROM {target} t WHERE t.{target_pk} = s.{owner})".format(
+                        owner=quote(self.column),
+                        old=quote(old),
+                        pk=quote(self.model._meta.pk.column),
+                        counts=quote(self.counts),
+                        rows=quote("row_count"),
+                        copy=quote(self.table),
+                        target=quote(target.db_table),
+                        target_pk=quote(target.pk.column),
+                    ),
+                    [self.last_row, self.last_row],
+                )
+                changed = {row[0] for row in cursor.fetchall()}
+            editor.alter_db_table(self.copy, self.table, live)
+            editor.execute(editor.sql_delete_table % {"table": quote(old)})
+            editor.execute(editor.sql_delete_table % {"table": quote(self.counts)})
+            if changed:
+                rebuild(changed)
+            for field in self.model._meta.local_fields:
+                if field.many_to_one:
+                    editor.alter_field(self.model, self.copy._meta.get_field(field.name), field)
+
+    def drop(self) -> None:
+        with connection.schema_editor() as editor:
+            editor.delete_model(self.copy)
+            editor.execute(editor.sql_delete_table % {"table": editor.quote_name(self.counts)})
@@ -1,4 +1,6 @@
-from django.db.models.signals import post_save, m2m_changed, pre_delete
+from django.db.models.signals import post_save, pre_save, m2m_changed, pre_delete, post_delete
+from django.db import transaction
+from django.conf import settings
 from cryptography.hazmat.primitives.asymmetric import rsa
 from django.dispatch import receiver
 from . import signed_requests
@@ -7,7 +9,10 @@ import requests
 from django.db.models import Q
 from .reverse import reverse
 from functools import cached_property
-from fortepan_us.kronofoto.models import Photo, WordCount, Tag, Term, PhotoTag, Place, PlaceWordCount, Donor, Archive, RemoteActor, ServiceActor
+from fortepan_us.kronofoto.models import Photo, WordCount, Tag, Term, PhotoTag, Place, PlaceWordCount, Donor, Archive, RemoteActor, ServiceActor, MapTile, Derivative, PhotoSphere
+from fortepan_us.kronofoto.indexing import PHOTO_FIELDS, enqueue
+from fortepan_us.kronofoto.search.results import invalidate
+from fortepan_us.kronofoto.imageutil import DerivativePipeline, IMAGE_FORMATS
 from collections import Counter
 import re
 from typing import Any, Union, Optional, List, Dict, NoReturn, Type, Iterable
@@ -82,6 +87,25 @@ class Sender:
         if resp.status_code != 200:
             logging.info("{code} {body!r} from {inbox} with {data}".format(code=resp.status_code, inbox=inbox, data=data, body=resp.content))
 
+def send_all(data_providers: Iterable[Union["PhotoDeleteSender", "DonorDeleteSender", "PlaceDeleteSender"]]) -> None:
+    """Send activities for many objects, loading each remote actor's profile
+    only once instead of once per object.
+
+    Args:
+        data_providers (iterable): The activities to send.
+    """
+    inboxes: Dict[str, Optional[str]] = {}
+    for data_provider in data_providers:
+        if not data_provider.is_local:
+            continue
+        sender = Sender(data_provider=data_provider)
+        for actor in data_provider.remote_actors:
+            if actor.profile not in inboxes:
+                inboxes[actor.profile] = (sender.load_profile(profile=actor.profile) or {}).get("inbox")
+            inbox = inboxes[actor.profile]
+            if inbox:
+                sender.send_data(inbox=inbox, data=data_provider.data)
+
 @dataclass
 class DonorDeleteSender:
     instance: Donor
@@ -235,47 +259,138 @@ def photo_activity(sender: Type[Photo], instance: Photo, created: bool, raw: Any
     Sender(PhotoUpsertSender(instance=instance, created=created)).send()
 
 
+@receiver(pre_save, sender=Photo)
+def photo_forget_old_values(sender: Any, instance: Photo, **kwargs: Any) -> None:
+    instance.__dict__.pop("_old_values", None)
+
+
+def old_values(instance: Photo) -> Optional[Dict[str, Any]]:
+    """Get the stored values of the Photo fields that the pre_save receivers
+    compare against, by attname. They are loaded with one query per save and
+    shared by the receivers.
+
+    Returns:
+        dict | None: The values, or None if the Photo has not been stored.
+    """
+    if "_old_values" not in instance.__dict__:
+        values = None
+        if instance.pk:
+            names = ("original", *MAP_TILE_FIELDS, *PHOTO_FIELDS, *SEARCH_RESULT_FIELDS)
+            attnames = {Photo._meta.get_field(name).attname for name in names}
+            values = Photo.objects.filter(pk=instance.pk).values(*attnames).first()
+        setattr(instance, "_old_values", values)
+    return instance.__dict__["_old_values"]
+
+@receiver(pre_save, sender=Photo)
+def photo_image_header(sender: Any, instance: Photo, raw: Any, **kwargs: Any) -> None:
+    if not raw and instance.original and not instance.original._committed:
+        try:
+            instance.capture_image_header()
+        except OSError:
+            pass
+
+@receiver(pre_save, sender=Photo)
+def photo_derivative_manifest(sender: Any, instance: Photo, raw: Any, **kwargs: Any) -> None:
+    if raw or not instance.pk or not instance.original or instance.original._committed:
+        return
+    names = []
+    values = old_values(instance)
+    old = values["original"] if values else None
+    if old:
+        pipeline = DerivativePipeline(id=instance.pk, path=old, profiles=settings.KF_DERIVATIVE_PROFILES)
+        names = [cacher.with_format(format).name for cacher in pipeline.cachers for format in IMAGE_FORMATS]
+    Derivative.objects.filter(photo_id=instance.pk).discard(names)
+
+@receiver(pre_save, sender=PhotoSphere)
+def photosphere_tile_set(sender: Any, instance: PhotoSphere, raw: Any, **kwargs: Any) -> None:
+    if not raw and instance.image and not instance.image._committed:
+        instance.tile_set = None
+
+MAP_TILE_FIELDS = ("location_point", "is_published", "year", "archive", "category")
+
+def on_map(values: Dict[str, Any]) -> bool:
+    return bool(values["location_point"] and values["is_published"] and values["year"] is not None)
+
+@receiver(pre_save, sender=Photo)
+def photo_map_tiles(sender: Any, instance: Photo, raw: Any, update_fields: Any, **kwargs: Any) -> None:
+    if raw or (update_fields is not None and not set(update_fields) & set(MAP_TILE_FIELDS)):
+        return
+    attnames = {Photo._meta.get_field(name).attname: name for name in MAP_TILE_FIELDS}
+    new = {name: getattr(instance, attname) for (attname, name) in attnames.items()}
+    old = None
+    values = old_values(instance)
+    if values:
+        old = {name: values[attname] for (attname, name) in attnames.items()}
+    if old == new or not (on_map(new) or (old and on_map(old))):
+        return
+    points = [new["location_point"], old["location_point"] if old else None]
+    transaction.on_commit(lambda: MapTile.objects.invalidate(points, settings.KF_MAP_TILE_MAX_ZOOM))
+
+@receiver(post_delete, sender=Photo)
+def photo_delete_map_tiles(sender: Any, instance: Photo, **kwargs: Any) -> None:
+    if instance.location_point:
+        points = [instance.location_point]
+        transaction.on_commit(lambda: MapTile.objects.invalidate(points, settings.KF_MAP_TILE_MAX_ZOOM))
+
+@receiver(pre_save, sender=Photo)
+def photo_index_fields(sender: Any, instance: Photo, raw: Any, update_fields: Any, **kwargs: Any) -> None:
+    attnames = {Photo._meta.get_field(name).attname: name for name in PHOTO_FIELDS}
+    if update_fields is not None:
+        attnames = {attname: name for (attname, name) in attnames.items() if {attname, name} & set(update_fields)}
+    old = old_values(instance) if attnames else None
+    setattr(instance, "_index_fields", {
+        PHOTO_FIELDS[name] for (attname, name) in attnames.items()
+        if old is None or old[attname] != getattr(instance, attname)
+    })
+
+# The Photo fields that decide which search results a Photo appears in,
+# apart from the indexed fields, whose changes are invalidated by reindex.
+SEARCH_RESULT_FIELDS = ("is_published", "year", "archive", "category")
+
+@receiver(pre_save, sender=Photo)
+def photo_search_result_fields(sender: Any, instance: Photo, raw: Any, update_fields: Any, **kwargs: Any) -> None:
+    attnames = {Photo._meta.get_field(name).attname: name for name in SEARCH_RESULT_FIELDS}
+    if update_fields is not None:
+        attnames = {attname: name for (attname, name) in attnames.items() if {attname, name} & set(update_fields)}
+    old = old_values(instance) if attnames else None
+    setattr(instance, "_search_results_changed", bool(attnames) and (
+        old is None or any(old[attname] != getattr(instance, attname) for attname in attnames)
+    ))
+
 @receiver(post_save, sender=Photo)
 def photo_save(sender: Any, instance: Photo, created: Any, raw: Any, using: Any, update_fields: Any, **kwargs: Any) -> None:
-    WordCount.objects.filter(photo=instance, field='CA').delete()
-    WordCount.objects.filter(photo=instance, field='PL').delete()
-    counts = Counter(w for w in re.split(r"[^\w\']+", instance.caption.lower()) if w.strip() and len(w.strip()) <= 64)
-    total = sum(counts.values())
-    wordcounts = [
-        WordCount(photo=instance, word=w, field='CA', count=counts[w]/total) for w in counts
-    ]
-    if instance.place:
-        q = Q(lft__lte=instance.place.lft, rght__gte=instance.place.rght, tree_id=instance.place.tree_id)
-        if instance.place.geom:
-            q |= Q(geom__contains=instance.place.geom)
-        if instance.location_point:
-            q |= Q(geom__contains=instance.location_point)
-        places = Place.objects.filter(q)
-        instance.places.set(places)
-        counts = sum((Counter(place.name.lower().split()) for place in places), Counter())
-        total = sum(counts.values())
-        wordcounts += [
-            WordCount(photo=instance, word=w, field='PL', count=counts[w]/total) for w in counts
-        ]
-    WordCount.objects.bulk_create(wordcounts)
+    enqueue([instance.id], getattr(instance, "_index_fields", PHOTO_FIELDS.values()))
+    setattr(instance, "_index_fields", set())
+    if getattr(instance, "_search_results_changed", True):
+        invalidate()
+    setattr(instance, "_search_results_changed", False)
+
+@receiver(post_delete, sender=Photo)
+def photo_delete_search_results(sender: Any, instance: Photo, **kwargs: Any) -> None:
+    if instance.is_published:
+        invalidate()
+
+@receiver(pre_save, sender=PhotoTag)
+def phototag_index_fields(sender: Any, instance: PhotoTag, raw: Any, **kwargs: Any) -> None:
+    old = PhotoTag.objects.filter(pk=instance.pk).values("photo_id", "tag_id", "accepted").first() if instance.pk else None
+    new = {"photo_id": instance.photo_id, "tag_id": instance.tag_id, "accepted": instance.accepted}
+    setattr(instance, "_index_photos", set() if old == new else {new["photo_id"], old["photo_id"] if old else None})
 
 @receiver(post_save, sender=PhotoTag)
 def tag_change(sender: Any, instance: PhotoTag, update_fields: Any, **kwargs: Any) -> None:
-    WordCount.objects.filter(photo=instance.photo, field='TA').delete()
-    counts : Counter = sum((Counter(tag.tag.lower().split()) for tag in instance.photo.tags.filter(phototag__accepted=True)), Counter())
-    total = sum(counts.values())
-    wordcounts = [
-        WordCount(photo=instance.photo, word=w, field='TA', count=counts[w]/total) for w in counts
-    ]
-    WordCount.objects.bulk_create(wordcounts)
+    enqueue(getattr(instance, "_index_photos", {instance.photo_id}), ["TA"])
+    setattr(instance, "_index_photos", set())
+
+@receiver(post_delete, sender=PhotoTag)
+def tag_delete(sender: Any, instance: PhotoTag, **kwargs: Any) -> None:
+    if instance.accepted:
+        enqueue([instance.photo_id], ["TA"])
 
 @receiver(m2m_changed, sender=Photo.terms.through)
-def photo_save_m2m(sender: Any, instance: Any, action: Any, **kwargs: Any) -> None:
-    if action in ('post_add', 'post_remove'):
-        WordCount.objects.filter(photo=instance, field='TE').delete()
-        counts: Counter = sum((Counter(term.term.lower().split()) for term in instance.terms.all()), Counter())
-        total = sum(counts.values())
-        wordcounts = [
-            WordCount(photo=instance, word=w, field='TE', count=counts[w]/total) for w in counts
-        ]
-        WordCount.objects.bulk_create(wordcounts)
+def photo_save_m2m(sender: Any, instance: Any, action: Any, reverse: bool, pk_set: Any, **kwargs: Any) -> None:
+    if action in ('post_add', 'post_remove') and pk_set:
+        enqueue(pk_set if reverse else [instance.id], ["TE"])
+    elif action == 'pre_clear' and reverse:
+        enqueue(sender.objects.filter(term_id=instance.id).values_list("photo_id", flat=True), ["TE"])
+    elif action == 'post_clear' and not reverse:
+        enqueue([instance.id], ["TE"])
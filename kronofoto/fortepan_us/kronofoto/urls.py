@@ -168,6 +168,11 @@ urlpatterns = urlpatterns + [
     path("<slug:short_name>/", include(urlpatterns)),
     path("placetypes", views.places.place_types),
     path("placetypes/<int:pk>", views.places.placelist, name="placelist"),
+    path(settings.IMAGE_CACHE_URL_PREFIX + "images/stats.json", views.resize_stats, name="resize-stats"),
+    path("iiif/<int:photo>", views.iiif_base, name="iiif-base"),
+    path("iiif/<int:photo>/info.json", views.iiif_info, name="iiif-info"),
+    path("iiif/<int:photo>/<str:region>/<str:size>/<str:rotation>/<str:quality>.<str:format>", views.iiif_image, name="iiif-image"),
+    path(settings.IMAGE_CACHE_URL_PREFIX + "images/sprites/<str:key>.jpg", views.thumbnail_sprite, name="thumbnail-sprite"),
     path(settings.IMAGE_CACHE_URL_PREFIX + "images/<int:block1>/<int:block2>/<str:profile1>.jpg", views.resize_image, name="resize-image"),
     path("", include("fortepan_us.kronofoto.views.vector_tiles")),
 ]
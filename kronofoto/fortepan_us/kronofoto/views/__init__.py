@@ -12,8 +12,9 @@ from .grid import GridView
 from .categories import category_list
 from .submission import submission, list_terms, define_terms
 from .exhibit import view as exhibit_view, exhibit_list, exhibit_create, exhibit_edit, exhibit_card_form, exhibit_figure_form, exhibit_images, exhibit_figure_image, exhibit_full_image, exhibit_two_column_image
-from .images import resize_image
+from .images import resize_image, resize_stats, thumbnail_sprite
 from .data import datadump
+from .iiif import iiif_base, iiif_info, iiif_image
 from django.http import HttpRequest, HttpResponse
 from django.shortcuts import get_object_or_404
 from fortepan_us.kronofoto.models import Photo
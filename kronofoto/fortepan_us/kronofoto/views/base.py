@@ -6,6 +6,7 @@ from functools import cached_property, wraps
 from fortepan_us.kronofoto.search.expression import Expression
 from fortepan_us.kronofoto.forms import BoundsSearchForm, Bounds
 from fortepan_us.kronofoto.search.parser import Parser
+from fortepan_us.kronofoto.search.results import SearchResults, cache_key
 from django.db.models import QuerySet, Q
 from django.contrib.gis.geos import Polygon
 from django.contrib.auth.models import User, AnonymousUser
@@ -191,6 +192,18 @@ class ArchiveRequest:
         else:
             raise BadRequest('invalid search request')
 
+    def get_search_results(self, queryset: PhotoQuerySet) -> SearchResults:
+        """Wrap the queryset of a relevance search so its ordered ids are
+        cached and pages are slices of them.
+        """
+        key = cache_key(
+            self.final_expr,
+            archive=str(self.archive_ref) if self.archive_ref else None,
+            category=self.category,
+            user=self.request.user,
+        )
+        return SearchResults(queryset=queryset, key=key)
+
 class PhotoRequest(ArchiveRequest):
     @property
     def base_template(self) -> str:
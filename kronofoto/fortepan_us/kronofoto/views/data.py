@@ -1,5 +1,7 @@
-from django.http import HttpResponse, HttpRequest, QueryDict, JsonResponse
-from typing import Optional
+from django.http import HttpResponse, HttpRequest, QueryDict, JsonResponse, StreamingHttpResponse
+from django.http.response import HttpResponseBase
+from django.conf import settings
+from typing import Optional, Dict, List, Tuple, Iterator, Callable
 from .base import ArchiveRequest, require_valid_archive
 from django.core.serializers import serialize
 import json
@@ -9,7 +11,10 @@ from django.shortcuts import get_object_or_404
 import hmac
 from django.core.exceptions import PermissionDenied
 from datetime import datetime, timedelta
-from django.db.models import Prefetch
+from django.db.models import Prefetch, Exists, OuterRef, QuerySet
+from dataclasses import dataclass
+from functools import cached_property
+import csv
 from collections import defaultdict
 from django import forms
 from typing import Any, Protocol, TypeVar
@@ -42,36 +47,59 @@ def hmac_auth(func: HttpHandler) -> HttpHandler:
 class DataQuery(forms.Form):
     since = forms.DateTimeField(required=False)
     after = forms.IntegerField(required=False)
+    limit = forms.IntegerField(required=False, min_value=1)
+    format = forms.ChoiceField(required=False, choices=[("json", "json"), ("jsonl", "jsonl"), ("csv", "csv")])
 
 
-@hmac_auth
-@require_valid_archive
-def datadump(request: HttpRequest, short_name: Optional[str]=None) -> HttpResponse:
-    size = 200
-    query_form = DataQuery(request.GET)
-    if query_form.is_valid():
-        after = query_form.cleaned_data['after'] or 0
-        since = query_form.cleaned_data['since']
+class Echo:
+    "A file-like object for csv.writer that hands back each line instead of storing it."
+    def write(self, value: str) -> str:
+        return value
 
-        filter_params = {}
-        if since:
-            filter_params['modified__gt'] = since
 
+@dataclass
+class DataExport:
+    """Exports one page of an archive's photos, in id order, as a stream.
 
-        photos = Photo.objects.filter(archive__slug=short_name, id__gt=after, **filter_params).select_related('donor', 'photographer', 'scanner').prefetch_related('terms', 'place').order_by('id')[:size+1]
-        phototags = defaultdict(list)
-        for t in PhotoTag.objects.filter(photo__in=photos, accepted=True).select_related('tag', 'photo'):
-            phototags[t.photo.id].append(t.tag)
-        if not request.user.has_perm('kronofoto.archive.{}.view'.format(short_name)):
-            raise PermissionDenied
+    Place ancestor chains, terms and accepted tags for the whole page are
+    loaded with one query each, and photos are read with a server side
+    iterator.
+    """
+    photos: QuerySet[Photo]
+    chunk_size: int = 2000
+
+    @cached_property
+    def place_chains(self) -> Dict[int, str]:
+        places = Place.objects.filter(id__in=self.photos.values("place_id"))
+        ancestors = Place.objects.filter(
+            Exists(places.filter(tree_id=OuterRef("tree_id"), lft__gte=OuterRef("lft"), rght__lte=OuterRef("rght")))
+        ).values_list("id", "name", "tree_id", "lft", "rght")
+        chains = {}
+        stack: List[Tuple[int, int, str]] = []
+        for id, name, tree_id, lft, rght in ancestors.order_by("tree_id", "lft"):
+            while stack and (stack[-1][0] != tree_id or stack[-1][1] < lft):
+                stack.pop()
+            stack.append((tree_id, rght, name))
+            chains[id] = "^^".join(name for (_, _, name) in reversed(stack))
+        return chains
+
+    @cached_property
+    def subjects(self) -> Dict[int, List[str]]:
+        ids = self.photos.values("id")
+        subjects: Dict[int, List[str]] = defaultdict(list)
+        terms = Photo.terms.through.objects.filter(photo__in=ids).values_list("photo_id", "term__term").order_by("term__term")
+        for photo_id, term in terms:
+            subjects[photo_id].append(term)
+        tags = PhotoTag.objects.filter(photo__in=ids, accepted=True).values_list("photo_id", "tag__tag").order_by("id")
+        for photo_id, tag in tags:
+            subjects[photo_id].append(tag)
+        return subjects
+
+    @property
+    def columns(self) -> Dict[str, Callable[[Photo], Any]]:
         field = lambda name: lambda p: getattr(p, name)
         const = lambda value: lambda p: value
 
-        def tags(p: Photo) -> str:
-            terms = [term.term for term in p.terms.all()]
-            tags = [tag.tag for tag in phototags[p.id]]
-            return "^^".join(terms+tags)
-
         def names(p: Photo) -> str:
             associated = []
             if p.donor:
@@ -82,21 +110,13 @@ def datadump(request: HttpRequest, short_name: Optional[str]=None) -> HttpRespon
                 associated.append("{}|Scanner".format(p.scanner))
             return "^^".join(associated)
 
-        place_cache = {}
-        def place(p: Photo) -> str:
-            if not p.place:
-                return ""
-            if p.place.id not in place_cache:
-                place_cache[p.place.id] = "^^".join(p2.name for p2 in p.place.get_ancestors(ascending=True, include_self=True))
-            return place_cache[p.place.id]
-
         def coords(p: Photo) -> str:
             if p.location_point:
                 return "{}|{}".format(p.location_point.y, p.location_point.x)
             else:
                 return ""
 
-        map = {
+        return {
             'ID': field('id'),
             'member_of': const(""),
             'member_of_existing_entity_id': const(""),
@@ -105,7 +125,7 @@ def datadump(request: HttpRequest, short_name: Optional[str]=None) -> HttpRespon
             'rights_statement': const('NO COPYRIGHT - UNITED STATES'),
             'held_by': const(""),
             'title': const(""),
-            'digital_file': lambda p: p.original.url,
+            'digital_file': lambda p: p.original.url if p.original else p.remote_image or "",
             'media_use': const("Original File"),
             'digital_origin': const("digitized other analog"),
             'creative_commons': const("Attribution-ShareAlike 4.0 International (CC BY-SA 4.0)"),
@@ -118,35 +138,90 @@ def datadump(request: HttpRequest, short_name: Optional[str]=None) -> HttpRespon
             'origin_information': lambda p: "||{year}{circa}".format(year=p.year, circa="?" if p.circa else ""),
             'language': const(""),
             'genre': const(""),
-            'subject': tags,
+            'subject': lambda p: "^^".join(self.subjects.get(p.id, [])),
             'temporal_subject': const(""),
-            'geographic_subject': place,
+            'geographic_subject': lambda p: self.place_chains.get(p.place_id, "") if p.place_id else "",
             'notes': const(""),
             'record_information': const(""),
             'coordinates': coords,
         }
-        data = [{k: mapper(p) for (k, mapper) in map.items()} for p in photos]
-        response = HttpResponse("", content_type="application/json")
-        if len(data) > size:
+
+    def rows(self) -> Iterator[Dict[str, Any]]:
+        columns = self.columns
+        photos = self.photos.select_related('donor', 'photographer', 'scanner').order_by('id')
+        for p in photos.iterator(chunk_size=self.chunk_size):
+            yield {k: mapper(p) for (k, mapper) in columns.items()}
+
+    def json(self, next: Optional[str]) -> Iterator[str]:
+        yield '{"results": ['
+        for i, row in enumerate(self.rows()):
+            yield (", " if i else "") + json.dumps(row)
+        yield '], "status": "OK", "next": {}}}'.format(json.dumps(next))
+
+    def jsonl(self) -> Iterator[str]:
+        for row in self.rows():
+            yield json.dumps(row) + "\n"
+
+    def csv(self) -> Iterator[str]:
+        writer = csv.writer(Echo())
+        yield writer.writerow(list(self.columns))
+        for row in self.rows():
+            yield writer.writerow(list(row.values()))
+
+
+CONTENT_TYPES = {
+    "json": "application/json",
+    "jsonl": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+@hmac_auth
+@require_valid_archive
+def datadump(request: HttpRequest, short_name: Optional[str]=None, domain: Optional[str]=None) -> HttpResponseBase:
+    query_form = DataQuery(request.GET)
+    if query_form.is_valid():
+        if not request.user.has_perm('kronofoto.archive.{}.view'.format(short_name)):
+            raise PermissionDenied
+        after = query_form.cleaned_data['after'] or 0
+        since = query_form.cleaned_data['since']
+        size = min(query_form.cleaned_data['limit'] or 200, settings.KF_DATADUMP_MAX_PAGE_SIZE)
+        format = query_form.cleaned_data['format'] or "json"
+
+        filter_params = {}
+        if since:
+            filter_params['modified__gt'] = since
+
+        photos = Photo.objects.filter(archive__slug=short_name, archive__server_domain=domain or "", id__gt=after, **filter_params)
+        page_ids = list(photos.order_by('id').values_list('id', flat=True)[:size+1])
+        next = None
+        if len(page_ids) > size:
             query_params = QueryDict(mutable=True)
-            query_params['after'] = str(photos[photos.count()-1].id)
+            query_params['after'] = str(page_ids[size-1])
             if since:
-                query_params['since'] = since
-            json.dump({
-                "results": data[:size],
-                "status": "OK",
-                "next": "{}?{}".format(
-                    reverse("kronofoto:data-dump", kwargs={"short_name": short_name}),
-                    query_params.urlencode()
-                )
-            }, response)
+                query_params['since'] = since.isoformat()
+            if query_form.cleaned_data['limit']:
+                query_params['limit'] = str(size)
+            if query_form.cleaned_data['format']:
+                query_params['format'] = format
+            next = "{}?{}".format(
+                reverse("kronofoto:data-dump", kwargs={"short_name": short_name}),
+                query_params.urlencode()
+            )
+        if page_ids:
+            photos = photos.filter(id__lte=page_ids[:size][-1])
         else:
-            json.dump({
-                "results": data[:size],
-                "status": "OK",
-                "next": None,
-            }, response)
-
+            photos = photos.none()
+        export = DataExport(photos=photos)
+        if format == "json":
+            content: Iterator[str] = export.json(next)
+        elif format == "jsonl":
+            content = export.jsonl()
+        else:
+            content = export.csv()
+        response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[format])
+        if next:
+            response['Link'] = '<{}>; rel="next"'.format(next)
         return response
     else:
         return JsonResponse({"status": "Invalid query"}, status=400)
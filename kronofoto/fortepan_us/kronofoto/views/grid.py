@@ -11,7 +11,6 @@ from django.conf import settings
 from django.core.exceptions import MultipleObjectsReturned
 from .basetemplate import BasePhotoTemplateMixin
 from fortepan_us.kronofoto.models import Photo
-from fortepan_us.kronofoto.models.photo import PhotoQuerySet
 from fortepan_us.kronofoto.decorators import strip_cookies
 from django.views.decorators.cache import cache_page
 from django.views.decorators.vary import vary_on_headers
@@ -129,8 +128,16 @@ class GridView(BasePhotoTemplateMixin, ListView):
         context.update(self.get_no_objects_context(object_list))
         return context
 
-    def get_queryset(self) -> PhotoQuerySet:
+    def get_queryset(self) -> Any:
         qs = super().get_queryset().prefetch_related("photosphere_set")
+        if self.final_expr and not self.final_expr.is_collection():
+            results = self.archive_request.get_search_results(qs)
+            if results.count() == 1:
+                try:
+                    raise Redirect("single object found", url=results[0].get_absolute_url())
+                except IndexError:
+                    pass
+            return results
         try:
             raise Redirect("single object found", url=qs.order_by('year', 'id').get().get_absolute_url())
         except (MultipleObjectsReturned, self.model.DoesNotExist):
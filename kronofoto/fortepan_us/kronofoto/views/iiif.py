@@ -0,0 +1,148 @@
+from django.http import HttpResponse, HttpRequest, JsonResponse, HttpResponseRedirect, Http404
+from django.http.response import HttpResponseBase
+from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.utils.cache import patch_cache_control
+from typing import Tuple
+from fortepan_us.kronofoto.models import Photo
+from fortepan_us.kronofoto.imageutil import TilePyramid
+from fortepan_us.kronofoto.reverse import reverse
+from fortepan_us.kronofoto.resizepool import resize_pool, ResizeQueueFull
+from .images import stored_image, queue_full
+
+IIIF_CONTEXT = "http://iiif.io/api/image/3/context.json"
+
+
+def get_pyramid(photo_id: int) -> TilePyramid:
+    """Get the tile pyramid of a published photo. Photos are only served once
+    the build_iiif_tiles command has built their pyramid.
+
+    Raises:
+        Http404: The photo is not published or its pyramid has not been built.
+    """
+    photo = get_object_or_404(
+        Photo.objects.filter(is_published=True).exclude(original="").only(
+            "id", "original", "original_width", "original_height", "original_orientation",
+        ),
+        pk=photo_id,
+    )
+    width, height = photo.get_upright_dimensions()
+    pyramid = TilePyramid(id=photo.id, path=photo.original.name, width=width, height=height)
+    if not pyramid.built():
+        raise Http404("Tiles have not been built")
+    return pyramid
+
+
+def parse_region(region: str, width: int, height: int) -> Tuple[int, int, int, int]:
+    """Parse an IIIF region parameter.
+
+    Args:
+        region (str): "full", "square" or "x,y,w,h".
+        width (int): Width of the image.
+        height (int): Height of the image.
+
+    Returns:
+        tuple[int, int, int, int]: x, y, width and height, clipped to the image.
+
+    Raises:
+        ValueError: The region is malformed or outside the image.
+    """
+    if region == "full":
+        return (0, 0, width, height)
+    if region == "square":
+        side = min(width, height)
+        return ((width - side) // 2, (height - side) // 2, side, side)
+    x, y, w, h = (int(value) for value in region.split(","))
+    if x < 0 or y < 0 or w <= 0 or h <= 0 or x >= width or y >= height:
+        raise ValueError(region)
+    return (x, y, min(w, width - x), min(h, height - y))
+
+
+def parse_size(size: str, width: int, height: int) -> Tuple[int, int]:
+    """Parse an IIIF size parameter. Upscaling is not supported.
+
+    Args:
+        size (str): "max", "w,", ",h" or "w,h".
+        width (int): Width of the region.
+        height (int): Height of the region.
+
+    Returns:
+        tuple[int, int]: The output width and height.
+
+    Raises:
+        ValueError: The size is malformed, larger than the region or larger than `KF_IIIF_MAX_SIZE`.
+    """
+    max_size = settings.KF_IIIF_MAX_SIZE
+    if size == "max":
+        scale = min(1, max_size / max(width, height))
+        return (max(1, round(width * scale)), max(1, round(height * scale)))
+    w, h = size.split(",")
+    if w and h:
+        result = (int(w), int(h))
+    elif w:
+        result = (int(w), max(1, round(height * int(w) / width)))
+    elif h:
+        result = (max(1, round(width * int(h) / height)), int(h))
+    else:
+        raise ValueError(size)
+    if min(result) <= 0 or result[0] > width or result[1] > height or max(result) > max_size:
+        raise ValueError(size)
+    return result
+
+
+def iiif_headers(resp: HttpResponseBase) -> HttpResponseBase:
+    resp["Access-Control-Allow-Origin"] = "*"
+    patch_cache_control(resp, max_age=60*60, public=True)
+    setattr(resp, 'override_vary', True)
+    return resp
+
+
+def iiif_base(request: HttpRequest, photo: int) -> HttpResponseBase:
+    return HttpResponseRedirect(reverse("kronofoto:iiif-info", kwargs={"photo": photo}))
+
+
+def iiif_info(request: HttpRequest, photo: int) -> HttpResponseBase:
+    pyramid = get_pyramid(photo)
+    max_size = settings.KF_IIIF_MAX_SIZE
+    info = {
+        "@context": IIIF_CONTEXT,
+        "id": reverse("kronofoto:iiif-base", kwargs={"photo": photo}),
+        "type": "ImageService3",
+        "protocol": "http://iiif.io/api/image",
+        "profile": "level1",
+        "width": pyramid.width,
+        "height": pyramid.height,
+        "maxWidth": max_size,
+        "maxHeight": max_size,
+        "tiles": [{"width": pyramid.tile_size, "scaleFactors": pyramid.scale_factors}],
+    }
+    resp = JsonResponse(info, content_type='application/ld+json;profile="{}"'.format(IIIF_CONTEXT))
+    return iiif_headers(resp)
+
+
+def iiif_image(request: HttpRequest, photo: int, region: str, size: str, rotation: str, quality: str, format: str) -> HttpResponseBase:
+    pyramid = get_pyramid(photo)
+    try:
+        box = parse_region(region, pyramid.width, pyramid.height)
+        dimensions = parse_size(size, box[2], box[3])
+    except ValueError:
+        return HttpResponse("Bad request", status=400)
+    if rotation != "0" or quality != "default" or format != "jpg":
+        return HttpResponse("Not implemented", status=501)
+    tile = pyramid.tile(box, dimensions)
+    if tile is not None:
+        stored = tile.stored()
+        if stored is not None:
+            resp = stored_image(request, tile, stored)
+            if resp is not None:
+                return iiif_headers(resp)
+    try:
+        data = resize_pool().render(
+            "{}/{}/{}".format(pyramid.name, ",".join(map(str, box)), ",".join(map(str, dimensions))),
+            lambda: pyramid.region(box, dimensions),
+        )
+    except ResizeQueueFull:
+        return queue_full()
+    if data is None:
+        return HttpResponse("Not found", status=404)
+    return iiif_headers(HttpResponse(data, content_type="image/jpeg"))
@@ -1,13 +1,70 @@
-from django.http import HttpResponse, HttpRequest
+from django.http import HttpResponse, HttpRequest, JsonResponse, HttpResponseRedirect
+from django.http.response import HttpResponseBase
 from django.core.signing import Signer, BadSignature
+from django.core.files.storage import default_storage
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.utils.cache import patch_cache_control, get_conditional_response
+from django.utils.http import http_date
 from typing import Optional, Any, Dict, Union, List, Tuple
-from dataclasses import dataclass
-from fortepan_us.kronofoto.imageutil import ImageCacher
+from dataclasses import dataclass, asdict
+from urllib.parse import quote
+from fortepan_us.kronofoto.imageutil import ImageCacher, StoredDerivative, ThumbnailSprite, available_formats, negotiate_format
+from fortepan_us.kronofoto.resizepool import resize_pool, ResizeQueueFull
 from django.views.decorators.cache import cache_control
 from fortepan_us.kronofoto.decorators import strip_cookies
 
-@cache_control(max_age=60*60, public=True)
-def resize_image(request: HttpRequest, block1: int, block2: int, profile1: str) -> HttpResponse:
+def image_headers(resp: HttpResponseBase) -> HttpResponseBase:
+    patch_cache_control(resp, max_age=60*60, public=True)
+    setattr(resp, 'override_vary', "Accept" if len(available_formats()) > 1 else True)
+    return resp
+
+def queue_full() -> HttpResponse:
+    """Respond to an image request that was turned away by the resize pool."""
+    busy = HttpResponse("Busy", status=503)
+    busy["Retry-After"] = str(settings.KF_RESIZE_RETRY_AFTER)
+    patch_cache_control(busy, no_store=True)
+    return busy
+
+def stored_image(request: HttpRequest, cacher: ImageCacher, stored: StoredDerivative) -> Optional[HttpResponseBase]:
+    """Respond with a derivative that is already in storage.
+
+    Depending on `KF_IMAGE_SERVE_MODE`, the web server is asked to send the
+    file ("x-accel-redirect" or "x-sendfile"), the client is redirected to the
+    storage URL ("redirect"), or the file is read and returned ("python").
+    Conditional requests are answered with 304 in every mode.
+
+    Args:
+        request (HttpRequest): The image request.
+        cacher (ImageCacher): The derivative profile.
+        stored (StoredDerivative): The storage metadata of the derivative.
+
+    Returns:
+        HttpResponseBase | None: The response, or None if the derivative could not be read.
+    """
+    last_modified = int(stored.modified.timestamp())
+    not_modified = get_conditional_response(request, etag=stored.etag, last_modified=last_modified)
+    mode = settings.KF_IMAGE_SERVE_MODE
+    if not_modified is not None:
+        resp: HttpResponseBase = not_modified
+    elif mode == "redirect":
+        resp = HttpResponseRedirect(default_storage.url(stored.name))
+    elif mode == "x-accel-redirect":
+        resp = HttpResponse(content_type=cacher.content_type)
+        resp["X-Accel-Redirect"] = quote(settings.KF_IMAGE_ACCEL_PREFIX + stored.name)
+    elif mode == "x-sendfile":
+        resp = HttpResponse(content_type=cacher.content_type)
+        resp["X-Sendfile"] = default_storage.path(stored.name)
+    else:
+        data = cacher.cached()
+        if data is None:
+            return None
+        resp = HttpResponse(data, content_type=cacher.content_type)
+    resp["ETag"] = stored.etag
+    resp["Last-Modified"] = http_date(last_modified)
+    return image_headers(resp)
+
+def resize_image(request: HttpRequest, block1: int, block2: int, profile1: str) -> HttpResponseBase:
     signer = Signer(salt=f"{block1}/{block2}")
     spec = request.GET.get('i')
     profile = f"{spec}:{profile1}"
@@ -17,6 +74,7 @@ def resize_image(request: HttpRequest, block1: int, block2: int, profile1: str)
             path: Union[str, Tuple[int, str]] = unsigned[0]
             width = unsigned[1]
             height = unsigned[2]
+            photo_id = unsigned[3] if len(unsigned) > 3 else None
         except:
             return HttpResponse("Not found", status=404)
         cacher = ImageCacher(
@@ -26,9 +84,42 @@ def resize_image(request: HttpRequest, block1: int, block2: int, profile1: str)
             sig=profile1,
             width=width,
             height=height,
+            format=negotiate_format(request.headers.get("Accept", "")),
+            photo_id=photo_id,
         )
-        resp = HttpResponse(cacher.precache(), content_type="image/jpeg")
-        setattr(resp, 'override_vary', True)
-        return resp
+        stored = cacher.stored()
+        if stored is not None:
+            resp = stored_image(request, cacher, stored)
+            if resp is not None:
+                return resp
+        try:
+            data = resize_pool().render(cacher.name, cacher.render)
+        except ResizeQueueFull:
+            return queue_full()
+        if data is None:
+            return HttpResponse("Not found", status=404)
+        return image_headers(HttpResponse(data, content_type=cacher.content_type))
     except BadSignature:
         return HttpResponse("Not found", status=404)
+
+def thumbnail_sprite(request: HttpRequest, key: str) -> HttpResponseBase:
+    try:
+        sprite = ThumbnailSprite.unsign(request.GET.get('i', ''))
+    except (BadSignature, TypeError, ValueError):
+        return HttpResponse("Not found", status=404)
+    if sprite.key != key:
+        return HttpResponse("Not found", status=404)
+    data = sprite.cached()
+    if data is None:
+        try:
+            data = resize_pool().render(sprite.name, sprite.render)
+        except ResizeQueueFull:
+            return queue_full()
+    resp = HttpResponse(data, content_type="image/jpeg")
+    patch_cache_control(resp, max_age=60*60, public=True)
+    setattr(resp, 'override_vary', True)
+    return resp
+
+@staff_member_required
+def resize_stats(request: HttpRequest) -> HttpResponse:
+    return JsonResponse(asdict(resize_pool().stats()))
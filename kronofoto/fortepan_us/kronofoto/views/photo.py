@@ -19,6 +19,7 @@ from .base import PhotoRequest
 from typing import final, TypedDict
 from .basetemplate import Theme
 from fortepan_us.kronofoto.forms import CarouselForm
+from fortepan_us.kronofoto.imageutil import ThumbnailSprite
 import random
 from itertools import cycle, chain, islice
 from dataclasses import dataclass
@@ -91,6 +92,13 @@ class CarouselListView(BasePhotoTemplateMixin, MultipleObjectMixin, TemplateView
                 'offset': offset,
             },
         }
+        if settings.KF_CAROUSEL_SPRITES:
+            sprite = ThumbnailSprite.for_photos([p for p in objects if isinstance(p, Photo)])
+            for p in objects:
+                if isinstance(p, Photo) and p.id in sprite.offsets:
+                    setattr(p, 'sprite_position', "-{}px 0".format(sprite.offsets[p.id]))
+            context['sprite_url'] = sprite.url
+            context['sprite_blank'] = EMPTY_PNG
         return self.render_to_response(context)
 
     def form_invalid(self, form: CarouselForm) -> HttpResponse:
@@ -21,6 +21,7 @@ from django.db.models import OuterRef, Exists, Q, QuerySet, Subquery
 from django_stubs_ext import WithAnnotations
 from django.contrib.gis.db.models.functions import Distance
 from django.conf import settings
+from django.core.files.storage import default_storage
 from django import forms
 from .base import ArchiveRequest
 from dataclasses import dataclass
@@ -103,10 +104,22 @@ class PhotoSphereDict(TypedDict):
     photos: List[ImagePlaneDict]
     infoboxes: List[InfoBoxDict]
 
+class PanoramaLevelDict(TypedDict):
+    width: int
+    cols: int
+    rows: int
+    zoomRange: List[int]
+
+class TiledPanoramaDict(TypedDict):
+    baseUrl: str
+    width: int
+    levels: List[PanoramaLevelDict]
+    tileUrl: str
+
 class NodeData(TypedDict, total=False):
     id: str
     useNewAnglesOrder: bool
-    panorama: str
+    panorama: Union[str, TiledPanoramaDict]
     sphereCorrection: Dict[str, float]
     gps: Tuple[float, float]
     links: List[LinksDict]
@@ -312,6 +325,19 @@ class ValidPhotoSphereView:
     def photo_url(self, photo: Photo) -> str:
         return photo.get_absolute_url()
 
+    @property
+    def panorama(self) -> Union[str, TiledPanoramaDict]:
+        tile_set = self.object.tile_set
+        if not tile_set:
+            return self.object.image.url
+        directory = default_storage.url(tile_set["directory"])
+        return {
+            "baseUrl": "{}/base.jpg".format(directory),
+            "width": tile_set["width"],
+            "levels": tile_set["levels"],
+            "tileUrl": directory + "/{level}/{col}_{row}.jpg",
+        }
+
     @property
     def json_response(self) -> JsonResponse:
         info_template = get_template(template_name="kronofoto/components/mainstreet-info.html")
@@ -325,7 +351,7 @@ class ValidPhotoSphereView:
         ]
         node: NodeData = {
             "id": str(object.id),
-            "panorama": object.image.url,
+            "panorama": self.panorama,
             "sphereCorrection": {"pan": (object.heading-90)/180 * 3.1416},
             "gps": (object.location.x, object.location.y) if object.location else (0, 0),
             "links": links,
@@ -7,12 +7,14 @@ from django.conf import settings
 from typing_extensions import Annotated
 from django.contrib.gis.geos import Point, Polygon, MultiPolygon
 from fortepan_us.kronofoto import models
-from django.contrib.gis.db.models.functions import Transform
+from django.contrib.gis.db.models.functions import Transform, SnapToGrid
+from django.db.models import Count, Min
 from django.views.decorators.vary import vary_on_headers
 import mercantile # type: ignore
 from dataclasses import dataclass
 import icontract
 from django.views.decorators.cache import cache_page
+from django.utils.cache import patch_cache_control
 from django.core.cache import cache
 from fortepan_us.kronofoto.reverse import reverse
 from .base import ArchiveRequest, ArchiveReference
@@ -114,6 +116,14 @@ class TileLayerBase:
         raise NotImplementedError
 
 
+    def encode(self) -> bytes:
+        """Encode the layers of this tile.
+
+        Returns:
+            bytes: The mapbox vector tile.
+        """
+        return mapbox_vector_tile.encode(self.layers)
+
     @property
     def response(self) -> HttpResponse:
         """Get an HttpResponse containing a mapbox vector tile for these x, y, and z.
@@ -122,7 +132,7 @@ class TileLayerBase:
             HttpResponse: A HttpResponse with a body consisting of this mapbox vector tile and with the correct mime type.
         """
         return HttpResponse(
-            mapbox_vector_tile.encode(self.layers),
+            self.encode(),
             headers={
                 "Content-Type": "application/vnd.mapbox-vector-tile",
             },
@@ -286,6 +296,39 @@ class PhotoMapTile(TileLayerBase):
     url_kwargs: Dict[str, Any]
     get_params: QueryDict
 
+    @property
+    def scope(self) -> str:
+        """Identifies the archive and category of this tile in the tile store.
+
+        Returns:
+            str: The url kwargs, sorted and joined.
+        """
+        return "&".join("{}={}".format(k, v) for (k, v) in sorted(self.url_kwargs.items()))
+
+    @property
+    def stored_response(self) -> HttpResponse:
+        """Get an HttpResponse for this tile from the tile store, rendering
+        and storing it if necessary. This is only valid for unfiltered tiles.
+
+        Returns:
+            HttpResponse: A HttpResponse with a body consisting of this mapbox vector tile and with the correct mime type.
+        """
+        data = models.MapTile.objects.get_or_render(
+            scope=self.scope,
+            zoom=self.zoom,
+            x=self.x,
+            y=self.y,
+            render=self.encode,
+        )
+        resp = HttpResponse(
+            data,
+            headers={
+                "Content-Type": "application/vnd.mapbox-vector-tile",
+            },
+        )
+        patch_cache_control(resp, max_age=60*10, public=True)
+        return resp
+
     @cached_property
     def photos(self) -> Iterable[AnnotatedPhoto]:
         """Returns the Photo that should be included in this tile.
@@ -297,7 +340,70 @@ class PhotoMapTile(TileLayerBase):
             location_point__intersects=self.bbox(),
         ).annotate(geom2=Transform("location_point", 3857))
 
+    def clustered_features(self, *, x_span: float, y_span: float, x0: float, y0: float) -> list[Feature]:
+        """Get one feature per occupied cell of the tile subgrid, grouping the
+        photos in the database.
+
+        Each photo location is snapped to the center of its cell, and photos
+        are grouped by that center. Only the representative photo of each
+        cell, the one with the lowest id, is loaded.
+
+        Returns:
+            list[Feature]: Points at cell centers with the representative photo and the number of photos in the cell.
+        """
+        tb = TileBounds(*self.bbox(3857).extent)
+        cells = models.Photo.objects.filter(id__in=self.photos.values("id")).annotate(
+            cell=SnapToGrid(
+                Transform("location_point", 3857),
+                tb.cell_width,
+                tb.cell_height,
+                tb.xmin + tb.cell_width/2,
+                tb.ymin + tb.cell_height/2,
+            ),
+        ).values("cell").annotate(count=Count("id"), representative=Min("id")).order_by()
+        occupied = {}
+        for cell in cells:
+            xcell, ycell = tb.get_cell(*cell["cell"].coords)
+            if 0 <= xcell < tb.subdivisions and 0 <= ycell < tb.subdivisions:
+                occupied[(xcell, ycell)] = (cell["count"], cell["representative"])
+        representatives = models.Photo.objects.only("id", "original", "remote_image").in_bulk(
+            [representative for (_, representative) in occupied.values()]
+        )
+
+        if self.get_params:
+            params = "?" + self.get_params.urlencode()
+        else:
+            params = ""
+        features_ : list[Feature] = []
+        for (x, y), (count, representative) in sorted(occupied.items()):
+            p = representatives[representative]
+            px, py = tb.get_center(x, y)
+            point = Point(
+                round((px - x0) * 4096 / x_span),
+                round((py - y0) * 4096 / y_span),
+            )
+            features_.append(
+                {
+                    "geometry": point.wkt,
+                    "properties": {
+                        "id": p.id,
+                        "href": reverse("kronofoto:map-detail", kwargs={"photo": p.id, **self.url_kwargs}) + params,
+                        "thumb": p.image_url(width=75, height=75),
+                        "count": count,
+                        "popup_href": reverse("kronofoto:map-subtile-detail", kwargs={**self.url_kwargs, **{"x": self.x, "y": self.y, "zoom": self.zoom, "subx": x, "suby": y}}) + params if count > 1 else "",
+                    },
+                }
+            )
+        return features_
+
     def get_layers(self, *, x_span: float, y_span: float, x0: float, y0: float) -> list[Layer]:
+        if settings.KF_MAP_TILE_SQL_CLUSTERING:
+            return [
+                {
+                    "name": "photos",
+                    "features": self.clustered_features(x_span=x_span, y_span=y_span, x0=x0, y0=y0),
+                },
+            ]
         features_ : list[Feature] = []
         photos = self.photos
         bbox = self.bbox(3857)
@@ -382,6 +488,9 @@ class PhotoMapTile(TileLayerBase):
 
 @cache_page(60*10)
 @vary_on_headers("")
+def filtered_photo_tile(request: HttpRequest, /, *, tile: PhotoMapTile) -> HttpResponse:
+    return tile.response
+
 def photo_tile(request: HttpRequest, /, *, archive: Optional[str]=None, domain: Optional[str]=None, category: Optional[str]=None, zoom: int, x: int, y: int) -> HttpResponse:
     """View function for Place map tiles.
 
@@ -395,6 +504,10 @@ def photo_tile(request: HttpRequest, /, *, archive: Optional[str]=None, domain:
         y (int): tile y index
     Returns:
         HttpResponse: The response contains the mapbox vector tile, or will return a 400 response if the zoom level is negative or too high.
+
+    Unfiltered tiles up to `KF_MAP_TILE_MAX_ZOOM` are served from the tile
+    store. Search results and deeper zoom levels are rendered and cached for
+    ten minutes.
     """
     archive_ref = None
     if archive:
@@ -402,14 +515,17 @@ def photo_tile(request: HttpRequest, /, *, archive: Optional[str]=None, domain:
     areq = ArchiveRequest(request=request, archive_ref=archive_ref, category=category)
     if zoom < 0 or zoom >= 35:
         return HttpResponse("invalid zoom level", status=400)
-    return PhotoMapTile(
+    tile = PhotoMapTile(
         queryset=areq.get_photo_queryset(),
         url_kwargs=areq.url_kwargs,
         get_params=areq.get_params,
         zoom=zoom,
         x=x,
         y=y,
-    ).response
+    )
+    if areq.final_expr or areq.get_params or zoom > settings.KF_MAP_TILE_MAX_ZOOM:
+        return filtered_photo_tile(request, tile=tile)
+    return tile.stored_response
 
 
 def photosphere_vector_tile(request: HttpRequest, /, *, tour: Optional[int]=None, mainstreet: int, zoom: int, x: int, y: int) -> HttpResponse:
@@ -1006,7 +1006,7 @@ class PhotoSpherePlugin {
     }
     install({elem}) {
         for (const elem2 of elem.querySelectorAll("[data-photosphere-data]")) {
-            import("./photosphere-bundle.js").then(({Viewer, MarkersPlugin, PlanPlugin, VirtualTourPlugin, ImagePlanePlugin}) => {
+            import("./photosphere-bundle.js").then(({Viewer, EquirectangularTilesAdapter, MarkersPlugin, PlanPlugin, VirtualTourPlugin, ImagePlanePlugin}) => {
             class MyViewer extends Viewer {
                 setPanorama(panorama, data) {
                     const tourPlugin = this.getPlugin(VirtualTourPlugin)
@@ -1051,7 +1051,16 @@ class PhotoSpherePlugin {
                                 const url = new URL(api_url)
                                 url.searchParams.append(param_name, nodeId)
                                 const resp = await fetch(url.toString())
-                                return resp.json()
+                                const node = await resp.json()
+                                if (typeof node.panorama === "object") {
+                                    const template = node.panorama.tileUrl
+                                    node.panorama.tileUrl = (col, row, level) =>
+                                        template
+                                            .replace("{level}", level)
+                                            .replace("{col}", col)
+                                            .replace("{row}", row)
+                                }
+                                return node
                             },
                             preload: true,
                             transitionOptions: (toNode, fromNode, fromLink) => ({
@@ -1127,6 +1136,7 @@ class PhotoSpherePlugin {
             }
             const viewer = new MyViewer({
                 container: elem2,
+                adapter: EquirectangularTilesAdapter,
                 navbar: [
                     "zoom",
                     "move",
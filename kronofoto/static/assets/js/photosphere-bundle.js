@@ -1,4 +1,5 @@
 export {Viewer} from "@photo-sphere-viewer/core"
+export {EquirectangularTilesAdapter} from "@photo-sphere-viewer/equirectangular-tiles-adapter"
 export {MarkersPlugin} from "@photo-sphere-viewer/markers-plugin"
 export {PlanPlugin} from "@photo-sphere-viewer/plan-plugin"
 export {VirtualTourPlugin} from "@photo-sphere-viewer/virtual-tour-plugin"
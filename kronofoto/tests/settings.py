@@ -81,6 +81,7 @@ STORAGES = {
 
 AUTHENTICATION_BACKENDS = ['fortepan_us.kronofoto.auth.backends.ArchiveBackend']
 KF_URL_SCHEME = ""
+KF_SEARCH_RESULT_CACHE = None
 GOOGLE_RECAPTCHA3_SITE_KEY = 'google_test_key'
 GOOGLE_RECAPTCHA3_SECRET_KEY = 'google_secret_key'
 USE_TZ = True
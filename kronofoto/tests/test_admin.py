@@ -207,6 +207,17 @@ def test_photoadmin_save_form():
     ma.save_form(request, form, change)
     assert [] == change.mock_calls
 
+def test_render_derivatives_warns_on_unreadable_original():
+    from unittest import mock
+    photo = Photo(id=1, original="broken.jpg")
+    request = RequestFactory().post('/')
+    with mock.patch.object(DerivativePipeline, "run", side_effect=OSError("cannot identify image file")), \
+            mock.patch.object(DerivativePipeline, "save_placeholder") as save_placeholder, \
+            mock.patch.object(messages, "warning") as warning:
+        render_derivatives(request, photo)
+    save_placeholder.assert_not_called()
+    assert "cannot identify image file" in warning.call_args.args[1]
+
 def test_usertaginline():
     ma = UserTagInline(Photo, admin_site=AdminSite())
     mock = Mock(spec=PhotoTag.creator.through, autospec=True)
@@ -605,3 +616,118 @@ def test_termfilter():
         else:
             qs.annotate().filter.assert_called_once_with(terms__count=int(lookup))
 
+
+@pytest.mark.django_db()
+def test_bulk_ingest(settings):
+    from fortepan_us.kronofoto.forms import BatchIngestForm
+    from fortepan_us.kronofoto.ingest import BulkIngest
+    from fortepan_us.kronofoto.models import Category, IngestItem, WordCount
+    from concurrent.futures import ThreadPoolExecutor
+    from django.utils.datastructures import MultiValueDict
+    from PIL import Image
+    settings.KF_DERIVATIVE_PROFILES = [(75, 75)]
+    settings.KF_IMAGE_FORMATS = []
+    archive = Archive.objects.create(slug="ingest")
+    category = Category.objects.create(name="ingest", slug="ingest")
+    def jpeg():
+        data = BytesIO()
+        Image.new("RGB", (300, 200)).save(data, "JPEG")
+        return SimpleUploadedFile("photo.jpg", data.getvalue(), content_type="image/jpeg")
+    form = BatchIngestForm(
+        {"archive": archive.id, "category": category.id, "license": "CC-BY-SA-4.0", "year": 1950, "caption": "main street parade"},
+        MultiValueDict({"files": [jpeg(), jpeg(), SimpleUploadedFile("broken.jpg", b"not an image")]}),
+    )
+    assert form.is_valid(), form.errors
+    batch = form.save_batch(None)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        BulkIngest(batch=batch, executor=executor).run()
+    assert batch.progress() == {"queued": 0, "created": 0, "done": 2, "failed": 1, "total": 3}
+    assert batch.items.get(state=IngestItem.State.FAILED).filename == "broken.jpg"
+    photos = Photo.objects.filter(ingestitem__batch=batch)
+    assert {(p.year, p.original_width, p.original_height, bool(p.placeholder)) for p in photos} == {(1950, 300, 200, True)}
+    assert WordCount.objects.filter(photo__in=photos, field="CA", word="parade").count() == 2
+
+@pytest.mark.django_db()
+def test_bulk_ingest_interrupted_while_indexing(settings):
+    from fortepan_us.kronofoto.forms import BatchIngestForm
+    from fortepan_us.kronofoto.ingest import BulkIngest
+    from fortepan_us.kronofoto.models import Category, IngestItem
+    from concurrent.futures import ThreadPoolExecutor
+    from django.utils.datastructures import MultiValueDict
+    from unittest import mock
+    from PIL import Image
+    settings.KF_DERIVATIVE_PROFILES = [(75, 75)]
+    settings.KF_IMAGE_FORMATS = []
+    archive = Archive.objects.create(slug="ingest")
+    category = Category.objects.create(name="ingest", slug="ingest")
+    data = BytesIO()
+    Image.new("RGB", (300, 200)).save(data, "JPEG")
+    form = BatchIngestForm(
+        {"archive": archive.id, "category": category.id, "license": "CC-BY-SA-4.0", "year": 1950},
+        MultiValueDict({"files": [SimpleUploadedFile("photo.jpg", data.getvalue(), content_type="image/jpeg")]}),
+    )
+    assert form.is_valid(), form.errors
+    batch = form.save_batch(None)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with mock.patch.object(BulkIngest, "index", side_effect=RuntimeError):
+            with pytest.raises(RuntimeError):
+                BulkIngest(batch=batch, executor=executor).run()
+        assert not Photo.objects.filter(ingestitem__batch=batch).exists()
+        assert batch.items.get().state == IngestItem.State.QUEUED
+        BulkIngest(batch=batch, executor=executor).run()
+    assert batch.progress()["done"] == 1
+    assert Photo.objects.filter(ingestitem__batch=batch).count() == 1
+
+@pytest.mark.django_db()
+def test_ingest_batch_claims(settings):
+    from fortepan_us.kronofoto.models import IngestBatch
+    from django.utils import timezone
+    from datetime import timedelta
+    batch = IngestBatch.objects.create()
+    assert IngestBatch.objects.claim(batch.id)
+    assert not IngestBatch.objects.claim(batch.id)
+    batch.refresh_from_db()
+    assert not batch.stalled()
+    IngestBatch.objects.filter(id=batch.id).update(
+        heartbeat=timezone.now() - timedelta(seconds=settings.KF_INGEST_STALLED_AFTER + 1),
+    )
+    batch.refresh_from_db()
+    assert batch.stalled()
+    assert IngestBatch.objects.claim(batch.id)
+    IngestBatch.objects.filter(id=batch.id).update(finished=timezone.now(), heartbeat=None)
+    assert not IngestBatch.objects.claim(batch.id)
+
+@pytest.mark.django_db()
+def test_ctda_import(settings):
+    from fortepan_us.kronofoto.management.commands.import_ctda_photos import Command
+    from fortepan_us.kronofoto.models import Category, ConnecticutRecord, WordCount
+    from concurrent.futures import ThreadPoolExecutor
+    from unittest import mock
+    from PIL import Image
+    settings.KF_DERIVATIVE_PROFILES = [(75, 75)]
+    settings.KF_IMAGE_FORMATS = []
+    command = Command()
+    command.archive = Archive.objects.create(slug="ctda")
+    command.category = Category.objects.create(name="ctda", slug="ctda")
+    command.donors = {}
+    records = [
+        ConnecticutRecord.objects.create(
+            file_id1=12, file_id2=id, title="Main Street", year="1920", contributor="Smith",
+            description="parade {}".format(id), location="Hartford", cleaned_year=1920, cleaned_city="Hartford",
+        )
+        for id in (1, 2)
+    ]
+    tiff = BytesIO()
+    Image.new("RGBA", (300, 200)).save(tiff, "TIFF")
+    def get(url, **kwargs):
+        resp = MagicMock()
+        resp.__enter__.return_value.iter_content.return_value = [tiff.getvalue() if url == records[0].tiff_url() else b"not a tiff"]
+        return resp
+    with mock.patch("requests.get", side_effect=get), ThreadPoolExecutor(max_workers=2) as executor:
+        assert command.import_records(records, executor) == (1, 1)
+    records[0].refresh_from_db()
+    records[1].refresh_from_db()
+    photo = records[0].photo
+    assert (photo.archive, photo.donor.last_name, photo.city, photo.year, photo.original_width) == (command.archive, "Smith", "Hartford", 1920, 300)
+    assert WordCount.objects.filter(photo=photo, field="CA", word="parade").exists()
+    assert records[1].photo is None
@@ -0,0 +1,71 @@
+from django.test import TestCase, Client
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import reverse
+from fortepan_us.kronofoto.models import Archive, Category, Photo, Place, PlaceType, Tag, PhotoTag, Term
+from fortepan_us.kronofoto.views.data import DataExport
+from .util import small_gif
+import csv
+import json
+
+
+class DataDumpTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.archive = Archive.objects.create(slug="an-archive")
+        category = Category.objects.create(slug="a-category")
+        place_type = PlaceType.objects.create()
+        state = Place.objects.create(place_type=place_type, name="Iowa")
+        county = Place.objects.create(place_type=place_type, name="Polk", parent=state)
+        city = Place.objects.create(place_type=place_type, name="Des Moines", parent=county)
+        term = Term.objects.create(term="Streets")
+        tag = Tag.objects.create(tag="cars")
+        cls.photos = []
+        for i, place in enumerate([city, county, None, state, city]):
+            photo = Photo.objects.create(
+                archive=cls.archive,
+                category=category,
+                original=SimpleUploadedFile("small.gif", small_gif, content_type="image/gif"),
+                place=place,
+                year=1950 + i,
+            )
+            photo.terms.add(term)
+            PhotoTag.objects.create(photo=photo, tag=tag, accepted=i % 2 == 0)
+            cls.photos.append(photo)
+        cls.user = User.objects.create_superuser("admin", "admin@example.com", "admin")
+
+    def test_export_rows(self):
+        rows = list(DataExport(photos=Photo.objects.filter(archive=self.archive)).rows())
+        assert [row["ID"] for row in rows] == [p.id for p in self.photos]
+        assert rows[0]["geographic_subject"] == "Des Moines^^Polk^^Iowa"
+        assert rows[1]["geographic_subject"] == "Polk^^Iowa"
+        assert rows[2]["geographic_subject"] == ""
+        assert rows[3]["geographic_subject"] == "Iowa"
+        assert rows[0]["subject"] == "Streets^^cars"
+        assert rows[1]["subject"] == "Streets"
+
+    def test_pages_do_not_skip_photos(self):
+        client = Client()
+        client.force_login(self.user)
+        url = "{}?limit=2".format(reverse("kronofoto:data-dump", kwargs={"short_name": "an-archive"}))
+        ids = []
+        while url:
+            resp = client.get(url)
+            assert resp.status_code == 200
+            data = json.loads(b"".join(resp.streaming_content))
+            ids += [row["ID"] for row in data["results"]]
+            url = data["next"]
+        assert ids == [p.id for p in self.photos]
+
+    def test_csv(self):
+        client = Client()
+        client.force_login(self.user)
+        url = "{}?format=csv".format(reverse("kronofoto:data-dump", kwargs={"short_name": "an-archive"}))
+        resp = client.get(url)
+        assert resp["Content-Type"] == "text/csv"
+        rows = list(csv.DictReader(b"".join(resp.streaming_content).decode().splitlines()))
+        assert [int(row["ID"]) for row in rows] == [p.id for p in self.photos]
+
+    def test_requires_permission(self):
+        resp = Client().get(reverse("kronofoto:data-dump", kwargs={"short_name": "an-archive"}))
+        assert resp.status_code == 403
@@ -2,8 +2,10 @@ from django.test import Client, RequestFactory, SimpleTestCase
 from django.http import QueryDict
 from hypothesis.extra.django import from_model, register_field_strategy, TestCase
 from hypothesis import strategies as st, given, note, settings
-from unittest.mock import Mock, sentinel, MagicMock
+from unittest.mock import Mock, sentinel, MagicMock, patch
 from fortepan_us.kronofoto.views.grid import GridView
+from fortepan_us.kronofoto.views.basetemplate import BasePhotoTemplateMixin
+from fortepan_us.kronofoto.search.results import SearchResults
 from fortepan_us.kronofoto.models import Archive
 from fortepan_us.kronofoto.forms import SearchForm
 from dataclasses import dataclass
@@ -31,3 +33,13 @@ class Tests(TestCase):
         context = view.get_no_objects_context(objects)
         assert not context['noresults']
 
+    def test_single_search_result_gone(self):
+        queryset = MagicMock()
+        queryset.values_list.return_value = [5]
+        results = SearchResults(queryset=queryset, key="kf:search:stale")
+        view = GridView()
+        view.archive_request = Mock()
+        view.archive_request.final_expr.is_collection.return_value = False
+        view.archive_request.get_search_results.return_value = results
+        with patch.object(BasePhotoTemplateMixin, "get_queryset"):
+            assert view.get_queryset() is results
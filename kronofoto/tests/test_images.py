@@ -3,8 +3,17 @@ from django.test import Client, RequestFactory, TestCase
 from django.core.files.storage import default_storage
 from .util import small_gif, a_photo, a_category, an_archive
 from django.core.files.base import ContentFile
-from unittest.mock import Mock
+from django.core.files.uploadedfile import SimpleUploadedFile
+from fortepan_us.kronofoto.models import Photo
+from unittest.mock import Mock, patch
+from fortepan_us.kronofoto.imageutil import ImageCacher, DerivativePipeline, ImageSigner, SignedUrlCache, ThumbnailSprite, TilePyramid, negotiate_format, read_placeholder, difference_hash
+from dataclasses import replace
+from fortepan_us.kronofoto.remoteimages import RemoteOriginalCache, RemoteImageError
+from PIL import Image, ExifTags
+from io import BytesIO, StringIO
 import pytest
+import base64
+import time
 
 @pytest.mark.django_db()
 def test_image_url(a_photo):
@@ -14,3 +23,462 @@ def test_image_url(a_photo):
     assert resp.status_code == 200
     resp = client.get(url[:-1])
     assert resp.status_code == 404
+
+@pytest.mark.django_db()
+def test_image_url_conditional_request(a_photo):
+    url = image_url(photo=a_photo, width=100, height=100)[len("//example.com"):]
+    client = Client()
+    client.get(url)
+    resp = client.get(url)
+    assert resp.status_code == 200
+    assert resp["ETag"]
+    resp = client.get(url, HTTP_IF_NONE_MATCH=resp["ETag"])
+    assert resp.status_code == 304
+
+@pytest.mark.django_db()
+def test_image_url_accel_redirect(a_photo, settings):
+    settings.KF_IMAGE_SERVE_MODE = "x-accel-redirect"
+    settings.KF_IMAGE_ACCEL_PREFIX = "/protected/"
+    url = image_url(photo=a_photo, width=100, height=100)[len("//example.com"):]
+    client = Client()
+    resp = client.get(url)
+    assert resp.status_code == 200
+    assert resp.content
+    resp = client.get(url)
+    assert resp.status_code == 200
+    assert resp["X-Accel-Redirect"].startswith("/protected/images/")
+    assert resp.content == b""
+
+def test_resize_pool_coalesces_same_key():
+    from fortepan_us.kronofoto.resizepool import ResizePool
+    import threading
+    pool = ResizePool(size=1, queue_limit=4, timeout=5)
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+    def render():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return b"data"
+    results = []
+    leader = threading.Thread(target=lambda: results.append(pool.render("a", render)))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=lambda: results.append(pool.render("a", render)))
+    follower.start()
+    while pool.stats().coalesced == 0:
+        time.sleep(0.001)
+    release.set()
+    leader.join()
+    follower.join()
+    assert results == [b"data", b"data"]
+    assert len(calls) == 1
+    stats = pool.stats()
+    assert stats.renders == 1
+    assert stats.in_flight == 0
+    assert stats.queue_depth == 0
+
+def test_resize_pool_rejects_when_saturated():
+    from fortepan_us.kronofoto.resizepool import ResizePool, ResizeQueueFull
+    import threading
+    pool = ResizePool(size=1, queue_limit=0, timeout=5)
+    started = threading.Event()
+    release = threading.Event()
+    def slow():
+        started.set()
+        release.wait(5)
+        return b"slow"
+    leader = threading.Thread(target=lambda: pool.render("a", slow))
+    leader.start()
+    started.wait(5)
+    with pytest.raises(ResizeQueueFull):
+        pool.render("b", lambda: b"data")
+    release.set()
+    leader.join()
+    assert pool.stats().rejected == 1
+    assert pool.render("b", lambda: b"data") == b"data"
+
+def test_resize_pool_times_out_waiting_for_slot():
+    from fortepan_us.kronofoto.resizepool import ResizePool, ResizeQueueFull
+    import threading
+    pool = ResizePool(size=1, queue_limit=1, timeout=0.01)
+    started = threading.Event()
+    release = threading.Event()
+    def slow():
+        started.set()
+        release.wait(5)
+        return b"slow"
+    leader = threading.Thread(target=lambda: pool.render("a", slow))
+    leader.start()
+    started.wait(5)
+    with pytest.raises(ResizeQueueFull):
+        pool.render("b", lambda: b"data")
+    release.set()
+    leader.join()
+    assert pool.stats().rejected == 1
+
+def jpeg(width, height, orientation=1):
+    exif = Image.Exif()
+    exif[ExifTags.Base.Orientation] = orientation
+    data = BytesIO()
+    Image.new("RGB", (width, height)).save(data, "JPEG", exif=exif)
+    return BytesIO(data.getvalue())
+
+def test_decode_thumbnail_in_draft_mode():
+    cacher = ImageCacher(block1=0, block2=0, path="original.jpg", sig="sig", width=75, height=75)
+    assert cacher.decode(jpeg(4000, 3000)).size == (500, 375)
+
+def test_decode_draft_mode_respects_orientation():
+    cacher = ImageCacher(block1=0, block2=0, path="original.jpg", sig="sig", width=0, height=700)
+    assert cacher.decode(jpeg(4000, 3000, orientation=6)).size == (750, 1000)
+
+def test_decode_small_original_full_size():
+    cacher = ImageCacher(block1=0, block2=0, path="original.jpg", sig="sig", width=500, height=500)
+    assert cacher.decode(jpeg(600, 400)).size == (600, 400)
+
+@pytest.mark.django_db()
+def test_derivative_pipeline_renders_every_profile(settings):
+    settings.KF_IMAGE_FORMATS = []
+    name = default_storage.save("original/pipeline.jpg", ContentFile(jpeg(3000, 2000).getvalue()))
+    pipeline = DerivativePipeline(id=5, path=name, profiles=[(75, 75), (0, 700), (500, 500), (0, 1400)])
+    rendered = pipeline.run()
+    assert [(cacher.width, cacher.height) for cacher in rendered] == [(0, 1400), (0, 700), (500, 500), (75, 75)]
+    sizes = [Image.open(default_storage.open(cacher.name)).size for cacher in pipeline.cachers]
+    assert sizes == [(75, 75), (1050, 700), (500, 500), (2100, 1400)]
+    assert pipeline.missing() == []
+    assert pipeline.run() == []
+
+@pytest.mark.django_db()
+def test_derivative_pipeline_renders_each_format(settings):
+    settings.KF_IMAGE_FORMATS = ["webp"]
+    name = default_storage.save("original/formats.jpg", ContentFile(jpeg(1000, 800).getvalue()))
+    pipeline = DerivativePipeline(id=6, path=name, profiles=[(75, 75), (0, 700)])
+    rendered = pipeline.run()
+    assert [(cacher.width, cacher.height, cacher.format) for cacher in rendered] == [
+        (0, 700, "webp"), (0, 700, "jpeg"), (75, 75, "webp"), (75, 75, "jpeg"),
+    ]
+    for cacher in rendered:
+        image = Image.open(default_storage.open(cacher.name))
+        assert image.format == cacher.format.upper()
+        assert image.size == ((875, 700) if cacher.height == 700 else (75, 75))
+
+@pytest.mark.django_db()
+def test_derivative_pipeline_renders_jpeg_only(settings):
+    settings.KF_IMAGE_FORMATS = ["webp"]
+    name = default_storage.save("original/jpeg-only.jpg", ContentFile(jpeg(1000, 800).getvalue()))
+    pipeline = DerivativePipeline(id=7, path=name, profiles=[(75, 75), (0, 700)])
+    rendered = pipeline.run(cachers=pipeline.jpeg_cachers)
+    assert [(cacher.width, cacher.height, cacher.format) for cacher in rendered] == [(0, 700, "jpeg"), (75, 75, "jpeg")]
+    assert [cacher.format for cacher in pipeline.missing()] == ["webp", "webp"]
+    assert pipeline.placeholder
+
+@pytest.mark.django_db()
+def test_derivative_pipeline_makes_placeholder(settings):
+    settings.KF_IMAGE_FORMATS = []
+    name = default_storage.save("original/placeholder.jpg", ContentFile(jpeg(1200, 800, orientation=6).getvalue()))
+    pipeline = DerivativePipeline(id=8, path=name, profiles=[(75, 75), (0, 700)])
+    pipeline.run()
+    assert pipeline.placeholder.startswith("data:image/")
+    assert len(pipeline.placeholder) < 200
+    with default_storage.open(name) as infile:
+        placeholder = read_placeholder(infile)
+    header, data = placeholder.split(",")
+    assert Image.open(BytesIO(base64.b64decode(data))).size == (11, 16)
+
+def test_placeholder_fits_field_without_webp(monkeypatch):
+    import os
+    from fortepan_us.kronofoto import imageutil
+    monkeypatch.setattr(imageutil, "can_encode", lambda format: False)
+    noise = Image.frombytes("RGB", (160, 120), os.urandom(160 * 120 * 3))
+    placeholder = imageutil.make_placeholder(noise)
+    assert placeholder.startswith("data:image/png;")
+    assert len(placeholder) <= imageutil.PLACEHOLDER_MAX_LENGTH
+
+def test_hamming_index_matches_brute_force():
+    from fortepan_us.kronofoto.models import HammingIndex, hamming_distance
+    import random
+    rng = random.Random(4)
+    hashes = [(id, rng.getrandbits(64)) for id in range(500)]
+    hashes += [(1000 + id, value ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64))) for id, value in hashes[:50]]
+    index = HammingIndex(hashes)
+    for distance in (0, 3, 6, 9):
+        for id, value in hashes[:60]:
+            expected = [(other, hamming_distance(value, v)) for other, v in hashes if hamming_distance(value, v) <= distance]
+            assert sorted(index.query(value, distance)) == sorted(expected)
+    assert sorted(index.groups(2)) == [[id, 1000 + id] for id in range(50)]
+
+@pytest.mark.django_db()
+def test_derivative_pipeline_stores_image_hash(a_photo, settings):
+    from fortepan_us.kronofoto.models import ImageHash
+    settings.KF_IMAGE_FORMATS = []
+    image = Image.radial_gradient("L").resize((1200, 800)).convert("RGB")
+    data = BytesIO()
+    image.save(data, "JPEG", quality=95)
+    name = default_storage.save("original/hashed.jpg", ContentFile(data.getvalue()))
+    pipeline = DerivativePipeline(id=a_photo.id, path=name, profiles=[(75, 75), (0, 700)])
+    pipeline.run()
+    pipeline.save_placeholder()
+    stored = ImageHash.objects.get(photo=a_photo)
+    rescan = BytesIO()
+    image.resize((600, 400)).save(rescan, "JPEG", quality=40)
+    rescan = Image.open(rescan)
+    assert ImageHash.objects.near(difference_hash(rescan), 6)[0][0] == a_photo.id
+    assert ImageHash.objects.near(difference_hash(Image.linear_gradient("L").resize((1200, 800))), 6) == []
+    assert stored.near_duplicates(6) == []
+
+@pytest.mark.django_db()
+def test_derivative_manifest(settings):
+    from fortepan_us.kronofoto.models import Derivative
+    from django.core.management import call_command
+    settings.KF_IMAGE_FORMATS = []
+    name = default_storage.save("original/manifest.jpg", ContentFile(jpeg(1000, 800).getvalue()))
+    cacher = DerivativePipeline(id=7, path=name, profiles=[(75, 75)]).cachers[0]
+    data = cacher.render()
+    entry = Derivative.objects.get(name=cacher.name)
+    assert (entry.size, entry.width, entry.height) == (len(data), 75, 75)
+    default_storage.delete(cacher.name)
+    assert cacher.stored().size == len(data)
+    call_command("reconcile_derivatives", stdout=StringIO())
+    assert not Derivative.objects.filter(name=cacher.name).exists()
+    assert cacher.stored() is None
+    cacher.render()
+    Derivative.objects.all().delete()
+    call_command("reconcile_derivatives", "--checksums", stdout=StringIO())
+    entry = Derivative.objects.get(name=cacher.name)
+    assert (entry.width, entry.height) == (75, 75)
+    assert len(entry.checksum) == 40
+
+@pytest.mark.django_db()
+def test_replaced_original_discards_derivatives(settings, a_category, an_archive):
+    settings.KF_IMAGE_FORMATS = ["webp"]
+    photo = Photo.objects.create(
+        original=SimpleUploadedFile("replaced.jpg", jpeg(300, 200).getvalue(), content_type="image/jpeg"),
+        archive=an_archive,
+        category=a_category,
+    )
+    pipeline = DerivativePipeline(id=photo.id, path=photo.original.name, profiles=[(75, 75)])
+    pipeline.run()
+    on_request = ImageSigner(id=photo.id, path=photo.original.name, width=120, height=0)
+    assert Client().get(on_request.url).status_code == 200
+    names = [cacher.name for cacher in pipeline.cachers] + [on_request.cacher.name]
+    assert all(default_storage.exists(name) for name in names)
+    photo.original = SimpleUploadedFile("replaced.jpg", jpeg(200, 300).getvalue(), content_type="image/jpeg")
+    photo.save()
+    assert not any(default_storage.exists(name) for name in names)
+    assert all(cacher.stored() is None for cacher in pipeline.cachers)
+
+@pytest.mark.django_db()
+def test_thumbnail_sprite(settings):
+    settings.KF_IMAGE_FORMATS = []
+    names = [default_storage.save("original/sprite.jpg", ContentFile(jpeg(300, 200).getvalue())) for _ in range(3)]
+    sprite = ThumbnailSprite(signers=[ImageSigner(id=id, path=name, width=75, height=75) for id, name in zip((3, 1, 2), names)])
+    assert sprite.offsets == {3: 0, 1: 75, 2: 150}
+    assert sprite.key != replace(sprite, signers=sprite.signers[::-1]).key
+    resp = Client().get(sprite.url)
+    assert resp.status_code == 200
+    assert Image.open(BytesIO(b"".join(resp))).size == (225, 75)
+    assert default_storage.exists(sprite.name)
+    assert Client().get(sprite.url.replace(sprite.key, "0" * 40)).status_code == 404
+
+@pytest.mark.django_db()
+def test_thumbnail_sprite_follows_replaced_original(settings, a_category, an_archive):
+    settings.KF_IMAGE_FORMATS = []
+    photo = Photo.objects.create(
+        original=SimpleUploadedFile("sprite.jpg", jpeg(300, 200).getvalue(), content_type="image/jpeg"),
+        archive=an_archive,
+        category=a_category,
+    )
+    Photo.objects.filter(id=photo.id).update(placeholder="data:image/webp;base64,AAAA")
+    photo.refresh_from_db()
+    sprite = ThumbnailSprite.for_photos([photo])
+    assert ThumbnailSprite.unsign(sprite.url.split("?i=")[1]).key == sprite.key
+    photo.original = SimpleUploadedFile("sprite.jpg", jpeg(300, 200).getvalue(), content_type="image/jpeg")
+    photo.save()
+    assert ThumbnailSprite.for_photos([photo]).key != sprite.key
+
+@pytest.mark.django_db()
+def test_tile_pyramid(settings):
+    from fortepan_us.kronofoto.views.iiif import parse_region, parse_size
+    settings.KF_IIIF_TILE_SIZE = 256
+    name = default_storage.save("original/pyramid.jpg", ContentFile(jpeg(600, 1000, orientation=6).getvalue()))
+    pyramid = TilePyramid(id=9, path=name, width=1000, height=600)
+    assert pyramid.scale_factors == [1, 2, 4]
+    assert pyramid.region((0, 0, 1000, 600), (500, 300)) is None
+    assert pyramid.build() == 4 * 3 + 2 * 2 + 1
+    assert pyramid.built()
+    tile = pyramid.tile((512, 512, 488, 88), (244, 44))
+    assert Image.open(BytesIO(tile.cached())).size == (244, 44)
+    assert pyramid.tile((500, 0, 256, 256), (256, 256)) is None
+    region = parse_region("100,100,800,800", 1000, 600)
+    assert region == (100, 100, 800, 500)
+    size = parse_size("400,", region[2], region[3])
+    assert Image.open(BytesIO(pyramid.region(region, size))).size == (400, 250)
+    with pytest.raises(ValueError):
+        parse_size("1600,", region[2], region[3])
+
+@pytest.mark.django_db()
+def test_iiif_image_serves_built_pyramids_only(a_photo, settings):
+    from django.urls import reverse
+    settings.KF_IIIF_TILE_SIZE = 256
+    Photo.objects.filter(id=a_photo.id).update(is_published=True)
+    url = reverse("kronofoto:iiif-image", kwargs={
+        "photo": a_photo.id, "region": "full", "size": "max", "rotation": "0", "quality": "default", "format": "jpg",
+    })
+    info = reverse("kronofoto:iiif-info", kwargs={"photo": a_photo.id})
+    assert Client().get(url).status_code == 404
+    assert Client().get(info).status_code == 404
+    width, height = a_photo.get_upright_dimensions()
+    TilePyramid(id=a_photo.id, path=a_photo.original.name, width=width, height=height).build()
+    assert Client().get(url).status_code == 200
+    assert Client().get(info).status_code == 200
+
+def test_negotiate_format(settings):
+    settings.KF_IMAGE_FORMATS = ["webp"]
+    assert negotiate_format("image/avif,image/webp,image/apng,image/*,*/*;q=0.8") == "webp"
+    assert negotiate_format("image/webp;q=0, */*") == "jpeg"
+    assert negotiate_format("*/*") == "jpeg"
+    assert negotiate_format("") == "jpeg"
+    settings.KF_IMAGE_FORMATS = []
+    assert negotiate_format("image/webp") == "jpeg"
+
+def test_encoder_options(settings):
+    settings.KF_IMAGE_ENCODERS = {"jpeg": {"quality": 60}}
+    settings.KF_IMAGE_PROFILE_ENCODERS = {(75, 75): {"jpeg": {"quality": 80, "progressive": True}}}
+    thumb = ImageCacher(block1=0, block2=0, path="original.jpg", sig="sig", width=75, height=75)
+    assert thumb.encoder_options == {"quality": 80, "progressive": True}
+    assert replace(thumb, width=500, height=500).encoder_options == {"quality": 60}
+    assert thumb.with_format("webp").name == "images/0/0/sig.webp"
+
+@pytest.mark.django_db()
+def test_signed_url_cache_matches_signer(a_photo):
+    signer = ImageSigner(id=a_photo.id, path=a_photo.original.name, width=75, height=75)
+    cache = SignedUrlCache(size=2)
+    assert cache.get(signer) == signer.sign_url()
+    assert cache.get(ImageSigner(id=a_photo.id, path=a_photo.original.name, width=75, height=75)) == signer.sign_url()
+    cache.get(ImageSigner(id=a_photo.id, path=a_photo.original.name, width=500, height=500))
+    cache.get(ImageSigner(id=a_photo.id, path=a_photo.original.name, width=0, height=700))
+    assert len(cache._urls) == 2
+
+@pytest.mark.django_db()
+def test_signed_url_cache_signs_each_profile_once(a_photo, monkeypatch):
+    profiles = [(75, 75)] * 48 + [(75, 75)] * 40 + [(0, 700)]
+    sign_url = Mock(side_effect=ImageSigner.sign_url)
+    monkeypatch.setattr(ImageSigner, "sign_url", lambda self: sign_url(self))
+    cache = SignedUrlCache(size=100)
+    for _ in range(3):
+        for width, height in profiles:
+            cache.get(ImageSigner(id=a_photo.id, path=a_photo.original.name, width=width, height=height))
+    assert sign_url.call_count == 2
+
+@pytest.mark.slow
+@pytest.mark.django_db()
+def test_signed_url_cache_benchmark(a_photo):
+    # Signing cost of one grid page, a carousel and the detail image. Run
+    # with `pytest -m slow -s` to see the numbers.
+    profiles = [(75, 75)] * 48 + [(75, 75)] * 40 + [(0, 700)]
+    def render(url):
+        start = time.perf_counter()
+        for width, height in profiles:
+            url(ImageSigner(id=a_photo.id, path=a_photo.original.name, width=width, height=height))
+        return time.perf_counter() - start
+    cache = SignedUrlCache(size=100)
+    uncached = min(render(lambda signer: signer.sign_url()) for _ in range(20))
+    cached = min(render(cache.get) for _ in range(20))
+    print("signing per request: {:.2f}ms uncached, {:.2f}ms cached".format(uncached * 1000, cached * 1000))
+
+@pytest.mark.django_db()
+def test_photo_captures_image_header_on_save(a_category, an_archive):
+    photo = Photo.objects.create(
+        original=SimpleUploadedFile("upload.jpg", jpeg(40, 30, orientation=6).getvalue(), content_type="image/jpeg"),
+        archive=an_archive,
+        category=a_category,
+    )
+    photo.refresh_from_db()
+    assert (photo.original_width, photo.original_height, photo.original_orientation) == (40, 30, 6)
+    Photo.objects.filter(id=photo.id).update(original_orientation=0)
+    photo.refresh_from_db()
+    with patch.object(photo.original.storage, "open", side_effect=AssertionError("read the original")):
+        assert photo.get_image_dimensions() == (40, 30)
+    assert photo.get_upright_dimensions() == (30, 40)
+
+@pytest.mark.django_db()
+def test_photo_reads_missing_dimensions_lazily(a_category, an_archive):
+    photo = Photo.objects.create(
+        original=SimpleUploadedFile("lazy.jpg", jpeg(40, 30, orientation=6).getvalue(), content_type="image/jpeg"),
+        archive=an_archive,
+        category=a_category,
+    )
+    Photo.objects.filter(id=photo.id).update(original_width=0, original_height=0, original_orientation=0)
+    photo.refresh_from_db()
+    assert photo.get_upright_dimensions() == (30, 40)
+    photo.refresh_from_db()
+    assert (photo.original_width, photo.original_height, photo.original_orientation) == (40, 30, 6)
+    Photo.objects.filter(id=photo.id).update(original_orientation=0)
+    photo.refresh_from_db()
+    with patch.object(photo.original.storage, "open", side_effect=AssertionError("read the original")):
+        assert photo.get_image_dimensions() == (40, 30)
+
+class FakeResponse:
+    def __init__(self, status_code, content=b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+def remote_cache(tmp_path, **kwargs):
+    options = dict(directory=str(tmp_path), max_bytes=1000, timeout=(1, 1), revalidate_after=0, failure_ttl=60)
+    options.update(kwargs)
+    return RemoteOriginalCache(**options)
+
+def test_remote_originals_revalidate_with_etag(tmp_path):
+    cache = remote_cache(tmp_path)
+    cache.session = Mock()
+    cache.session.get.return_value = FakeResponse(200, b"original", {"ETag": '"v1"'})
+    with cache.open("https://example.net/a.jpg") as infile:
+        assert infile.read() == b"original"
+    cache.session.get.return_value = FakeResponse(304)
+    with cache.open("https://example.net/a.jpg") as infile:
+        assert infile.read() == b"original"
+    assert cache.session.get.call_args.kwargs["headers"] == {"If-None-Match": '"v1"'}
+
+def test_remote_originals_size_limit(tmp_path):
+    cache = remote_cache(tmp_path, max_bytes=4)
+    cache.session = Mock()
+    cache.session.get.return_value = FakeResponse(200, b"too large")
+    with pytest.raises(RemoteImageError):
+        cache.open("https://example.net/a.jpg")
+    assert [path for path in tmp_path.rglob("*") if path.is_file() and path.suffix != ".json"] == []
+
+def test_remote_originals_remember_failures(tmp_path):
+    cache = remote_cache(tmp_path)
+    cache.session = Mock()
+    cache.session.get.return_value = FakeResponse(500)
+    for _ in range(3):
+        with pytest.raises(RemoteImageError):
+            cache.open("https://example.net/a.jpg")
+    assert cache.session.get.call_count == 1
+
+def test_remote_originals_evict_least_recently_used(tmp_path):
+    import os
+    cache = remote_cache(tmp_path, revalidate_after=3600, max_total_bytes=10)
+    cache.session = Mock()
+    for name, age in [("a", 300), ("b", 200)]:
+        cache.session.get.return_value = FakeResponse(200, b"1234")
+        cache.open("https://example.net/{}.jpg".format(name)).close()
+        data_path, _ = cache.paths("https://example.net/{}.jpg".format(name))
+        os.utime(data_path, (time.time() - age, time.time() - age))
+    cache.open("https://example.net/a.jpg").close()
+    cache.session.get.return_value = FakeResponse(200, b"1234")
+    cache.open("https://example.net/c.jpg").close()
+    assert [os.path.exists(cache.paths("https://example.net/{}.jpg".format(name))[0]) for name in "abc"] == [True, False, True]
+    assert not os.path.exists(cache.paths("https://example.net/b.jpg")[1])
@@ -151,3 +151,28 @@ def test_photosphere_response(view, object, domain, photo, nearby_mainstreets, n
     view.photosphere_pair = lambda id: Mock(**{"photosphere.get_absolute_url()": "https://www.example.com"})
     view.tourset = tourset
     view.response
+
+
+def test_panorama_tiles(settings):
+    from fortepan_us.kronofoto.imageutil import PanoramaTiles
+    from django.core.files.storage import default_storage
+    from django.core.files.base import ContentFile
+    from PIL import Image
+    from io import BytesIO
+    settings.KF_PHOTOSPHERE_TILE_SIZE = 128
+    settings.KF_PHOTOSPHERE_BASE_WIDTH = 256
+    data = BytesIO()
+    Image.new("RGB", (2000, 1000)).save(data, "JPEG")
+    name = default_storage.save("photosphere/tiles-test.jpg", ContentFile(data.getvalue()))
+    try:
+        tile_set = PanoramaTiles(name=name).build()
+        assert [(level["cols"], level["rows"], level["width"]) for level in tile_set["levels"]] == [(4, 2, 500), (8, 4, 1000), (16, 8, 2000)]
+        assert tile_set["levels"][0]["zoomRange"][0] == 0 and tile_set["levels"][-1]["zoomRange"][1] == 100
+        with default_storage.open("{}/2/15_7.jpg".format(tile_set["directory"])) as infile:
+            assert Image.open(infile).size == (125, 125)
+        view = ValidPhotoSphereView(pk=1, request=RequestFactory().get("/"))
+        view.object = PhotoSphere(id=1, tile_set=tile_set)
+        assert view.panorama["tileUrl"].endswith("/{level}/{col}_{row}.jpg")
+    finally:
+        default_storage.delete("{}_tiles".format(name.rsplit(".", 1)[0]))
+        default_storage.delete(name)
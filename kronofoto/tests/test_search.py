@@ -1,4 +1,4 @@
-from django.test import SimpleTestCase, tag
+from django.test import SimpleTestCase, tag, override_settings
 from django.db.models import Q
 from fortepan_us.kronofoto import models
 from django.contrib.auth.models import AnonymousUser
@@ -10,39 +10,43 @@ from fortepan_us.kronofoto.search.expression import (
     And, CollectionExpr, Maximum, Tag, Term, City, State, Country, County, Caption, Or, Not, Donor, YearEquals, YearLTE, YearGTE, Description, TagExactly, TermExactly, DonorExactly, SingleWordTag, MultiWordCaption, IsNew, IndexContains
 )
 from django.core.files.uploadedfile import SimpleUploadedFile
-from fortepan_us.kronofoto.models import Photo, Archive, Donor as DonorModel, Category, Tag as TagModel, PhotoTag, NewCutoff, Term as TermModel
+from fortepan_us.kronofoto.models import Photo, Archive, Donor as DonorModel, Category, Tag as TagModel, PhotoTag, NewCutoff, Term as TermModel, WordCount, IndexUpdate, IndexChange
 from .util import small_gif
+from unittest import mock
+from fortepan_us.kronofoto import signals
 import datetime
+import pytest
 
 class ExpressionTests(TestCase):
     def test_subquery_expression(self):
         expression = SingleWordTag("test")
-        archive = Archive.objects.create()
-        donor = DonorModel.objects.create(archive=archive)
-        category = Category.objects.create()
-        matchphoto = Photo.objects.create(
-            original=SimpleUploadedFile('small.gif', small_gif, content_type='image/gif'),
-            archive=archive,
-            donor=donor,
-            category=category,
-        )
-        testtag = TagModel.objects.create(tag="test")
-        PhotoTag.objects.create(tag=testtag, accepted=True, photo=matchphoto)
-        PhotoTag.objects.create(tag=TagModel.objects.create(tag="car"), accepted=True, photo=matchphoto)
-        matchphoto2 = Photo.objects.create(
-            original=SimpleUploadedFile('small.gif', small_gif, content_type='image/gif'),
-            archive=archive,
-            donor=donor,
-            category=category,
-        )
-        PhotoTag.objects.create(tag=testtag, accepted=True, photo=matchphoto2)
-        photo = Photo.objects.create(
-            original=SimpleUploadedFile('small.gif', small_gif, content_type='image/gif'),
-            archive=archive,
-            donor=donor,
-            category=category,
-        )
-        PhotoTag.objects.create(tag=TagModel.objects.create(tag="other"), accepted=True, photo=photo)
+        with self.captureOnCommitCallbacks(execute=True):
+            archive = Archive.objects.create()
+            donor = DonorModel.objects.create(archive=archive)
+            category = Category.objects.create()
+            matchphoto = Photo.objects.create(
+                original=SimpleUploadedFile('small.gif', small_gif, content_type='image/gif'),
+                archive=archive,
+                donor=donor,
+                category=category,
+            )
+            testtag = TagModel.objects.create(tag="test")
+            PhotoTag.objects.create(tag=testtag, accepted=True, photo=matchphoto)
+            PhotoTag.objects.create(tag=TagModel.objects.create(tag="car"), accepted=True, photo=matchphoto)
+            matchphoto2 = Photo.objects.create(
+                original=SimpleUploadedFile('small.gif', small_gif, content_type='image/gif'),
+                archive=archive,
+                donor=donor,
+                category=category,
+            )
+            PhotoTag.objects.create(tag=testtag, accepted=True, photo=matchphoto2)
+            photo = Photo.objects.create(
+                original=SimpleUploadedFile('small.gif', small_gif, content_type='image/gif'),
+                archive=archive,
+                donor=donor,
+                category=category,
+            )
+            PhotoTag.objects.create(tag=TagModel.objects.create(tag="other"), accepted=True, photo=photo)
         photos = expression.as_collection(Photo.objects.all(), user=AnonymousUser())
         self.assertIn(matchphoto, photos)
         self.assertIn(matchphoto2, photos)
@@ -52,30 +56,31 @@ class ExpressionTests(TestCase):
 
     def test_multiword_caption(self):
         expression = MultiWordCaption("a comment")
-        archive = Archive.objects.create()
-        donor = DonorModel.objects.create(archive=archive)
-        category = Category.objects.create()
-        matchphoto = Photo.objects.create(
-            original=SimpleUploadedFile('small.gif', small_gif, content_type='image/gif'),
-            archive=archive,
-            donor=donor,
-            category=category,
-            caption="this is a comment",
-        )
-        matchphoto2 = Photo.objects.create(
-            original=SimpleUploadedFile('small.gif', small_gif, content_type='image/gif'),
-            archive=archive,
-            donor=donor,
-            category=category,
-            caption="this is a comment and some other text",
-        )
-        photo = Photo.objects.create(
-            original=SimpleUploadedFile('small.gif', small_gif, content_type='image/gif'),
-            archive=archive,
-            donor=donor,
-            category=category,
-            caption="this is a car",
-        )
+        with self.captureOnCommitCallbacks(execute=True):
+            archive = Archive.objects.create()
+            donor = DonorModel.objects.create(archive=archive)
+            category = Category.objects.create()
+            matchphoto = Photo.objects.create(
+                original=SimpleUploadedFile('small.gif', small_gif, content_type='image/gif'),
+                archive=archive,
+                donor=donor,
+                category=category,
+                caption="this is a comment",
+            )
+            matchphoto2 = Photo.objects.create(
+                original=SimpleUploadedFile('small.gif', small_gif, content_type='image/gif'),
+                archive=archive,
+                donor=donor,
+                category=category,
+                caption="this is a comment and some other text",
+            )
+            photo = Photo.objects.create(
+                original=SimpleUploadedFile('small.gif', small_gif, content_type='image/gif'),
+                archive=archive,
+                donor=donor,
+                category=category,
+                caption="this is a car",
+            )
         photos = expression.as_search(Photo.objects.all(), user=AnonymousUser())
         self.assertEqual(2, photos.count())
         self.assertEqual(matchphoto.id, photos[0].id)
@@ -453,10 +458,269 @@ class ExpressionTest(SimpleTestCase):
 
 
 @tag("fast")
+class FullTextQueryTest(SimpleTestCase):
+    def testCompilesWordSearchesToOneTsquery(self):
+        from fortepan_us.kronofoto.search.fulltext import FullTextQuery
+        expr = And(Caption("Main Street"), Or(Tag("car"), Not(Term("o'brien"))))
+        self.assertEqual(
+            FullTextQuery().tsquery(expr),
+            "('main':A <-> 'street':A) & (('car':B) | (!('o':C <-> 'brien':C)))",
+        )
+
+    def testKeepsOtherExpressions(self):
+        from fortepan_us.kronofoto.search.fulltext import FullTextQuery
+        expr = And(Caption("car"), YearEquals(1950))
+        self.assertIsNone(FullTextQuery().tsquery(expr))
+        q = FullTextQuery().filter(expr)
+        self.assertIn(('year', 1950), q.children)
+        self.assertEqual(q.children[0][0], 'search_text')
+
+class IndexQueryTest(SimpleTestCase):
+    def index(self):
+        from fortepan_us.kronofoto.search.memory import InvertedIndex, Postings
+        index = InvertedIndex()
+        for key, rows in {("TA", "car"): [(1, 1.0), (2, 0.5)], ("CA", "car"): [(2, 0.25), (3, 1.0)]}.items():
+            postings = index.postings[key] = Postings()
+            for id, weight in rows:
+                postings.add(id, weight)
+        index.photo_ids = {1, 2, 3, 4}
+        index.loaded_at = 0
+        return index
+
+    def testCombinesPostings(self):
+        from fortepan_us.kronofoto.search.memory import IndexQuery
+        query = IndexQuery(index=self.index())
+        expr = And(Tag("car"), Not(Caption("car")))
+        self.assertEqual(query.matches(expr), {1})
+        self.assertEqual(query.score(expr, False, 1), 1.0)
+        self.assertEqual(query.score(Or(Tag("car"), Caption("car")), False, 2), 0.75)
+
+    def testOverlayReplacesStalePostings(self):
+        index = self.index()
+        index.stale = {2}
+        index.overlay[("TA", "car")] = {4: 2.0}
+        self.assertEqual(index.lookup(("TA", "car")), {1: 1.0, 4: 2.0})
+
+    def testLeavesMultiWordSearchesToSql(self):
+        from fortepan_us.kronofoto.search.memory import IndexQuery
+        query = IndexQuery(index=self.index())
+        self.assertTrue(query.supported(Or(Tag("car"), Not(Caption("car")))))
+        self.assertFalse(query.supported(And(Tag("car"), Caption("main street"))))
+
+class IndexUpdateTest(TestCase):
+    def photo(self, **kwargs):
+        return Photo.objects.create(
+            original=SimpleUploadedFile('small.gif', small_gif, content_type='image/gif'),
+            archive=Archive.objects.create(),
+            category=Category.objects.create(),
+            **kwargs,
+        )
+
+    def testCoalescesUpdatesUntilCommit(self):
+        from fortepan_us.kronofoto import indexing
+        with mock.patch.object(indexing, "reindex", wraps=indexing.reindex) as reindex:
+            with self.captureOnCommitCallbacks(execute=True):
+                photo = self.photo(caption="a parade")
+                PhotoTag.objects.create(tag=TagModel.objects.create(tag="main street"), accepted=True, photo=photo)
+                photo.caption = "the parade"
+                photo.save()
+                self.assertFalse(WordCount.objects.filter(photo=photo).exists())
+        reindex.assert_called_once_with({photo.id: {"CA", "PL", "TA"}})
+        self.assertEqual(
+            set(WordCount.objects.filter(photo=photo).values_list("field", "word")),
+            {("CA", "the"), ("CA", "parade"), ("TA", "main"), ("TA", "street")},
+        )
+
+    def testSkipsUnindexedFields(self):
+        from fortepan_us.kronofoto import indexing
+        with self.captureOnCommitCallbacks(execute=True):
+            photo = self.photo(caption="a parade")
+        with mock.patch.object(indexing, "reindex") as reindex:
+            with self.captureOnCommitCallbacks(execute=True):
+                photo.is_featured = True
+                photo.save()
+                photo.save(update_fields=["caption"])
+        reindex.assert_not_called()
+
+    def testLoadsOldValuesOnce(self):
+        photo = self.photo(caption="a parade")
+        photo.caption = "a fire"
+        with self.assertNumQueries(1):
+            signals.photo_forget_old_values(sender=Photo, instance=photo)
+            signals.photo_map_tiles(sender=Photo, instance=photo, raw=False, update_fields=None)
+            signals.photo_index_fields(sender=Photo, instance=photo, raw=False, update_fields=None)
+        self.assertEqual(photo._index_fields, {"CA"})
+
+    def testDrainsQueue(self):
+        from fortepan_us.kronofoto import indexing
+        photo = self.photo(caption="a parade")
+        with override_settings(KF_SEARCH_INDEX_UPDATES="queue"):
+            photo.caption = "a fire"
+            photo.save()
+            photo.caption = "a fire truck"
+            photo.save()
+        self.assertEqual(IndexUpdate.objects.count(), 2)
+        self.assertEqual(indexing.drain(10), 2)
+        self.assertFalse(IndexUpdate.objects.exists())
+        self.assertEqual(set(WordCount.objects.filter(photo=photo).values_list("word", flat=True)), {"a", "fire", "truck"})
+
+@override_settings(KF_SEARCH_RESULT_CACHE="default")
+class SearchResultsTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def testPagesAreSlicesOfCachedIds(self):
+        from fortepan_us.kronofoto.search.results import SearchResults, cache_key
+        key = cache_key(Tag("car"), archive=None, category=None, user=AnonymousUser())
+        queryset = mock.Mock()
+        queryset.values_list.return_value = [5, 3, 9]
+        results = SearchResults(queryset=queryset, key=key)
+        self.assertEqual(results.count(), 3)
+        results[1:3]
+        self.assertEqual(queryset.filter.call_args.kwargs, {"id__in": [3, 9]})
+        cached = SearchResults(queryset=mock.Mock(), key=key)
+        self.assertEqual(list(cached.ids), [5, 3, 9])
+        cached.queryset.values_list.assert_not_called()
+
+    def testIndexChangesInvalidate(self):
+        from fortepan_us.kronofoto.search.results import cache_key, invalidate
+        key = cache_key(Tag("car"), archive=None, category=None, user=AnonymousUser())
+        self.assertEqual(key, cache_key(Tag("car"), archive=None, category=None, user=AnonymousUser()))
+        self.assertNotEqual(key, cache_key(Tag("car"), archive="an-archive", category=None, user=AnonymousUser()))
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidate()
+        self.assertNotEqual(key, cache_key(Tag("car"), archive=None, category=None, user=AnonymousUser()))
+
+    def testOnlyVisibilityChangesInvalidate(self):
+        from fortepan_us.kronofoto.search.results import cache_key
+        def key():
+            return cache_key(Tag("car"), archive=None, category=None, user=AnonymousUser())
+        with self.captureOnCommitCallbacks(execute=True):
+            photo = Photo.objects.create(
+                original=SimpleUploadedFile('small.gif', small_gif, content_type='image/gif'),
+                archive=Archive.objects.create(),
+                category=Category.objects.create(),
+                is_published=False,
+            )
+        before = key()
+        with self.captureOnCommitCallbacks(execute=True):
+            photo.circa = True
+            photo.save()
+        self.assertEqual(key(), before)
+        with self.captureOnCommitCallbacks(execute=True):
+            photo.is_published = True
+            photo.save()
+        self.assertNotEqual(key(), before)
+
 class DescriptionTest(SimpleTestCase):
     def testHasLongDescription(self):
         self.assertEqual(str(Description([Term("dog"), Term("Farm"), YearEquals(1912)])), "from 1912; and termed with dog and farm")
         self.assertEqual(str(Description([YearLTE(1920), YearGTE(1910)])), "between 1910 and 1920")
         self.assertEqual(str(Description([Term("dog"), YearLTE(1920), YearGTE(1910)])), "between 1910 and 1920; and termed with dog")
 
-
+@pytest.mark.django_db()
+def test_index_updates_wait_for_commit(django_capture_on_commit_callbacks):
+    archive = Archive.objects.create()
+    category = Category.objects.create()
+    with django_capture_on_commit_callbacks(execute=True):
+        photo = Photo.objects.create(
+            original=SimpleUploadedFile('small.gif', small_gif, content_type='image/gif'),
+            archive=archive,
+            category=category,
+            caption="main street parade",
+        )
+        PhotoTag.objects.create(tag=TagModel.objects.create(tag="car"), accepted=True, photo=photo)
+        assert photo not in Caption("parade").as_search(Photo.objects.all(), user=AnonymousUser())
+    assert photo in Caption("parade").as_search(Photo.objects.all(), user=AnonymousUser())
+    assert photo in Tag("car").as_search(Photo.objects.all(), user=AnonymousUser())
+
+@pytest.mark.django_db
+@override_settings(KF_SEARCH_BACKEND="memory")
+def test_index_sync_sees_deleted_rows():
+    from fortepan_us.kronofoto.indexing import reindex
+    from fortepan_us.kronofoto.search.memory import InvertedIndex
+    photo = Photo.objects.create(
+        original=SimpleUploadedFile('small.gif', small_gif, content_type='image/gif'),
+        archive=Archive.objects.create(),
+        category=Category.objects.create(),
+        caption="parade",
+    )
+    reindex({photo.id: {"CA"}})
+    index = InvertedIndex()
+    index.loaded_at = 0
+    index.refresh([photo.id])
+    index.last_change = IndexChange.objects.latest("id").id
+    assert index.lookup(("CA", "parade")) == {photo.id: 1.0}
+    Photo.objects.filter(id=photo.id).update(caption="")
+    reindex({photo.id: {"CA"}})
+    assert not WordCount.objects.filter(photo=photo).exists()
+    index.sync()
+    assert index.lookup(("CA", "parade")) == {}
+
+def index_rows(model, photos):
+    from fortepan_us.kronofoto.indexing import FIELDS, word_counts
+    rows, _ = word_counts({photo.id: set(FIELDS) for photo in photos})
+    model.objects.bulk_create([
+        model(photo_id=id, field=field, word=word, count=count) for (id, field, word, count) in rows
+    ])
+
+@pytest.mark.django_db(transaction=True)
+def test_shadow_table_swap():
+    from fortepan_us.kronofoto.shadow import ShadowTable
+    from django.db import connection
+    archive = Archive.objects.create()
+    category = Category.objects.create()
+    photos = [
+        Photo.objects.create(
+            original=SimpleUploadedFile('small.gif', small_gif, content_type='image/gif'),
+            archive=archive,
+            category=category,
+            caption=caption,
+        )
+        for caption in ("a parade", "a fire")
+    ]
+    expected = set(WordCount.objects.values_list("photo_id", "field", "word"))
+    shadow = ShadowTable.create(WordCount, "photo_id")
+    assert shadow.table in connection.introspection.table_names()
+    assert not shadow.copy.objects.exists()
+    index_rows(shadow.copy, photos)
+    rebuilt = []
+    shadow.swap(rebuilt.append)
+    assert rebuilt == []
+    assert set(WordCount.objects.values_list("photo_id", "field", "word")) == expected
+    assert not any(table.startswith(shadow.table) for table in connection.introspection.table_names())
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, WordCount._meta.db_table)
+    assert any(constraint["foreign_key"] for constraint in constraints.values())
+
+@pytest.mark.django_db(transaction=True)
+def test_shadow_table_carries_over_concurrent_changes():
+    from fortepan_us.kronofoto.shadow import ShadowTable
+    from fortepan_us.kronofoto.indexing import FIELDS, reindex
+    archive = Archive.objects.create()
+    category = Category.objects.create()
+    def photo(caption):
+        return Photo.objects.create(
+            original=SimpleUploadedFile('small.gif', small_gif, content_type='image/gif'),
+            archive=archive,
+            category=category,
+            caption=caption,
+        )
+    deleted, emptied, kept = photo("a parade"), photo("a fire"), photo("a flood")
+    shadow = ShadowTable.create(WordCount, "photo_id")
+    index_rows(shadow.copy, [deleted, emptied, kept])
+    inserted = photo("a storm")
+    deleted_id = deleted.id
+    deleted.delete()
+    emptied.caption = ""
+    emptied.save()
+    rebuilt = set()
+    def rebuild(photo_ids):
+        rebuilt.update(photo_ids)
+        reindex({id: set(FIELDS) for id in photo_ids})
+    shadow.swap(rebuild)
+    assert rebuilt == {deleted_id, emptied.id, inserted.id}
+    assert set(WordCount.objects.values_list("photo_id", "word")) == {
+        (kept.id, "a"), (kept.id, "flood"), (inserted.id, "a"), (inserted.id, "storm"),
+    }
@@ -1,9 +1,13 @@
 from __future__ import annotations
 from django.test import TestCase
 from hypothesis import given, strategies as st, settings as hsettings
-from fortepan_us.kronofoto.views.vector_tiles import PhotoSphereTile
+from fortepan_us.kronofoto.views.vector_tiles import PhotoSphereTile, PhotoMapTile
 from django.contrib.gis.geos import Point, Polygon
-from fortepan_us.kronofoto.models import PhotoSphere, MainStreetSet, PhotoSphereTour
+from fortepan_us.kronofoto.models import PhotoSphere, MainStreetSet, PhotoSphereTour, MapTile, Archive, Category, Photo
+from fortepan_us.kronofoto.models.maptile import covering_tiles
+from django.core.files.uploadedfile import SimpleUploadedFile
+from .util import small_gif
+import mercantile
 from dataclasses import dataclass
 import pytest
 
@@ -92,3 +96,91 @@ def test_layers(pst):
 def test_bounds(pst):
     pst.bounds
     pst.bbox
+
+@hsettings(max_examples=50)
+@given(
+    lng=st.floats(min_value=-179, max_value=179),
+    lat=st.floats(min_value=-85, max_value=85),
+    zoom=st.integers(min_value=0, max_value=16),
+)
+def test_covering_tiles_contain_point(lng, lat, zoom):
+    tiles = covering_tiles(Point(lng, lat), zoom)
+    assert {z for (z, x, y) in tiles} == set(range(zoom + 1))
+    for (z, x, y) in tiles:
+        bounds = mercantile.bounds(x, y, z)
+        assert bounds.west - 1e-6 <= lng <= bounds.east + 1e-6
+        assert bounds.south - 1e-6 <= lat <= bounds.north + 1e-6
+
+class TestMapTileStore(TestCase):
+    def test_invalidate(self):
+        tile = mercantile.tile(-93.6, 41.6, 10)
+        MapTile.objects.create(scope="", zoom=10, x=tile.x, y=tile.y, data=b"inside")
+        MapTile.objects.create(scope="category=photos", zoom=10, x=tile.x, y=tile.y, data=b"inside")
+        MapTile.objects.create(scope="", zoom=10, x=tile.x + 1, y=tile.y, data=b"outside")
+        assert MapTile.objects.invalidate([Point(-93.6, 41.6), None], 12) == 2
+        assert list(MapTile.objects.values_list("data", flat=True)) == [b"outside"]
+
+    def test_get_or_render(self):
+        rendered = []
+        def render():
+            rendered.append(1)
+            return b"tile"
+        assert MapTile.objects.get_or_render(scope="", zoom=1, x=0, y=0, render=render) == b"tile"
+        assert MapTile.objects.get_or_render(scope="", zoom=1, x=0, y=0, render=render) == b"tile"
+        assert len(rendered) == 1
+
+    def test_photo_save_invalidates(self):
+        archive = Archive.objects.create(slug="an-archive")
+        category = Category.objects.create(slug="photos")
+        tile = mercantile.tile(-93.6, 41.6, 5)
+        MapTile.objects.create(scope="", zoom=5, x=tile.x, y=tile.y, data=b"stale")
+        with self.captureOnCommitCallbacks(execute=True):
+            photo = Photo.objects.create(
+                archive=archive,
+                category=category,
+                original=SimpleUploadedFile("small.gif", small_gif, content_type="image/gif"),
+                location_point=Point(-93.6, 41.6),
+                is_published=True,
+                year=1950,
+            )
+        assert not MapTile.objects.exists()
+        MapTile.objects.create(scope="", zoom=5, x=tile.x, y=tile.y, data=b"fresh")
+        with self.captureOnCommitCallbacks(execute=True):
+            photo.caption = "unrelated"
+            photo.save()
+        assert MapTile.objects.exists()
+
+class TestPhotoClustering(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        archive = Archive.objects.create(slug="an-archive")
+        category = Category.objects.create(slug="photos")
+        for i, (lng, lat) in enumerate([(-93.6, 41.6), (-93.61, 41.61), (-93.6, 41.6), (-100.0, 45.0), (-80.0, 30.0)]):
+            Photo.objects.create(
+                archive=archive,
+                category=category,
+                original=SimpleUploadedFile("small.gif", small_gif, content_type="image/gif"),
+                location_point=Point(lng, lat),
+                is_published=True,
+                year=1950 + i,
+            )
+
+    def features(self, sql_clustering):
+        from django.http import QueryDict
+        with self.settings(KF_MAP_TILE_SQL_CLUSTERING=sql_clustering):
+            tile = mercantile.tile(-93.6, 41.6, 4)
+            return PhotoMapTile(
+                queryset=Photo.objects.filter(is_published=True, year__isnull=False).order_by("year", "id"),
+                url_kwargs={},
+                get_params=QueryDict(),
+                zoom=4,
+                x=tile.x,
+                y=tile.y,
+            ).layers[0]["features"]
+
+    def test_sql_clustering_matches_python_binning(self):
+        clustered = self.features(True)
+        binned = self.features(False)
+        key = lambda feature: (feature["geometry"], feature["properties"]["id"], feature["properties"]["count"])
+        assert sorted(map(key, clustered)) == sorted(map(key, binned))
+        assert sum(feature["properties"]["count"] for feature in clustered) == 4